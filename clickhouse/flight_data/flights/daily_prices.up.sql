@@ -0,0 +1,37 @@
+-- Cheapest, dearest and last price of every flight per scrape day, what the dashboards plot, kept up to date from the
+-- inserts into `flights`, from the Kafka queue or the `clickhouse` sink of the scrapers. Keep in sync with `migrations`
+CREATE TABLE IF NOT EXISTS flight_data.daily_prices
+(
+    source LowCardinality(String),
+    destination LowCardinality(String),
+    currency LowCardinality(String),
+    company LowCardinality(String),
+    flight_date DateTime CODEC(Delta, ZSTD(1)),
+    scrape_date Date CODEC(Delta, ZSTD(1)),
+    min_price SimpleAggregateFunction(min, Float32),
+    max_price SimpleAggregateFunction(max, Float32),
+    -- Comparable between airlines and currencies, unset for fares without a rate
+    min_price_eur SimpleAggregateFunction(min, Nullable(Float32)),
+    max_price_eur SimpleAggregateFunction(max, Nullable(Float32)),
+    -- Price of the latest insert, rows rebuilt from `flights` rank by their scrape day only
+    last_price AggregateFunction(argMax, Float32, DateTime64(3))
+)
+ENGINE = AggregatingMergeTree
+PARTITION BY toYYYYMM(scrape_date)
+ORDER BY (source, destination, currency, scrape_date, flight_date, company);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS flight_data.daily_prices_mv TO flight_data.daily_prices AS
+SELECT
+    source,
+    destination,
+    currency,
+    company,
+    flight_date,
+    scrape_date,
+    min(price) AS min_price,
+    max(price) AS max_price,
+    min(price_eur) AS min_price_eur,
+    max(price_eur) AS max_price_eur,
+    argMaxState(price, now64(3)) AS last_price
+FROM flight_data.flights
+GROUP BY source, destination, currency, company, flight_date, scrape_date;
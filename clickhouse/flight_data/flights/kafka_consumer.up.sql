@@ -1,9 +1,12 @@
+-- Template rendered by `pipeline.up.yml`: `kafka_consumers` consumers read the partitions of the topic, each one in
+-- its own thread inserting its own blocks, as many as the partitions up to the number of cores of the server
 CREATE TABLE IF NOT EXISTS flight_data.kafka_queue
 (
     flight_date DateTime,
     source String,
     destination String,
     price Float32,
+    price_eur Nullable(Float32),
     currency String,
     company String,
     scrape_date Date
@@ -14,8 +17,8 @@ settings
     kafka_topic_list = 'flights',
     kafka_group_name = 'clickhouse',
     kafka_format = 'JSONEachRow',
-    kafka_thread_per_consumer = 0,
-    kafka_num_consumers = 1,
+    kafka_thread_per_consumer = 1,
+    kafka_num_consumers = {{ kafka_consumers }},
     kafka_handle_error_mode = 'stream';
 
 CREATE MATERIALIZED VIEW IF NOT EXISTS  flight_data.kafka_queue_mv TO flight_data.flights AS
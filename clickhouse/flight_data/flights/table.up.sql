@@ -1,12 +1,19 @@
+-- Sorted by route first, the dashboards look a route up, then its scrapes and its flights.
+-- Keep in sync with `migrations`, which move existing tables to this layout
 CREATE TABLE IF NOT EXISTS flight_data.flights
 (
-    flight_date DateTime,
-    source String,
-    destination String,
-    price Float32,
-    currency String,
-    company String,
-    scrape_date Date,
-    PRIMARY KEY(flight_date, company)
+    flight_date DateTime CODEC(Delta, ZSTD(1)),
+    source LowCardinality(String),
+    destination LowCardinality(String),
+    price Float32 CODEC(ZSTD(1)),
+    -- Set by the scrapers, rows ingested before only have the price of their euro fares
+    price_eur Nullable(Float32) DEFAULT if(currency = 'EUR', price, NULL) CODEC(ZSTD(1)),
+    currency LowCardinality(String),
+    company LowCardinality(String),
+    scrape_date Date CODEC(Delta, ZSTD(1)),
+    -- Skips the granules of other scrape dates in queries by scrape date over all the routes
+    INDEX scrape_date_minmax scrape_date TYPE minmax GRANULARITY 1
 )
-ENGINE = MergeTree;
+ENGINE = MergeTree
+PARTITION BY toYYYYMM(scrape_date)
+ORDER BY (source, destination, scrape_date, flight_date, company);
@@ -0,0 +1,4 @@
+-- Tables created by `flights/table.up.sql` already have the layout
+SELECT sorting_key = 'source, destination, scrape_date, flight_date, company'
+FROM system.tables
+WHERE database = 'flight_data' AND name = 'flights';
@@ -0,0 +1,3 @@
+-- Gives up on the migration before its swap, `flights` was never touched
+DROP VIEW IF EXISTS flight_data.kafka_queue_mv_next;
+DROP TABLE IF EXISTS flight_data.flights_next;
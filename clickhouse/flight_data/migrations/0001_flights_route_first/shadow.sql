@@ -0,0 +1,19 @@
+-- The layout of `flights/table.up.sql`, filled with the rows of the Kafka queue from now on
+CREATE TABLE IF NOT EXISTS flight_data.flights_next
+(
+    flight_date DateTime CODEC(Delta, ZSTD(1)),
+    source LowCardinality(String),
+    destination LowCardinality(String),
+    price Float32 CODEC(ZSTD(1)),
+    currency LowCardinality(String),
+    company LowCardinality(String),
+    scrape_date Date CODEC(Delta, ZSTD(1)),
+    INDEX scrape_date_minmax scrape_date TYPE minmax GRANULARITY 1
+)
+ENGINE = MergeTree
+PARTITION BY toYYYYMM(scrape_date)
+ORDER BY (source, destination, scrape_date, flight_date, company);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS flight_data.kafka_queue_mv_next TO flight_data.flights_next AS
+SELECT *
+FROM flight_data.kafka_queue;
@@ -0,0 +1,11 @@
+-- The Kafka queue is not consumed without views, its rows wait in Kafka until the view is created again
+DROP VIEW IF EXISTS flight_data.kafka_queue_mv;
+DROP VIEW IF EXISTS flight_data.kafka_queue_mv_next;
+
+-- Atomic, queries always find a `flights` table
+EXCHANGE TABLES flight_data.flights AND flight_data.flights_next;
+RENAME TABLE flight_data.flights_next TO flight_data.flights_previous;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS flight_data.kafka_queue_mv TO flight_data.flights AS
+SELECT *
+FROM flight_data.kafka_queue;
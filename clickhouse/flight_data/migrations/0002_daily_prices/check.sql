@@ -0,0 +1,4 @@
+-- Created by `flights/daily_prices.up.sql` on fresh deployments
+SELECT count() = 1
+FROM system.tables
+WHERE database = 'flight_data' AND name = 'daily_prices';
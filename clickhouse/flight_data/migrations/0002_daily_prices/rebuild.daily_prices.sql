@@ -0,0 +1,16 @@
+-- Aggregates the rows of `flights` matching {condition} into {table}. Min, max and argMax are the same when a row is
+-- counted twice, so the rows also inserted by the view while rebuilding do not change the result
+INSERT INTO {table}
+SELECT
+    source,
+    destination,
+    currency,
+    company,
+    flight_date,
+    scrape_date,
+    min(price),
+    max(price),
+    argMaxState(price, toDateTime64(scrape_date, 3))
+FROM flight_data.flights
+WHERE {condition}
+GROUP BY source, destination, currency, company, flight_date, scrape_date;
@@ -0,0 +1,31 @@
+-- Rollup of `flights/daily_prices.up.sql`, filled with the scrapes before it by `rebuild.daily_prices.sql`
+CREATE TABLE IF NOT EXISTS flight_data.daily_prices
+(
+    source LowCardinality(String),
+    destination LowCardinality(String),
+    currency LowCardinality(String),
+    company LowCardinality(String),
+    flight_date DateTime CODEC(Delta, ZSTD(1)),
+    scrape_date Date CODEC(Delta, ZSTD(1)),
+    min_price SimpleAggregateFunction(min, Float32),
+    max_price SimpleAggregateFunction(max, Float32),
+    -- Price of the latest insert, rows rebuilt from `flights` rank by their scrape day only
+    last_price AggregateFunction(argMax, Float32, DateTime64(3))
+)
+ENGINE = AggregatingMergeTree
+PARTITION BY toYYYYMM(scrape_date)
+ORDER BY (source, destination, currency, scrape_date, flight_date, company);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS flight_data.daily_prices_mv TO flight_data.daily_prices AS
+SELECT
+    source,
+    destination,
+    currency,
+    company,
+    flight_date,
+    scrape_date,
+    min(price) AS min_price,
+    max(price) AS max_price,
+    argMaxState(price, now64(3)) AS last_price
+FROM flight_data.kafka_queue
+GROUP BY source, destination, currency, company, flight_date, scrape_date;
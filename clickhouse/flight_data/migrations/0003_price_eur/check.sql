@@ -0,0 +1,10 @@
+-- Created by the `flights` files on fresh deployments
+SELECT count() = 4
+FROM system.columns
+WHERE database = 'flight_data'
+    AND (table, name) IN (
+        ('flights', 'price_eur'),
+        ('kafka_queue', 'price_eur'),
+        ('daily_prices', 'min_price_eur'),
+        ('daily_prices', 'max_price_eur')
+    );
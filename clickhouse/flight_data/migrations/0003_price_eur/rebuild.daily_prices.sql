@@ -0,0 +1,20 @@
+-- Aggregates the rows of `flights` matching {condition} into {table}, see `0002_daily_prices`
+INSERT INTO {table} (
+    source, destination, currency, company, flight_date, scrape_date,
+    min_price, max_price, min_price_eur, max_price_eur, last_price
+)
+SELECT
+    source,
+    destination,
+    currency,
+    company,
+    flight_date,
+    scrape_date,
+    min(price),
+    max(price),
+    min(price_eur),
+    max(price_eur),
+    argMaxState(price, toDateTime64(scrape_date, 3))
+FROM flight_data.flights
+WHERE {condition}
+GROUP BY source, destination, currency, company, flight_date, scrape_date;
@@ -0,0 +1,58 @@
+-- Euro prices set by the scrapers, see `flights/table.up.sql`. The rollup is filled again by
+-- `rebuild.daily_prices.sql`, with the euro prices of the rows ingested before
+ALTER TABLE flight_data.flights
+    ADD COLUMN IF NOT EXISTS price_eur Nullable(Float32) DEFAULT if(currency = 'EUR', price, NULL) CODEC(ZSTD(1))
+    AFTER price;
+
+ALTER TABLE flight_data.daily_prices
+    ADD COLUMN IF NOT EXISTS min_price_eur SimpleAggregateFunction(min, Nullable(Float32)) AFTER max_price,
+    ADD COLUMN IF NOT EXISTS max_price_eur SimpleAggregateFunction(max, Nullable(Float32)) AFTER min_price_eur;
+
+-- The columns of a Kafka table cannot be altered, the queue is created again with the consumers it had. Its consumer
+-- group keeps the offsets, the new queue resumes where the previous one stopped
+DROP VIEW IF EXISTS flight_data.kafka_queue_mv;
+
+DROP VIEW IF EXISTS flight_data.daily_prices_mv;
+
+DROP TABLE IF EXISTS flight_data.kafka_queue;
+
+CREATE TABLE flight_data.kafka_queue
+(
+    flight_date DateTime,
+    source String,
+    destination String,
+    price Float32,
+    price_eur Nullable(Float32),
+    currency String,
+    company String,
+    scrape_date Date
+)
+ENGINE = Kafka()
+settings
+    kafka_broker_list  = 'kafka:9092',
+    kafka_topic_list = 'flights',
+    kafka_group_name = 'clickhouse',
+    kafka_format = 'JSONEachRow',
+    kafka_thread_per_consumer = 1,
+    kafka_num_consumers = {{ kafka_consumers }},
+    kafka_handle_error_mode = 'stream';
+
+CREATE MATERIALIZED VIEW flight_data.kafka_queue_mv TO flight_data.flights AS
+SELECT *
+FROM flight_data.kafka_queue;
+
+CREATE MATERIALIZED VIEW flight_data.daily_prices_mv TO flight_data.daily_prices AS
+SELECT
+    source,
+    destination,
+    currency,
+    company,
+    flight_date,
+    scrape_date,
+    min(price) AS min_price,
+    max(price) AS max_price,
+    min(price_eur) AS min_price_eur,
+    max(price_eur) AS max_price_eur,
+    argMaxState(price, now64(3)) AS last_price
+FROM flight_data.kafka_queue
+GROUP BY source, destination, currency, company, flight_date, scrape_date;
@@ -0,0 +1,6 @@
+-- Created by `flights/daily_prices.up.sql` on fresh deployments
+SELECT count() = 1
+FROM system.tables
+WHERE database = 'flight_data'
+    AND name = 'daily_prices_mv'
+    AND position(create_table_query, 'FROM flight_data.flights') > 0;
@@ -0,0 +1,22 @@
+-- The rollup is fed by the inserts into `flights` instead of the Kafka queue, so the fares the `clickhouse` sink of the
+-- scrapers inserts directly are rolled up as well. The new view is attached before the old one is dropped, no insert is
+-- missed: the ones in between are rolled up twice, which changes neither the lowest, the highest nor the last price
+CREATE MATERIALIZED VIEW IF NOT EXISTS flight_data.daily_prices_mv_next TO flight_data.daily_prices AS
+SELECT
+    source,
+    destination,
+    currency,
+    company,
+    flight_date,
+    scrape_date,
+    min(price) AS min_price,
+    max(price) AS max_price,
+    min(price_eur) AS min_price_eur,
+    max(price_eur) AS max_price_eur,
+    argMaxState(price, now64(3)) AS last_price
+FROM flight_data.flights
+GROUP BY source, destination, currency, company, flight_date, scrape_date;
+
+DROP VIEW IF EXISTS flight_data.daily_prices_mv;
+
+RENAME TABLE flight_data.daily_prices_mv_next TO flight_data.daily_prices_mv;
@@ -0,0 +1,87 @@
+"""
+Measures the parse time and peak memory of EasyJet search responses, decoding the whole response as before versus
+streaming only `bestOffers` out of it.
+
+The recorded fixture is enlarged by repeating its `offers`, which is the part of the response that grows with the
+number of connections EasyJet finds.
+
+Usage (from the `scrapers` directory):
+    python -m benchmarks.easyjet_parse --enlarge 1 10 100
+"""
+import argparse
+import datetime
+import json
+import os
+import time
+import tracemalloc
+
+from typing import Callable
+
+from scrapy import http
+
+from scrapers import airline_route
+from scrapers.spiders import EasyJet
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'easyjet_search.json')
+WINDOW = airline_route.RouteWindow('EasyJet', 'BSL', 'AMS', datetime.date(2023, 7, 14), datetime.date(2023, 7, 14))
+
+
+def enlarged(times: int) -> bytes:
+    with open(FIXTURE, 'rb') as f:
+        data = json.load(f)
+
+    data['data']['search']['offers'] *= times
+
+    return json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+
+def whole_document(spider: EasyJet.EasyJetSpider, response: http.TextResponse) -> int:
+    """The decoding done before: all of the response, then `bestOffers` is looked up"""
+    best_offers = response.json()['data']['search']['bestOffers']
+
+    return sum(1 for offer_type in spider.OFFER_TYPES if best_offers[offer_type] is not None)
+
+
+def streaming(spider: EasyJet.EasyJetSpider, response: http.TextResponse) -> int:
+    return sum(1 for _ in spider.parse(response))
+
+
+def measure(parser: Callable[[EasyJet.EasyJetSpider, http.TextResponse], int], body: bytes, repeat: int):
+    spider = EasyJet.EasyJetSpider()
+
+    def response() -> http.TextResponse:
+        # A new response every time, `TextResponse` caches its decoded text and json
+        request = http.Request(EasyJet.EasyJetSpider.API_ENDPOINT, meta={'route_window': WINDOW})
+        return http.TextResponse(request.url, body=body, encoding='utf-8', request=request)
+
+    tracemalloc.start()
+    parser(spider, response())
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    responses = [response() for _ in range(repeat)]
+    start = time.perf_counter()
+
+    for r in responses:
+        parser(spider, r)
+
+    return (time.perf_counter() - start) / repeat, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--enlarge', type=int, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    for times in args.enlarge:
+        body = enlarged(times)
+        print(f'Response of {len(body) / 1024:.0f} KiB')
+
+        for name, candidate in [('whole document', whole_document), ('streaming', streaming)]:
+            seconds, peak = measure(candidate, body, args.repeat)
+            print(f'    {name:<16} {seconds * 1000:>9.3f} ms/response {peak / 1024:>10.0f} KiB peak')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""
+Compares the per-item Kafka delivery used before with the batched and compressed delivery of `AirlineScraperPipeline`.
+
+Both run against the in-process stand-in broker, so the numbers measure the scraper's side of the delivery (encoding,
+batching, compression) and the bytes that would be sent to Kafka.
+
+Usage (from the `scrapers` directory):
+    python -m benchmarks.kafka_delivery --routes 100 --days 180
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import time
+import types
+
+from typing import Any, Callable, Dict, Iterator
+
+from benchmarks import stand_in_broker
+
+os.environ.setdefault('KAFKA_TOPIC', 'flights')
+os.environ.setdefault('KAFKA_BOOTSTRAP_BROKERS', 'stand-in:9092')
+
+from scrapers import items, pipelines, settings  # noqa: E402
+
+TOPIC = os.environ['KAFKA_TOPIC']
+
+
+def fares(routes: int, days: int, record_type: Callable[..., Any] = items.FareRecord) -> Iterator[Any]:
+    today = datetime.date.today()
+    scrape_date = today.isoformat()
+
+    for route in range(routes):
+        source, destination = f'S{route:02X}', f'D{route:02X}'
+
+        for day in range(days):
+            yield record_type(
+                flight_date=(today + datetime.timedelta(days=day)).isoformat(),
+                source=source,
+                destination=destination,
+                price=round(19.99 + (route * 7 + day * 13) % 250, 2),
+                currency='EUR',
+                company='RyanAir',
+                scrape_date=scrape_date
+            )
+
+
+def per_item(broker: stand_in_broker.StandInBroker, routes: int, days: int):
+    """What `AirlineScraperPipeline` did before: dict items, default producer settings and a lambda serializer"""
+    producer = stand_in_broker.StandInProducer(broker, value_serializer=lambda v: json.dumps(v).encode('utf-8'))
+
+    for fare in fares(routes, days, dict):
+        producer.send(TOPIC, fare)
+
+    producer.close()
+
+
+def batched(broker: stand_in_broker.StandInBroker, routes: int, days: int, compression: str):
+    pipeline = pipelines.AirlineScraperPipeline(
+        producer_config={
+            'batch_size': settings.KAFKA_BATCH_SIZE,
+            'linger_ms': settings.KAFKA_LINGER_MS,
+            'compression_type': compression or None,
+        },
+        producer_factory=lambda **configs: stand_in_broker.StandInProducer(broker, **configs),
+    )
+    spider = types.SimpleNamespace(name='benchmark')
+
+    pipeline.open_spider(spider)
+
+    for fare in fares(routes, days):
+        pipeline.process_item(fare, spider)
+
+    pipeline.close_spider(spider)
+    assert pipeline.delivered == routes * days, f'{pipeline.delivered} delivered out of {routes * days}'
+
+
+def run(name: str, scenario: Callable[[stand_in_broker.StandInBroker], None], items: int) -> Dict[str, float]:
+    broker = stand_in_broker.StandInBroker(keep_batches=False)
+
+    start = time.perf_counter()
+    scenario(broker)
+    elapsed = time.perf_counter() - start
+
+    result = {
+        'items/s': items / elapsed,
+        'requests': broker.requests,
+        'wire bytes': broker.wire_bytes,
+        'bytes/item': broker.wire_bytes / items,
+    }
+    print(f'{name:<16}' + ''.join(f'{key:>12}: {value:<12.1f}' for key, value in result.items()))
+
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--routes', type=int, default=100)
+    parser.add_argument('--days', type=int, default=180)
+    parser.add_argument('--compression', nargs='+', default=['', 'gzip', 'lz4', 'zstd'])
+    args = parser.parse_args()
+
+    items = args.routes * args.days
+    print(f'{items} fares, batch size {settings.KAFKA_BATCH_SIZE}, linger {settings.KAFKA_LINGER_MS}ms')
+
+    run('per item', lambda broker: per_item(broker, args.routes, args.days), items)
+
+    for compression in args.compression:
+        checked = pipelines.compression_type(compression, logging.getLogger('benchmark'))
+
+        if checked != (compression or None):
+            print(f'Skipping {compression}, its library is not installed')
+            continue
+
+        run(
+            f'batched {compression or "none"}',
+            lambda broker: batched(broker, args.routes, args.days, compression),
+            items
+        )
+
+
+if __name__ == '__main__':
+    main()
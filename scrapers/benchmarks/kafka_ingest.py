@@ -0,0 +1,140 @@
+"""
+Measures how fast ClickHouse ingests the `flights` topic as its partitions grow, against the containers of
+`deploy/docker-compose`.
+
+For every partition count, a topic of that many partitions is filled by `AirlineScraperPipeline` with `--routes` routes
+of `--days` fares, keyed by route. Only then are the tables of `clickhouse/flight_data/flights` created in the
+`ingest_benchmark` database, the Kafka queue rendered from `kafka_consumer.up.sql` with one consumer per partition (up
+to `--max-consumers`), so the time until `flights` holds all the fares is the time ClickHouse took to ingest them.
+
+Usage (from the `scrapers` directory, once `pipeline.up.yml` deployed the containers):
+    python -m benchmarks.kafka_ingest --partitions 1 2 4 8 --routes 1000 --days 180
+"""
+import argparse
+import logging
+import os
+import time
+import types
+
+from kafka import KafkaProducer
+from kafka.admin import KafkaAdminClient, NewTopic
+
+from benchmarks import kafka_delivery
+from scrapers import clickhouse_http, clickhouse_migrate, pipelines, settings
+
+DATABASE = 'ingest_benchmark'
+FLIGHTS_DIR = os.path.join(os.path.dirname(settings.CLICKHOUSE_MIGRATIONS_DIR), 'flights')
+
+
+def flights_sql(name: str, topic: str, consumers: int) -> str:
+    """
+    Statements of `flights/{name}.up.sql` creating the tables in `DATABASE`, reading `topic`
+    """
+    with open(os.path.join(FLIGHTS_DIR, f'{name}.up.sql'), 'r') as f:
+        sql = f.read()
+
+    return sql \
+        .replace('flight_data.', f'{DATABASE}.') \
+        .replace("kafka_topic_list = 'flights'", f"kafka_topic_list = '{topic}'") \
+        .replace("kafka_group_name = 'clickhouse'", f"kafka_group_name = '{topic}'") \
+        .replace(clickhouse_migrate.KAFKA_CONSUMERS, str(consumers))
+
+
+def fill_topic(bootstrap_servers: str, topic: str, partitions: int, routes: int, days: int) -> float:
+    """
+    Creates `topic` and sends the fares to it, returns how many fares per second were sent
+    """
+    admin = KafkaAdminClient(bootstrap_servers=bootstrap_servers)
+    admin.create_topics([NewTopic(topic, partitions, 1)])
+    admin.close()
+
+    os.environ['KAFKA_TOPIC'] = topic
+    os.environ['KAFKA_BOOTSTRAP_BROKERS'] = bootstrap_servers
+    pipeline = pipelines.AirlineScraperPipeline(
+        producer_config={
+            'batch_size': settings.KAFKA_BATCH_SIZE,
+            'linger_ms': settings.KAFKA_LINGER_MS,
+            'buffer_memory': settings.KAFKA_BUFFER_MEMORY,
+            'compression_type': pipelines.compression_type(
+                settings.KAFKA_COMPRESSION_TYPE, logging.getLogger('benchmark')
+            ),
+        },
+        producer_factory=KafkaProducer,
+    )
+    spider = types.SimpleNamespace(name='benchmark')
+
+    start = time.perf_counter()
+    pipeline.open_spider(spider)
+
+    for fare in kafka_delivery.fares(routes, days):
+        pipeline.process_item(fare, spider)
+
+    pipeline.close_spider(spider)
+    assert pipeline.delivered == routes * days, f'{pipeline.delivered} delivered out of {routes * days}'
+
+    return routes * days / (time.perf_counter() - start)
+
+
+def ingest(client: clickhouse_http.ClickHouseClient, topic: str, consumers: int, rows: int, timeout: float) -> float:
+    """
+    Creates the tables consuming `topic` and waits for all the `rows`, returns how many rows per second were ingested
+    """
+    client.execute(f'DROP DATABASE IF EXISTS {DATABASE} SYNC')
+    client.execute(f'CREATE DATABASE {DATABASE}')
+
+    for statement in clickhouse_migrate.statements(flights_sql('table', topic, consumers)):
+        client.execute(statement)
+
+    start = time.perf_counter()
+
+    # The view attached to the queue starts the consumers
+    for statement in clickhouse_migrate.statements(flights_sql('kafka_consumer', topic, consumers)):
+        client.execute(statement)
+
+    ingested = 0
+
+    while ingested < rows:
+        if time.perf_counter() - start > timeout:
+            raise TimeoutError(f'{ingested} rows out of {rows} ingested from {topic} in {timeout}s')
+
+        time.sleep(0.1)
+        ingested = client.value(f'SELECT count() FROM {DATABASE}.flights')
+
+    elapsed = time.perf_counter() - start
+    client.execute(f'DROP DATABASE {DATABASE} SYNC')
+
+    return rows / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--partitions', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--routes', type=int, default=1000)
+    parser.add_argument('--days', type=int, default=180)
+    parser.add_argument('--bootstrap-servers', default='localhost:9093', help='External listener of the kafka container')
+    parser.add_argument('--max-consumers', type=int, default=os.cpu_count(), help='Cores of the ClickHouse server')
+    parser.add_argument('--timeout', type=float, default=600, help='Seconds to wait for all the rows to be ingested')
+    args = parser.parse_args()
+
+    rows = args.routes * args.days
+    client = clickhouse_http.ClickHouseClient(
+        settings.CLICKHOUSE_URL, settings.CLICKHOUSE_USER, settings.CLICKHOUSE_PASSWORD
+    )
+    run = int(time.time())
+    print(f'{rows} fares over {args.routes} routes')
+
+    for partitions in args.partitions:
+        topic = f'ingest_benchmark_{run}_{partitions}'
+        consumers = min(partitions, args.max_consumers)
+        sent = fill_topic(args.bootstrap_servers, topic, partitions, args.routes, args.days)
+        ingested = ingest(client, topic, consumers, rows, args.timeout)
+        print(
+            f'{partitions:>3} partitions {consumers:>3} consumers'
+            f'{sent:>12.0f} rows/s sent {ingested:>12.0f} rows/s ingested'
+        )
+
+    client.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,373 @@
+"""
+End-to-end load test of the scrapers, to find where a settings profile stops keeping up and plan capacity.
+
+The real spiders crawl a synthetic routes file of `--routes` routes per airline, against `mock_airlines` running in a
+child process, through the real middlewares and pipelines, into a `StandInBroker` instead of Kafka. The crawls run as
+one run of `scrapers.runner`, with state (rate control, route history, ...) in a temporary directory unless
+`--state-dir` keeps it between runs. Every second, the harness samples:
+- the requests sent, the responses received and the items scraped by all the spiders;
+- the records delivered to the broker, the backlog being the items scraped but not delivered yet;
+- the RSS of the crawling process.
+
+The report gives the total crawl time, the mean and peak response rates, the growth of the RSS and the backlog.
+
+Profiles are sets of settings overrides, see `PROFILES`, `--set` overrides single settings on top of them.
+
+Usage (from the `scrapers` directory):
+    python -m benchmarks.load_harness --routes 10000 --profile unthrottled
+    python -m benchmarks.load_harness --routes 1000 --duration 300 --latency 0.5 --error-rate 0.02
+    python -m benchmarks.load_harness --routes 100 --set EASYJET_SEARCHES_PER_REQUEST=1 --output report.json
+"""
+import argparse
+import functools
+import itertools
+import json
+import math
+import os
+import resource
+import string
+import subprocess
+import sys
+import tempfile
+import time
+
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+from urllib import parse
+
+from benchmarks import mock_airlines, stand_in_broker
+
+AIRLINES = ['RyanAir', 'WizzAir', 'EasyJet']
+
+# Settings overrides, string values are formatted with the `state_dir` of the run
+PROFILES: Dict[str, Dict[str, Any]] = {
+    # What crawls run with
+    'default': {},
+    # As fast as the stand-in APIs answer, to find the limits of the crawling process itself
+    'unthrottled': {
+        'AUTOTHROTTLE_ENABLED': False,
+        'DOWNLOAD_DELAY': 0,
+        'RANDOMIZE_DOWNLOAD_DELAY': False,
+        'CONCURRENT_REQUESTS': 64,
+        'CONCURRENT_REQUESTS_PER_DOMAIN': 32,
+    },
+    # Rate control starting from the most it allows, with limits only the stand-in APIs should get
+    'rate-control-open': {
+        'AUTOTHROTTLE_ENABLED': False,
+        'RATE_CONTROL_ENABLED': True,
+        'RATE_CONTROL_MIN_DELAY': 0.25,
+        'RATE_CONTROL_MAX_CONCURRENCY': 16,
+        'DOWNLOAD_DELAY': 0.25,
+        'CONCURRENT_REQUESTS': 64,
+        'CONCURRENT_REQUESTS_PER_DOMAIN': 16,
+    },
+    # Deliveries through the on-disk spool
+    'spooled': {
+        'AUTOTHROTTLE_ENABLED': False,
+        'DOWNLOAD_DELAY': 0,
+        'RANDOMIZE_DOWNLOAD_DELAY': False,
+        'CONCURRENT_REQUESTS': 64,
+        'CONCURRENT_REQUESTS_PER_DOMAIN': 32,
+        'KAFKA_SPOOL_DIR': '{state_dir}/spool',
+    },
+}
+
+# Attributes holding the urls of the API of every spider class
+ENDPOINTS = {
+    'RyanAir': ['API_ENDPOINT_TEMPLATE'],
+    'WizzAir': ['API_ENDPOINT', 'BUILD_NUMBER_URL'],
+    'EasyJet': ['API_ENDPOINT'],
+}
+
+SAMPLE_INTERVAL = 1.0
+
+
+class Sample(NamedTuple):
+    elapsed: float
+    requests: int
+    responses: int
+    items: int
+    delivered: int
+    failed: int
+    rss: int
+
+    @property
+    def backlog(self) -> int:
+        return self.items - self.delivered - self.failed
+
+
+def airport_codes() -> List[str]:
+    return [''.join(letters) for letters in itertools.product(string.ascii_uppercase, repeat=3)]
+
+
+def generate_routes(routes_per_airline: int, airlines: List[str]) -> Dict[str, List[Dict[str, str]]]:
+    """
+    Routes files content with `routes_per_airline` distinct routes for each airline, between as few airports as
+    possible so some of them are hubs like in the real files. Every route is listed in a single direction, spiders
+    crawl both
+    """
+    airports = airport_codes()[:max(2, math.ceil(math.sqrt(2 * routes_per_airline)) + 1)]
+    pairs = list(itertools.islice(itertools.combinations(airports, 2), routes_per_airline))
+
+    return {airline: [{'source': source, 'destination': destination} for source, destination in pairs]
+            for airline in airlines}
+
+
+def profile_settings(profile: str, overrides: List[str], state_dir: str) -> Dict[str, Any]:
+    result = dict(PROFILES[profile])
+
+    for override in overrides:
+        key, _, value = override.partition('=')
+
+        try:
+            result[key] = json.loads(value)
+        except json.JSONDecodeError:
+            result[key] = value
+
+    return {key: value.format(state_dir=state_dir) if isinstance(value, str) else value
+            for key, value in result.items()}
+
+
+def local_url(url: str, base_url: str) -> str:
+    """
+    `url` with the scheme and the host of `base_url`
+    """
+    base = parse.urlsplit(base_url)
+
+    return parse.urlsplit(url)._replace(scheme=base.scheme, netloc=base.netloc).geturl()
+
+
+def rss_bytes() -> int:
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        # Peak rather than current, where there is no procfs
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def start_mock(args: argparse.Namespace) -> Tuple[subprocess.Popen, str]:
+    mock = subprocess.Popen(
+        [
+            sys.executable, '-m', 'benchmarks.mock_airlines',
+            '--port', '0',
+            '--seed', str(args.seed),
+            '--latency', str(args.latency),
+            '--jitter', str(args.jitter),
+            '--error-rate', str(args.error_rate),
+            '--error-status', str(args.error_status),
+            '--padding-kib', str(args.padding_kib),
+            '--wizzair-version', args.wizzair_version,
+            '--ryanair-max-days', str(args.ryanair_max_days),
+        ],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    port = mock.stdout.readline().strip()
+
+    if not port:
+        mock.wait()
+        raise RuntimeError(f'Mock airlines exited with {mock.returncode} before listening')
+
+    return mock, f'http://127.0.0.1:{port}'
+
+
+def configure_environment(args: argparse.Namespace, routes_file: str, state_dir: str, overrides: Dict[str, Any]):
+    """
+    Settings the scrapers read from the environment when `scrapers.settings` is imported, so before any import of
+    the scrapers
+    """
+    os.environ['ROUTES_FILE'] = routes_file
+    os.environ['STATE_DIR'] = state_dir
+    os.environ['DAYS_TO_SCRAPE'] = str(args.days)
+    os.environ['LOG_LEVEL'] = args.log_level
+    os.environ.setdefault('KAFKA_TOPIC', 'flights')
+    os.environ.setdefault('KAFKA_BOOTSTRAP_BROKERS', 'stand-in:9092')
+
+    # Some settings are only read from the environment, like `EASYJET_SEARCHES_PER_REQUEST`
+    for key, value in overrides.items():
+        os.environ[key] = str(value)
+
+
+def crawl(args: argparse.Namespace, base_url: str, overrides: Dict[str, Any]) -> Dict[str, Any]:
+    from scrapy import crawler
+    from scrapy.utils import project, reactor as scrapy_reactor
+
+    from scrapers import pipelines, runner
+    from scrapers.spiders import EasyJet, RyanAir, WizzAir
+
+    for spider_class in [RyanAir.RyanairSpider, WizzAir.WizzairSpider, EasyJet.EasyJetSpider]:
+        for attribute in ENDPOINTS[spider_class.name]:
+            setattr(spider_class, attribute, local_url(getattr(spider_class, attribute), base_url))
+
+        # Requests to other domains are dropped as offsite
+        spider_class.allowed_domains = spider_class.allowed_domains + [parse.urlsplit(base_url).hostname]
+
+    settings = project.get_project_settings()
+    settings.set('FX_RATES_URL', local_url(settings.get('FX_RATES_URL'), base_url), priority='cmdline')
+    settings.setdict(overrides, priority='cmdline')
+    settings.set('LOG_LEVEL', args.log_level, priority='cmdline')
+
+    if args.duration:
+        settings.set('CLOSESPIDER_TIMEOUT', args.duration, priority='cmdline')
+
+    scrapy_reactor.install_reactor(settings.get('TWISTED_REACTOR'), settings.get('ASYNCIO_EVENT_LOOP'))
+
+    from twisted.internet import reactor, task
+
+    broker = stand_in_broker.StandInBroker(partitions=args.partitions, keep_batches=False)
+    process = crawler.CrawlerProcess(settings)
+    crawl_runner = runner.CrawlRunner(process, args.spiders, [])
+    crawl_runner.producer = pipelines.SharedProducer(functools.partial(stand_in_broker.StandInProducer, broker))
+
+    samples: List[Sample] = []
+    rss_start = rss_bytes()
+    started = time.perf_counter()
+    crawl_runner.run()
+    crawlers = list(process.crawlers)
+
+    def total(key: str) -> int:
+        return sum(c.stats.get_value(key, 0) for c in crawlers)
+
+    def sample():
+        samples.append(Sample(
+            time.perf_counter() - started,
+            total('downloader/request_count'),
+            total('downloader/response_count'),
+            total('item_scraped_count'),
+            total('kafka/delivered'),
+            total('kafka/failed'),
+            rss_bytes(),
+        ))
+
+    sampler = task.LoopingCall(sample)
+    sampler.start(SAMPLE_INTERVAL)
+    reactor.addSystemEventTrigger('before', 'shutdown', lambda: sampler.running and sampler.stop())
+    process.start(stop_after_crawl=True)
+
+    crawl_seconds = time.perf_counter() - started
+    # What the pipelines left lingering in the producer
+    crawl_runner.producer.close()
+    sample()
+    last = samples[-1]
+
+    statuses: Dict[str, int] = {}
+
+    for c in crawlers:
+        for key, value in c.stats.get_stats().items():
+            if key.startswith('downloader/response_status_count/'):
+                status = key.rpartition('/')[2]
+                statuses[status] = statuses.get(status, 0) + value
+
+    return {
+        'crawl_seconds': round(crawl_seconds, 2),
+        'requests': last.requests,
+        'responses': last.responses,
+        'items': last.items,
+        'delivered': last.delivered,
+        'failed_deliveries': last.failed,
+        'statuses': statuses,
+        # Requests are counted when queued to the downloader, responses are what the airlines really served
+        'responses_per_second': round(last.responses / crawl_seconds, 1),
+        'items_per_second': round(last.items / crawl_seconds, 1),
+        'peak_responses_per_second': max(
+            (round((b.responses - a.responses) / (b.elapsed - a.elapsed), 1) for a, b in zip(samples, samples[1:])
+             if b.elapsed > a.elapsed),
+            default=0.0
+        ),
+        'rss_start_bytes': rss_start,
+        'rss_peak_bytes': max(s.rss for s in samples),
+        'rss_end_bytes': last.rss,
+        'rss_growth_bytes': last.rss - rss_start,
+        'backlog_peak': max(s.backlog for s in samples),
+        'backlog_end': last.backlog,
+        'broker_wire_bytes': broker.wire_bytes,
+        'spiders': {
+            c.spidercls.name: {
+                'elapsed_seconds': c.stats.get_value('elapsed_time_seconds'),
+                'requests': c.stats.get_value('downloader/request_count', 0),
+                'items': c.stats.get_value('item_scraped_count', 0),
+                'finish_reason': c.stats.get_value('finish_reason'),
+            }
+            for c in crawlers
+        },
+        'timeline': [s._asdict() for s in samples] if args.timeline else None,
+    }
+
+
+def print_report(report: Dict[str, Any]):
+    mib = 1024 * 1024
+    print(f'Profile {report["profile"]} over {report["routes_per_airline"]} routes per airline, '
+          f'{report["days"]} days ahead')
+    print(f'  crawl time      {report["crawl_seconds"]:>10.1f} s')
+    print(f'  requests        {report["requests"]:>10}')
+    print(f'  responses       {report["responses"]:>10} ({report["responses_per_second"]}/s, '
+          f'peak {report["peak_responses_per_second"]}/s)')
+    print(f'  statuses        {report["statuses"]}')
+    print(f'  items           {report["items"]:>10} ({report["items_per_second"]}/s)')
+    print(f'  delivered       {report["delivered"]:>10} ({report["failed_deliveries"]} failed, '
+          f'{report["broker_wire_bytes"] / mib:.1f} MiB on the wire)')
+    print(f'  backlog         {report["backlog_peak"]:>10} peak, {report["backlog_end"]} at the end')
+    print(f'  RSS             {report["rss_start_bytes"] / mib:>10.1f} MiB at start, '
+          f'{report["rss_peak_bytes"] / mib:.1f} peak, {report["rss_end_bytes"] / mib:.1f} at the end '
+          f'({report["rss_growth_bytes"] / mib:+.1f})')
+
+    for name, spider in report['spiders'].items():
+        print(f'  {name:<15} {spider["requests"]:>10} requests, {spider["items"]} items in '
+              f'{spider["elapsed_seconds"] or 0:.1f}s, {spider["finish_reason"]}')
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('spiders', nargs='*', default=AIRLINES, help='Spiders to run, all of them by default')
+    parser.add_argument('--routes', type=int, default=1000, help='Routes per airline')
+    parser.add_argument('--days', type=int, default=180, help='Days ahead to scrape')
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='unthrottled')
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE',
+                        help='Setting overriding the profile, JSON values are decoded')
+    parser.add_argument('--duration', type=int, default=0,
+                        help='Close the spiders after this many seconds, downloads already queued still finish')
+    parser.add_argument('--state-dir', help='Keep the state of the spiders there between runs')
+    parser.add_argument('--partitions', type=int, default=1, help='Partitions of the stand-in topic')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--log-level', default='WARNING')
+    parser.add_argument('--output', help='Also write the report there, as JSON')
+    parser.add_argument('--timeline', action='store_true', help='Include every sample in the JSON report')
+    mock_airlines.add_arguments(parser)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix='load-harness-') as work_dir:
+        state_dir = os.path.abspath(args.state_dir) if args.state_dir else os.path.join(work_dir, 'state')
+        routes_file = os.path.join(work_dir, 'airline_routes.json')
+        overrides = profile_settings(args.profile, args.set, state_dir)
+
+        with open(routes_file, 'w') as f:
+            json.dump(generate_routes(args.routes, args.spiders), f)
+
+        configure_environment(args, routes_file, state_dir, overrides)
+        mock, base_url = start_mock(args)
+
+        try:
+            report = {
+                'profile': args.profile,
+                'settings': overrides,
+                'routes_per_airline': args.routes,
+                'days': args.days,
+                'mock': mock_airlines.behaviour_from(args)._asdict(),
+                **crawl(args, base_url, overrides),
+            }
+        finally:
+            mock.terminate()
+            mock.wait()
+
+    print_report(report)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    return report
+
+
+if __name__ == '__main__':
+    main()
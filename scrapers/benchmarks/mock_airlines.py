@@ -0,0 +1,326 @@
+"""
+Local stand-in for the RyanAir, WizzAir and EasyJet APIs the spiders crawl, and for the ECB exchange rates, for load
+tests.
+
+Requests are answered on the paths of the real APIs with responses shaped like `fixtures`, for the requested route and
+dates. Prices and the days with flights are derived from the route and the day, so they are the same on every run.
+Latency, the share of requests answered with an error and extra bytes added to every response are configurable, as is
+the version the WizzAir API is served under, other versions answer 404s like the real API does once it moved, and the
+most days a RyanAir response covers.
+
+Usage (from the `scrapers` directory):
+    python -m benchmarks.mock_airlines --port 8000 --latency 0.2 --error-rate 0.01 --padding-kib 50
+"""
+import argparse
+import datetime
+import json
+import random
+import sys
+import zlib
+
+from typing import Callable, Dict, List, NamedTuple, Optional, Union
+from urllib import parse
+
+from twisted.web import resource, server
+
+RYANAIR_PATH_PREFIX = '/api/farfnd/3/oneWayFares/'
+WIZZAIR_PATH_SUFFIX = '/Api/search/timetable'
+WIZZAIR_BUILD_NUMBER_PATH = '/buildnumber'
+EASYJET_PATH = '/api/graphql'
+ECB_RATES_PATH = '/stats/eurofxref/eurofxref-hist-90d.xml'
+
+# Euro reference rates served for every day, WizzAir answers in the currency of the departure airport
+ECB_RATES = {'GBP': 0.8571, 'HUF': 379.85, 'PLN': 4.4345, 'RON': 4.9485}
+
+
+class Behaviour(NamedTuple):
+    # Mean seconds before a response is sent, spread uniformly by `jitter` times the mean on both sides
+    latency: float = 0.0
+    jitter: float = 0.5
+    # Share of requests answered with `error_status` and an empty body
+    error_rate: float = 0.0
+    error_status: int = 429
+    # Filler added to every successful response, in KiB
+    padding_kib: int = 0
+    # Version the WizzAir API is served under, and announced by its build number page
+    wizzair_version: str = '19.1.0'
+    # Most days a RyanAir response covers, the days after them are left out. 0 answers every day requested
+    ryanair_max_days: int = 0
+
+
+def _hash(*parts: str) -> int:
+    return zlib.crc32('/'.join(parts).encode())
+
+
+def has_flight(source: str, destination: str, day: datetime.date) -> bool:
+    # Roughly 7 days out of 10
+    return _hash(source, destination, day.isoformat()) % 10 < 7
+
+
+def price(source: str, destination: str, day: datetime.date) -> float:
+    return 9.99 + _hash(destination, source, day.isoformat()) % 200
+
+
+def days(start: datetime.date, end: datetime.date) -> List[datetime.date]:
+    return [start + datetime.timedelta(days=i) for i in range((end - start).days + 1)]
+
+
+def ryanair_cheapest_per_day(source: str, destination: str, start: datetime.date, end: datetime.date) -> dict:
+    fares = []
+
+    for day in days(start, end):
+        available = has_flight(source, destination, day)
+        value = price(source, destination, day)
+        fares.append({
+            'day': day.isoformat(),
+            'arrivalDate': f'{day}T08:35:00' if available else None,
+            'departureDate': f'{day}T06:10:00' if available else None,
+            'price': {
+                'value': value,
+                'valueMainUnit': str(int(value)),
+                'valueFractionalUnit': '99',
+                'currencyCode': 'EUR',
+                'currencySymbol': '€'
+            } if available else None,
+            'soldOut': False,
+            'unavailable': not available,
+        })
+
+    return {'outbound': {'fares': fares, 'minFare': None, 'maxFare': None}}
+
+
+def wizzair_timetable(source: str, destination: str, start: datetime.date, end: datetime.date) -> dict:
+    return {
+        'outboundFlights': [
+            {
+                'departureStation': source,
+                'arrivalStation': destination,
+                'departureDate': f'{day}T00:00:00',
+                'price': {'amount': price(source, destination, day), 'currencyCode': 'EUR'},
+                'priceType': 'price',
+                'departureDates': [f'{day}T07:25:00'],
+                'classOfService': 'B',
+                'hasMacFlight': False,
+            }
+            for day in days(start, end) if has_flight(source, destination, day)
+        ],
+        'returnFlights': [],
+    }
+
+
+def easyjet_offer(source: str, destination: str, day: datetime.date) -> dict:
+    def airport(code: str) -> dict:
+        return {'code': code, 'name': code, 'city': code, 'country': 'XX'}
+
+    leg = {
+        'id': f'{source}{destination}{day:%Y%m%d}',
+        'duration': 125,
+        'origin': airport(source),
+        'destination': airport(destination),
+        'departure': f'{day}T06:10:00Z',
+        'arrival': f'{day}T08:15:00Z',
+        'carrierType': 'AIRLINE',
+        'operatingCarrier': {'name': 'easyJet', 'code': 'U2', 'flightNumber': '1234'},
+        'marketingCarrier': {'name': 'easyJet', 'code': 'U2', 'flightNumber': '1234'},
+    }
+
+    return {
+        'id': leg['id'],
+        'price': price(source, destination, day),
+        'pricePerPerson': price(source, destination, day),
+        'currency': 'EUR',
+        'transferURL': 'https://www.easyjet.com/',
+        'duration': 125,
+        'itinerary': {'outbound': [{**leg, 'legs': [leg]}], 'homebound': None},
+    }
+
+
+def easyjet_search(source: str, destination: str, day: datetime.date) -> dict:
+    if not has_flight(source, destination, day):
+        return {'bestOffers': {'RECOMMENDED': None, 'QUICKEST': None, 'CHEAPEST': None}, 'offers': []}
+
+    offer = easyjet_offer(source, destination, day)
+
+    return {
+        'numberOfPages': 1,
+        'bestOffers': {'RECOMMENDED': offer, 'QUICKEST': offer, 'CHEAPEST': offer},
+        'offers': [offer],
+        'currency': 'EUR',
+        'residency': None,
+    }
+
+
+def ecb_rates(today: datetime.date, days: int = 5) -> str:
+    cubes = ''.join(
+        f'<Cube time="{today - datetime.timedelta(days=i)}">'
+        + ''.join(f'<Cube currency="{currency}" rate="{rate}"/>' for currency, rate in ECB_RATES.items())
+        + '</Cube>'
+        for i in range(days)
+    )
+
+    return (
+        '<gesmes:Envelope xmlns:gesmes="http://www.gesmes.org/xml/2002-08-01" '
+        f'xmlns="http://www.ecb.int/vocabulary/2002-08-01/eurofxref"><Cube>{cubes}</Cube></gesmes:Envelope>'
+    )
+
+
+def easyjet_graphql(variables: dict) -> dict:
+    source, destination = variables['origin'], variables['destination']
+
+    if variables.get('departureDateString'):
+        day = datetime.date.fromisoformat(variables['departureDateString'])
+        return {'data': {'search': easyjet_search(source, destination, day)}}
+
+    # Batched searches are aliased `d0`, `d1`, ... and select only `bestOffers`
+    return {
+        'data': {
+            alias: {'bestOffers': easyjet_search(source, destination, datetime.date.fromisoformat(value))['bestOffers']}
+            for alias, value in variables.items() if alias[0] == 'd' and alias[1:].isdigit()
+        }
+    }
+
+
+class MockAirlines(resource.Resource):
+    isLeaf = True
+
+    def __init__(self, behaviour: Behaviour, seed: int = 0):
+        super().__init__()
+        self.behaviour = behaviour
+        self.random = random.Random(seed)
+        self.padding = 'x' * (behaviour.padding_kib * 1024)
+        self.requests = 0
+
+    def _answer(self, request: server.Request) -> Optional[Union[dict, str]]:
+        path = request.path.decode()
+
+        if path.startswith(RYANAIR_PATH_PREFIX):
+            source, destination = path[len(RYANAIR_PATH_PREFIX):].split('/')[:2]
+            query = parse.parse_qs(request.uri.decode().partition('?')[2])
+            start = datetime.date.fromisoformat(query['outboundDateFrom'][0])
+            end = datetime.date.fromisoformat(query['outboundDateTo'][0])
+
+            if self.behaviour.ryanair_max_days:
+                end = min(end, start + datetime.timedelta(days=self.behaviour.ryanair_max_days - 1))
+
+            return ryanair_cheapest_per_day(source, destination, start, end)
+
+        if path == WIZZAIR_BUILD_NUMBER_PATH:
+            return f'SSR 20230712.1 https://be.wizzair.com/{self.behaviour.wizzair_version}'
+
+        if path == f'/{self.behaviour.wizzair_version}{WIZZAIR_PATH_SUFFIX}':
+            flight = json.loads(request.content.read())['flightList'][0]
+            request.addCookie(b'RequestVerificationToken', b'0123456789abcdef', path=b'/')
+            return wizzair_timetable(
+                flight['departureStation'],
+                flight['arrivalStation'],
+                datetime.date.fromisoformat(flight['from']),
+                datetime.date.fromisoformat(flight['to']),
+            )
+
+        if path == EASYJET_PATH:
+            return easyjet_graphql(json.loads(request.content.read())['variables'])
+
+        if path == ECB_RATES_PATH:
+            return ecb_rates(datetime.date.today())
+
+        return None
+
+    def render(self, request: server.Request):
+        self.requests += 1
+        behaviour = self.behaviour
+
+        if behaviour.error_rate and self.random.random() < behaviour.error_rate:
+            request.setResponseCode(behaviour.error_status)
+            body = b''
+        else:
+            answer = self._answer(request)
+
+            if answer is None:
+                request.setResponseCode(404)
+                body = b''
+            elif isinstance(answer, str):
+                request.setHeader(b'Content-Type', b'text/plain; charset=utf-8')
+                body = answer.encode()
+            else:
+                if self.padding:
+                    answer['padding'] = self.padding
+
+                request.setHeader(b'Content-Type', b'application/json; charset=utf-8')
+                body = json.dumps(answer).encode()
+
+        delay = self.random.uniform(
+            behaviour.latency * (1 - behaviour.jitter), behaviour.latency * (1 + behaviour.jitter)
+        ) if behaviour.latency else 0
+
+        if not delay:
+            return body
+
+        from twisted.internet import reactor
+
+        call = reactor.callLater(delay, self._finish, request, body)
+        request.notifyFinish().addErrback(lambda _failure: call.active() and call.cancel())
+
+        return server.NOT_DONE_YET
+
+    @staticmethod
+    def _finish(request: server.Request, body: bytes):
+        request.write(body)
+        request.finish()
+
+
+def listen(behaviour: Behaviour, port: int = 0, seed: int = 0, on_listening: Optional[Callable[[int], None]] = None):
+    from twisted.internet import reactor
+
+    site = server.Site(MockAirlines(behaviour, seed))
+    # No access log, it would cost more than answering
+    site.log = lambda _request: None
+    listening = reactor.listenTCP(port, site, backlog=1024, interface='127.0.0.1')
+
+    if on_listening is not None:
+        on_listening(listening.getHost().port)
+
+    return listening
+
+
+def add_arguments(parser: argparse.ArgumentParser, defaults: Optional[Dict[str, object]] = None):
+    defaults = {**Behaviour()._asdict(), **(defaults or {})}
+    parser.add_argument('--latency', type=float, default=defaults['latency'], help='Mean response latency, seconds')
+    parser.add_argument('--jitter', type=float, default=defaults['jitter'], help='Latency spread, share of the mean')
+    parser.add_argument('--error-rate', type=float, default=defaults['error_rate'],
+                        help='Share of requests answered with --error-status')
+    parser.add_argument('--error-status', type=int, default=defaults['error_status'])
+    parser.add_argument('--padding-kib', type=int, default=defaults['padding_kib'],
+                        help='KiB of filler added to every response')
+    parser.add_argument('--wizzair-version', default=defaults['wizzair_version'],
+                        help='Version the WizzAir API is served under')
+    parser.add_argument('--ryanair-max-days', type=int, default=defaults['ryanair_max_days'],
+                        help='Most days a RyanAir response covers, 0 for all the days requested')
+
+
+def behaviour_from(args: argparse.Namespace) -> Behaviour:
+    return Behaviour(
+        args.latency, args.jitter, args.error_rate, args.error_status, args.padding_kib, args.wizzair_version,
+        args.ryanair_max_days,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=0, help='Port to listen on, any free one by default')
+    parser.add_argument('--seed', type=int, default=0)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    def announce(port: int):
+        # The load harness reads the port from the first line
+        print(port, flush=True)
+        print(f'Mock airlines listening on http://127.0.0.1:{port}', file=sys.stderr, flush=True)
+
+    from twisted.internet import reactor
+
+    listen(behaviour_from(args), args.port, args.seed, announce)
+    reactor.run()
+
+
+if __name__ == '__main__':
+    main()
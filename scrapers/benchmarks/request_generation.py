@@ -0,0 +1,176 @@
+"""
+Measures how fast the spiders build the requests of a whole crawl, the search bodies rebuilt for every request as
+before versus rendered from the `request_templates` of the spiders, and the whole `prepare_request` of every spider.
+
+Every route is searched in both directions over `--days` days, by windows of the spider's `WINDOW_SIZE`, EasyJet
+sending `EASYJET_SEARCHES_PER_REQUEST` searches per request.
+
+Usage (from the `scrapers` directory):
+    python -m benchmarks.request_generation --routes 10000 --days 180
+    python -m benchmarks.request_generation --routes 1000 WizzAir
+"""
+import argparse
+import copy
+import datetime
+import functools
+import json
+import time
+
+from typing import Callable, Dict, Iterator, List, Tuple
+
+from benchmarks import load_harness
+from scrapers import airline_route, settings
+from scrapers.spiders import EasyJet, RyanAir, WizzAir
+
+START = datetime.date(2023, 7, 1)
+
+Window = Tuple[airline_route.Route, datetime.date, datetime.date]
+
+
+def windows(spider, count: int, days: int) -> Iterator[Window]:
+    end = START + datetime.timedelta(days=days)
+
+    for route in load_harness.generate_routes(count, [spider.name])[spider.name]:
+        route = airline_route.Route(route['source'], route['destination'])
+
+        for directed_route in (route, route.return_route()):
+            start = START
+
+            while start < end:
+                yield directed_route, start, min(start + spider.window_size, end) - datetime.timedelta(days=1)
+                start += spider.window_size
+
+
+@functools.lru_cache(maxsize=None)
+def easyjet_days(left_date: datetime.date, right_date: datetime.date, searches: int) -> List[List[str]]:
+    """
+    Days of every request of a window, the windows of all the routes share their dates, so that only the bodies are
+    measured
+    """
+    days = [f'{left_date + datetime.timedelta(days=i)}' for i in range((right_date - left_date).days + 1)]
+
+    return [days[i:i + searches] for i in range(0, len(days), searches)]
+
+
+def easyjet_rebuilt(window: Window) -> int:
+    """The bodies built before: variables rebuilt and the whole body, query included, encoded for every request"""
+    route, left_date, right_date = window
+    built = 0
+
+    for days in easyjet_days(left_date, right_date, settings.EASYJET_SEARCHES_PER_REQUEST):
+        variables = {
+            "partner": "easyjet",
+            "metadata": {"language": "en", "currency": "EUR"},
+            "origin": route.source,
+            "destination": route.destination,
+            "passengerAges": [18],
+            "limit": 1,
+        }
+
+        for i, day in enumerate(days):
+            variables[f"d{i}"] = day
+
+        body = {"query": EasyJet.batched_search_query(len(days)), "variables": variables}
+        built += len(json.dumps(body, sort_keys=True).encode())
+
+    return built
+
+
+def easyjet_templated(window: Window) -> int:
+    route, left_date, right_date = window
+    built = 0
+
+    for days in easyjet_days(left_date, right_date, settings.EASYJET_SEARCHES_PER_REQUEST):
+        dates = {f"d{i}": day for i, day in enumerate(days)}
+        built += len(EasyJet.batched_search_template(len(days)).render(
+            origin=route.source, destination=route.destination, **dates
+        ))
+
+    return built
+
+
+WIZZAIR_BASE_BODY = {
+    "flightList": [{"departureStation": "", "arrivalStation": "", "from": "", "to": ""}],
+    "priceType": "",
+    "adultCount": 1,
+    "childCount": 0,
+    "infantCount": 0,
+}
+
+
+def wizzair_rebuilt(window: Window) -> int:
+    """The bodies built before: the base body copied and encoded for every price type"""
+    route, left_date, right_date = window
+    built = 0
+
+    for price_type in WizzAir.WizzairSpider.PRICE_TYPES:
+        body = copy.deepcopy(WIZZAIR_BASE_BODY)
+        body["flightList"][0].update({
+            "departureStation": route.source,
+            "arrivalStation": route.destination,
+            "from": left_date.strftime("%Y-%m-%d"),
+            "to": right_date.strftime("%Y-%m-%d"),
+        })
+        body.update(price_type)
+        built += len(json.dumps(body).encode())
+
+    return built
+
+
+def wizzair_templated(window: Window) -> int:
+    route, left_date, right_date = window
+
+    return sum(
+        len(template.render(
+            source=route.source, destination=route.destination, left=f'{left_date}', right=f'{right_date}'
+        ))
+        for template in WizzAir.WizzairSpider.TIMETABLE_TEMPLATES
+    )
+
+
+# Body builders, before and now, of the spiders sending a JSON body
+BODIES: Dict[str, Tuple[Callable[[Window], int], Callable[[Window], int]]] = {
+    'WizzAir': (wizzair_rebuilt, wizzair_templated),
+    'EasyJet': (easyjet_rebuilt, easyjet_templated),
+}
+
+SPIDERS = {
+    'RyanAir': RyanAir.RyanairSpider,
+    'WizzAir': WizzAir.WizzairSpider,
+    'EasyJet': EasyJet.EasyJetSpider,
+}
+
+
+def timed(operation: Callable[[Window], int], spider, count: int, days: int) -> Tuple[float, int]:
+    """Seconds spent on every window of the crawl, and what `operation` counted over them"""
+    counted, start = 0, time.perf_counter()
+
+    for window in windows(spider, count, days):
+        counted += operation(window)
+
+    return time.perf_counter() - start, counted
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('spiders', nargs='*', default=list(SPIDERS), help='Spiders to measure, all of them by default')
+    parser.add_argument('--routes', type=int, default=10000)
+    parser.add_argument('--days', type=int, default=180)
+    args = parser.parse_args()
+
+    for name in args.spiders:
+        # Only the routes generated here are searched
+        spider = SPIDERS[name](routes='BSL-AMS')
+        seconds, requests = timed(
+            lambda window: len(spider.prepare_request(*window)), spider, args.routes, args.days
+        )
+        print(f'{name}: {requests} requests over {args.routes} routes and {args.days} days')
+        print(f'    {"prepare_request":<16} {seconds:>8.2f} s {requests / seconds:>10.0f} requests/s')
+
+        for label, build in zip(['bodies rebuilt', 'bodies templated'], BODIES.get(name, ())):
+            seconds, size = timed(build, spider, args.routes, args.days)
+            print(f'    {label:<16} {seconds:>8.2f} s {requests / seconds:>10.0f} bodies/s {size / 2 ** 20:>8.0f} MiB')
+
+
+if __name__ == '__main__':
+    main()
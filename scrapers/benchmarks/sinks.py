@@ -0,0 +1,156 @@
+"""
+Compares how fast the fares of a crawl are handed to every sink, and how many bytes they take.
+
+`kafka` is `AirlineScraperPipeline` delivering to the in-process stand-in broker, with the compression of the
+settings. The bulk sinks of `scrapers.sinks` are written `--batch-size` fares at a time, the way `BulkSinkPipeline`
+hands them over: `parquet` and `arrow` to files of a temporary directory, when pyarrow is installed, and with
+`--clickhouse`, inserts into a `flights` table of the `sink_benchmark` database of `CLICKHOUSE_URL`, in every insert
+format.
+
+Usage (from the `scrapers` directory):
+    python -m benchmarks.sinks --routes 1000 --days 180
+    python -m benchmarks.sinks --routes 1000 --days 180 --clickhouse
+"""
+import argparse
+import datetime
+import itertools
+import logging
+import os
+import tempfile
+import time
+import types
+
+from typing import Callable, List
+
+from benchmarks import kafka_delivery, kafka_ingest, stand_in_broker
+from scrapers import clickhouse_http, clickhouse_migrate, items, pipelines, settings, sinks
+
+DATABASE = 'sink_benchmark'
+
+Batches = List[List[items.FareRecord]]
+
+
+def batches(routes: int, days: int, batch_size: int) -> Batches:
+    fares = kafka_delivery.fares(routes, days)
+
+    return list(iter(lambda: list(itertools.islice(fares, batch_size)), []))
+
+
+def kafka(fares: Batches) -> int:
+    broker = stand_in_broker.StandInBroker(keep_batches=False)
+    pipeline = pipelines.AirlineScraperPipeline(
+        producer_config={
+            'batch_size': settings.KAFKA_BATCH_SIZE,
+            'linger_ms': settings.KAFKA_LINGER_MS,
+            'compression_type': pipelines.compression_type(
+                settings.KAFKA_COMPRESSION_TYPE, logging.getLogger('benchmark')
+            ),
+        },
+        producer_factory=lambda **configs: stand_in_broker.StandInProducer(broker, **configs),
+    )
+    spider = types.SimpleNamespace(name='benchmark')
+    pipeline.open_spider(spider)
+
+    for batch in fares:
+        for fare in batch:
+            pipeline.process_item(fare, spider)
+
+    pipeline.close_spider(spider)
+
+    return broker.wire_bytes
+
+
+def write(sink: sinks.Sink, fares: Batches):
+    for batch in fares:
+        sink.write(batch)
+
+    sink.close()
+
+
+def file_sink(sink_class: type, directory: str) -> Callable[[Batches], int]:
+    def scenario(fares: Batches) -> int:
+        sink = sink_class(directory, 'benchmark', datetime.datetime.now())
+        write(sink, fares)
+
+        return os.path.getsize(sink.path)
+
+    return scenario
+
+
+def client() -> clickhouse_http.ClickHouseClient:
+    return clickhouse_http.ClickHouseClient(
+        settings.CLICKHOUSE_URL, settings.CLICKHOUSE_USER, settings.CLICKHOUSE_PASSWORD
+    )
+
+
+def clickhouse_sink(insert_format: str) -> Callable[[Batches], int]:
+    def scenario(fares: Batches) -> int:
+        sink = sinks.ClickHouseSink(client(), f'{DATABASE}.flights', insert_format)
+        write(sink, fares)
+
+        return sink.sent
+
+    return scenario
+
+
+def create_flights(admin: clickhouse_http.ClickHouseClient):
+    admin.execute(f'DROP DATABASE IF EXISTS {DATABASE} SYNC')
+    admin.execute(f'CREATE DATABASE {DATABASE}')
+
+    with open(os.path.join(kafka_ingest.FLIGHTS_DIR, 'table.up.sql'), 'r') as f:
+        for statement in clickhouse_migrate.statements(f.read()):
+            admin.execute(statement.replace('flight_data.', f'{DATABASE}.'))
+
+
+def run(name: str, scenario: Callable[[Batches], int], fares: Batches):
+    count = sum(len(batch) for batch in fares)
+
+    start = time.perf_counter()
+    size = scenario(fares)
+    elapsed = time.perf_counter() - start
+
+    result = {'items/s': count / elapsed, 'bytes': size, 'bytes/item': size / count}
+    print(f'{name:<24}' + ''.join(f'{key:>12}: {value:<12.1f}' for key, value in result.items()))
+
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--routes', type=int, default=1000)
+    parser.add_argument('--days', type=int, default=180)
+    parser.add_argument('--batch-size', type=int, default=settings.SINK_BATCH_SIZE)
+    parser.add_argument('--clickhouse', action='store_true', help='Also insert into the ClickHouse of CLICKHOUSE_URL')
+    args = parser.parse_args()
+
+    fares = batches(args.routes, args.days, args.batch_size)
+    print(f'{args.routes * args.days} fares in batches of {args.batch_size}')
+
+    run(f'kafka {settings.KAFKA_COMPRESSION_TYPE or "none"}', kafka, fares)
+
+    with tempfile.TemporaryDirectory() as directory:
+        for sink_class in [sinks.ParquetSink, sinks.ArrowSink]:
+            if not sinks.has_pyarrow():
+                print(f'Skipping {sink_class.EXTENSION}, pyarrow is not installed')
+                continue
+
+            run(sink_class.EXTENSION, file_sink(sink_class, directory), fares)
+
+    if not args.clickhouse:
+        return
+
+    admin = client()
+
+    for insert_format in sinks.ClickHouseSink.FORMATS:
+        create_flights(admin)
+        run(f'clickhouse {insert_format}', clickhouse_sink(insert_format), fares)
+
+        rows = admin.value(f'SELECT count() FROM {DATABASE}.flights')
+        assert rows == args.routes * args.days, f'{rows} rows inserted out of {args.routes * args.days}'
+
+    admin.execute(f'DROP DATABASE {DATABASE} SYNC')
+    admin.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+"""
+In-process stand-in for a Kafka broker and for `kafka.KafkaProducer`.
+
+Records are accumulated in real `kafka-python` record batches (same format, same compression), so the bytes counted by
+`StandInBroker` are the bytes a real producer would put on the wire, without needing a running broker.
+"""
+import collections
+import itertools
+import random
+import time
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from kafka import errors, future
+from kafka.partitioner import DefaultPartitioner
+from kafka.record import memory_records, default_records
+
+DeliveryReport = collections.namedtuple(
+    'DeliveryReport', ['topic', 'partition', 'offset', 'serialized_key_size', 'serialized_value_size']
+)
+
+_CODECS = {
+    None: default_records.DefaultRecordBatchBuilder.CODEC_NONE,
+    'gzip': default_records.DefaultRecordBatchBuilder.CODEC_GZIP,
+    'snappy': default_records.DefaultRecordBatchBuilder.CODEC_SNAPPY,
+    'lz4': default_records.DefaultRecordBatchBuilder.CODEC_LZ4,
+    'zstd': default_records.DefaultRecordBatchBuilder.CODEC_ZSTD,
+}
+
+
+class StandInBroker:
+    def __init__(self, partitions: int = 1, failure_rate: float = 0.0, seed: int = 0, keep_batches: bool = True):
+        self.partitions = partitions
+        self.keep_batches = keep_batches
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+
+        self.requests = 0
+        self.records = 0
+        self.wire_bytes = 0
+        self.offsets: Dict[Tuple[str, int], int] = collections.defaultdict(int)
+        # Every accepted batch, as (topic, partition, buffer), so tests can decode what was produced
+        self.batches: List[Tuple[str, int, bytes]] = []
+
+    def produce(self, topic: str, partition: int, buffer: bytes, record_count: int) -> Optional[int]:
+        """
+        Accepts a record batch and returns the offset of its first record, or `None` if the batch is rejected
+        """
+        self.requests += 1
+        self.wire_bytes += len(buffer)
+
+        if self.failure_rate and self.random.random() < self.failure_rate:
+            return None
+
+        base_offset = self.offsets[(topic, partition)]
+        self.offsets[(topic, partition)] += record_count
+        self.records += record_count
+
+        if self.keep_batches:
+            self.batches.append((topic, partition, buffer))
+
+        return base_offset
+
+    def values(self, topic: str) -> List[bytes]:
+        values = []
+
+        for batch_topic, _partition, buffer in self.batches:
+            if batch_topic != topic:
+                continue
+
+            records = memory_records.MemoryRecords(buffer)
+
+            while records.has_next():
+                values.extend(record.value for record in records.next_batch())
+
+        return values
+
+
+class _Batch:
+    __slots__ = ('builder', 'futures', 'created')
+
+    def __init__(self, compression: int, batch_size: int):
+        self.builder = memory_records.MemoryRecordsBuilder(2, compression, batch_size)
+        self.futures: List[Tuple[future.Future, int, int]] = []
+        self.created = time.monotonic()
+
+
+class StandInProducer:
+    """
+    Mimics the parts of `kafka.KafkaProducer` used by the pipelines. There is no I/O thread: batches are sent when
+    they are full, when they lingered long enough (checked on every `send`) or on `flush`.
+    """
+
+    def __init__(
+            self,
+            broker: StandInBroker,
+            batch_size: int = 16384,
+            linger_ms: int = 0,
+            compression_type: Optional[str] = None,
+            value_serializer: Optional[Callable[[Any], bytes]] = None,
+            key_serializer: Optional[Callable[[Any], bytes]] = None,
+            partitioner: Optional[Callable[[bytes, List[int], List[int]], int]] = None,
+            **_configs
+    ):
+        self.broker = broker
+        self.batch_size = batch_size
+        self.linger = linger_ms / 1000
+        self.compression = _CODECS[compression_type]
+        self.value_serializer = value_serializer
+        self.key_serializer = key_serializer
+        self.partitioner = partitioner or DefaultPartitioner()
+        self.round_robin = itertools.cycle(range(broker.partitions))
+        self.batches: Dict[Tuple[str, int], _Batch] = {}
+        self.closed = False
+
+    def bootstrap_connected(self) -> bool:
+        return True
+
+    def partitions_for(self, _topic: str):
+        return set(range(self.broker.partitions))
+
+    def send(self, topic: str, value: Any = None, key: Any = None, partition: Optional[int] = None) -> future.Future:
+        assert not self.closed, 'StandInProducer is closed'
+
+        key_bytes = self.key_serializer(key) if self.key_serializer and key is not None else key
+        value_bytes = self.value_serializer(value) if self.value_serializer and value is not None else value
+
+        if partition is None:
+            partition = self._partition(key_bytes)
+
+        batch = self.batches.get((topic, partition))
+
+        if batch is None:
+            batch = self.batches[(topic, partition)] = _Batch(self.compression, self.batch_size)
+
+        if batch.builder.append(int(time.time() * 1000), key_bytes, value_bytes) is None:
+            self._send_batch(topic, partition)
+            batch = self.batches[(topic, partition)] = _Batch(self.compression, self.batch_size)
+            batch.builder.append(int(time.time() * 1000), key_bytes, value_bytes)
+
+        record_future = future.Future()
+        batch.futures.append((record_future, len(key_bytes or b''), len(value_bytes or b'')))
+
+        if self.linger == 0 or batch.builder.is_full():
+            self._send_batch(topic, partition)
+        else:
+            self._send_lingering()
+
+        return record_future
+
+    def flush(self, timeout: Optional[float] = None):
+        for topic, partition in list(self.batches):
+            self._send_batch(topic, partition)
+
+    def close(self, timeout: Optional[float] = None):
+        self.flush()
+        self.closed = True
+
+    def _partition(self, key_bytes: Optional[bytes]) -> int:
+        partitions = list(range(self.broker.partitions))
+
+        if key_bytes is None:
+            return next(self.round_robin)
+
+        return self.partitioner(key_bytes, partitions, partitions)
+
+    def _send_lingering(self):
+        now = time.monotonic()
+
+        for (topic, partition), batch in list(self.batches.items()):
+            if now - batch.created >= self.linger:
+                self._send_batch(topic, partition)
+
+    def _send_batch(self, topic: str, partition: int):
+        batch = self.batches.pop((topic, partition), None)
+
+        if batch is None or not batch.futures:
+            return
+
+        batch.builder.close()
+        base_offset = self.broker.produce(topic, partition, batch.builder.buffer(), len(batch.futures))
+
+        for index, (record_future, key_size, value_size) in enumerate(batch.futures):
+            if base_offset is None:
+                record_future.failure(errors.KafkaError(f'Stand-in broker rejected batch for {topic}-{partition}'))
+            else:
+                record_future.success(DeliveryReport(topic, partition, base_offset + index, key_size, value_size))
@@ -0,0 +1,359 @@
+"""
+Micro-benchmarks of the scrapers' hot paths, run offline on the airline responses in `fixtures`.
+
+The fixtures are shaped after the responses the spiders parse, and are enlarged by repeating their fares or offers.
+Every case runs in a fresh process, so its peak RSS is its own, and reports:
+- the operations and the items (fares parsed, requests built, records serialized) per second, best of `--rounds`;
+- the median time of an operation relative to a fixed calibration workload, which is what is compared;
+- the most memory one operation holds at once and what it does not release, as seen by tracemalloc;
+- the peak RSS of the process running it.
+
+Results are compared to `baseline.json`, the command fails when a case is slower or allocates more than the baseline
+by more than `--tolerance`. Baselines only compare on the same machine, save a new one with `--save-baseline` after
+an intended change or when moving the suite to a different machine.
+
+Usage (from the `scrapers` directory):
+    python -m benchmarks.suite                      # all the cases, compared to the baseline
+    python -m benchmarks.suite parse/RyanAir        # only the cases starting with `parse/RyanAir`
+    python -m benchmarks.suite --save-baseline
+"""
+import argparse
+import copy
+import datetime
+import gc
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import statistics
+import sys
+import time
+import tracemalloc
+
+from typing import Callable, Dict, List, NamedTuple, Tuple
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+WINDOW_START = datetime.date(2023, 7, 1)
+WINDOW_END = datetime.date(2023, 7, 30)
+
+
+class Case(NamedTuple):
+    # Builds what the case needs, outside of the measurements, and returns a single operation returning its items
+    setup: Callable[[], Callable[[], int]]
+
+
+def fixture(name: str) -> dict:
+    with open(os.path.join(FIXTURES, name), 'r') as f:
+        return json.load(f)
+
+
+def enlarged(data: dict, path: List[str], times: int) -> bytes:
+    data = copy.deepcopy(data)
+    parent = data
+
+    for key in path[:-1]:
+        parent = parent[key]
+
+    parent[path[-1]] *= times
+
+    return json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+
+def parse_case(spider_factory: Callable, url: str, body: bytes, meta: Callable[[object], dict], **response_kwargs):
+    def setup() -> Callable[[], int]:
+        from scrapy import http
+
+        spider = spider_factory()
+
+        def operation() -> int:
+            # A new response every time, `TextResponse` caches its decoded text and json
+            request = http.Request(url, meta=meta(spider))
+            response = http.TextResponse(url, body=body, encoding='utf-8', request=request, **response_kwargs)
+
+            return sum(1 for _ in spider.parse(response))
+
+        return operation
+
+    return Case(setup)
+
+
+def ryanair_parse(times: int) -> Case:
+    from scrapers.spiders import RyanAir
+
+    return parse_case(
+        RyanAir.RyanairSpider,
+        RyanAir.RyanairSpider.API_ENDPOINT_TEMPLATE.format('BSL', 'AMS'),
+        enlarged(fixture('ryanair_cheapest_per_day.json'), ['outbound', 'fares'], times),
+        lambda spider: {'route_window': spider.route_window(spider.routes_to_scrape()[0], WINDOW_START, WINDOW_END)},
+    )
+
+
+def wizzair_parse(times: int) -> Case:
+    from scrapers.spiders import WizzAir
+
+    return parse_case(
+        WizzAir.WizzairSpider,
+        WizzAir.WizzairSpider.API_ENDPOINT,
+        enlarged(fixture('wizzair_timetable.json'), ['outboundFlights'], times),
+        lambda spider: {'route_window': spider.route_window(spider.routes_to_scrape()[0], WINDOW_START, WINDOW_END)},
+        headers=fixture('wizzair_timetable_headers.json'),
+    )
+
+
+def easyjet_parse(times: int) -> Case:
+    from scrapers import airline_route
+    from scrapers.spiders import EasyJet
+
+    day = datetime.date(2023, 7, 14)
+
+    return parse_case(
+        EasyJet.EasyJetSpider,
+        EasyJet.EasyJetSpider.API_ENDPOINT,
+        enlarged(fixture('easyjet_search.json'), ['data', 'search', 'offers'], times),
+        lambda spider: {'route_window': spider.route_window(airline_route.Route('BSL', 'AMS'), day, day)},
+    )
+
+
+def easyjet_batched_parse(searches: int) -> Case:
+    from scrapers import airline_route
+    from scrapers.spiders import EasyJet
+
+    route = airline_route.Route('BSL', 'AMS')
+    days = [WINDOW_START + datetime.timedelta(days=i) for i in range(searches)]
+    best_offers = fixture('easyjet_search.json')['data']['search']['bestOffers']
+    body = json.dumps({'data': {f'd{i}': {'bestOffers': best_offers} for i in range(searches)}}).encode('utf-8')
+
+    return parse_case(
+        EasyJet.EasyJetSpider,
+        EasyJet.EasyJetSpider.API_ENDPOINT,
+        body,
+        lambda spider: {'route_window': spider.route_window(route, days[0], days[-1]), 'route': route, 'dates': days},
+    )
+
+
+def prepare_request(spider_factory: Callable) -> Case:
+    def setup() -> Callable[[], int]:
+        from scrapers import airline_route
+
+        spider = spider_factory()
+        route = airline_route.Route('BSL', 'AMS')
+
+        return lambda: len(spider.prepare_request(route, WINDOW_START, WINDOW_END))
+
+    return Case(setup)
+
+
+def wizzair_session_response() -> Case:
+    def setup() -> Callable[[], int]:
+        import tempfile
+
+        import scrapy
+        from scrapy import http
+        from scrapers import wizzair_session
+        from scrapers.spiders import WizzAir
+
+        store = wizzair_session.VersionStore(os.path.join(tempfile.mkdtemp(), 'wizzair_session.json'))
+        session = wizzair_session.WizzAirSession(
+            store, WizzAir.WizzairSpider.BUILD_NUMBER_URL, '19.1.0', datetime.timedelta(days=1)
+        )
+        session.state = wizzair_session.READY
+        request = scrapy.Request(WizzAir.WizzairSpider.API_ENDPOINT, method='POST')
+        response = http.TextResponse(
+            WizzAir.WizzairSpider.API_ENDPOINT, body=b'{}', headers=fixture('wizzair_timetable_headers.json')
+        )
+
+        def operation() -> int:
+            session.on_response(request, response)
+            session.prepare(request, download=None)
+            return len(response.headers.getlist('Set-Cookie'))
+
+        return operation
+
+    return Case(setup)
+
+
+def serialize(records: int) -> Case:
+    def setup() -> Callable[[], int]:
+        from benchmarks import kafka_delivery
+        from scrapers import pipelines
+
+        fares = list(kafka_delivery.fares(records // 180, 180))
+
+        def operation() -> int:
+            for fare in fares:
+                pipelines.serialize_value(fare)
+
+            return len(fares)
+
+        return operation
+
+    return Case(setup)
+
+
+def cases() -> Dict[str, Callable[[], Case]]:
+    # Only built, fixtures included, in the process running the case
+    from scrapers.spiders import EasyJet, RyanAir, WizzAir
+
+    return {
+        'parse/RyanAir/x1': lambda: ryanair_parse(1),
+        'parse/RyanAir/x10': lambda: ryanair_parse(10),
+        'parse/WizzAir/x1': lambda: wizzair_parse(1),
+        'parse/WizzAir/x10': lambda: wizzair_parse(10),
+        'parse/EasyJet/x1': lambda: easyjet_parse(1),
+        'parse/EasyJet/x100': lambda: easyjet_parse(100),
+        'parse/EasyJet/batched10': lambda: easyjet_batched_parse(10),
+        'prepare_request/RyanAir': lambda: prepare_request(RyanAir.RyanairSpider),
+        'prepare_request/WizzAir': lambda: prepare_request(WizzAir.WizzairSpider),
+        'prepare_request/EasyJet': lambda: prepare_request(EasyJet.EasyJetSpider),
+        'session/WizzAir': wizzair_session_response,
+        'serialize/FareRecord': lambda: serialize(18000),
+    }
+
+
+def calibration() -> int:
+    """
+    Fixed pure Python work timed next to every case, the cases are compared by their time relative to it, which is
+    steadier than their raw time on a busy machine
+    """
+    data = json.loads(json.dumps([{'day': i, 'price': {'value': i * 1.5, 'currencyCode': 'EUR'}} for i in range(200)]))
+
+    return sum(1 for fare in data if fare['price']['value'] > 10)
+
+
+def timed(operation: Callable[[], int], min_time: float) -> float:
+    """
+    Seconds one call of `operation` takes, calling it for at least `min_time` seconds
+    """
+    count, started, elapsed = 0, time.perf_counter(), 0.0
+
+    while elapsed < min_time:
+        operation()
+        count += 1
+        elapsed = time.perf_counter() - started
+
+    return elapsed / count
+
+
+def measure(name: str, rounds: int, min_time: float) -> Dict[str, float]:
+    # The spiders log every parsed response
+    logging.disable(logging.CRITICAL)
+
+    operation = cases()[name]().setup()
+    # Warms up caches and lazy imports before anything is measured
+    items = operation()
+
+    tracemalloc.start()
+    operation()
+    # Whatever the first traced operation left behind belongs to the warm up
+    before, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    operation()
+    after, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    best, relative = float('inf'), []
+
+    for _ in range(rounds):
+        # Like `timeit`, collections would land on whichever case crosses the thresholds
+        gc.collect()
+        gc.disable()
+        reference = timed(calibration, min_time / 4)
+        seconds = timed(operation, min_time)
+        gc.enable()
+
+        best = min(best, seconds)
+        relative.append(seconds / reference)
+
+    return {
+        'ops_per_sec': 1 / best,
+        'items_per_sec': items / best,
+        # Median time of an operation in calibration runs, what the comparison with the baseline uses. Unlike the best
+        # time, the median does not keep a lucky round as the bar every later run is held to
+        'relative_cost': statistics.median(relative),
+        # Most memory one operation held at once, and what it did not release
+        'peak_alloc_bytes_per_op': peak - before,
+        'retained_bytes_per_op': max(after - before, 0),
+        # Kilobytes on Linux
+        'peak_rss_kib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def regressions(result: Dict[str, float], baseline: Dict[str, float], tolerance: float) -> List[str]:
+    found = []
+
+    if result['relative_cost'] > baseline['relative_cost'] * (1 + tolerance):
+        found.append(f'{result["relative_cost"] / baseline["relative_cost"] - 1:+.0%} time')
+
+    for key in ['peak_alloc_bytes_per_op', 'retained_bytes_per_op', 'peak_rss_kib']:
+        # Small allocations vary with what the interpreter happens to cache
+        if result[key] > baseline[key] * (1 + tolerance) + 4096:
+            found.append(f'{result[key] / max(baseline[key], 1) - 1:+.0%} {key}')
+
+    return found
+
+
+def run(names: List[str], rounds: int, min_time: float) -> Dict[str, Dict[str, float]]:
+    context = multiprocessing.get_context('spawn')
+    results = {}
+
+    for name in names:
+        # A process per case, so that the peak RSS is the case's
+        with context.Pool(1) as pool:
+            results[name] = pool.apply(measure, (name, rounds, min_time))
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('prefixes', nargs='*', help='Run only the cases starting with one of these')
+    parser.add_argument('--rounds', type=int, default=7)
+    parser.add_argument('--min-time', type=float, default=0.2, help='Seconds every round lasts at least')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Slowdown or growth failing the comparison')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    args = parser.parse_args()
+
+    names = [name for name in cases() if not args.prefixes or any(name.startswith(p) for p in args.prefixes)]
+    results = run(names, args.rounds, args.min_time)
+
+    try:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        baseline = {}
+
+    failed: List[Tuple[str, List[str]]] = []
+    print(f'{"case":<26} {"ops/s":>10} {"items/s":>12} {"peak KiB/op":>12} {"kept B/op":>10} {"RSS MiB":>8}  baseline')
+
+    for name, result in results.items():
+        found = regressions(result, baseline[name], args.tolerance) if name in baseline else []
+        compared = 'missing' if name not in baseline else ', '.join(found) if found else 'ok'
+
+        if found:
+            failed.append((name, found))
+
+        print(
+            f'{name:<26} {result["ops_per_sec"]:>10.0f} {result["items_per_sec"]:>12.0f} '
+            f'{result["peak_alloc_bytes_per_op"] / 1024:>12.1f} {result["retained_bytes_per_op"]:>10.0f} '
+            f'{result["peak_rss_kib"] / 1024:>8.1f}  {compared}'
+        )
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({**baseline, **results}, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+        print(f'Saved {len(results)} results to {args.baseline}')
+        return
+
+    if failed:
+        print(f'{len(failed)} regressions against {args.baseline}', file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,11 @@
 from __future__ import annotations
 
 import dataclasses
+import datetime
 import dataclasses_json
 
+from typing import NamedTuple
+
 @dataclasses_json.dataclass_json
 @dataclasses.dataclass
 class Route:
@@ -10,4 +13,26 @@ class Route:
     destination: str
 
     def return_route(self) -> Route:
-        return Route(self.destination, self.source)
\ No newline at end of file
+        return Route(self.destination, self.source)
+
+    def key(self) -> str:
+        return f'{self.source}-{self.destination}'
+
+    @staticmethod
+    def from_key(key: str) -> Route:
+        source, destination = key.strip().split('-')
+        return Route(source, destination)
+
+
+class RouteWindow(NamedTuple):
+    """
+    A route searched over a window of departure dates by an airline, the unit of work behind every request
+    """
+    airline: str
+    source: str
+    destination: str
+    start: datetime.date
+    end: datetime.date
+
+    def key(self) -> str:
+        return f'{self.airline}/{self.source}-{self.destination}/{self.start.isoformat()}/{self.end.isoformat()}'
@@ -0,0 +1,92 @@
+"""
+Minimal client of the ClickHouse HTTP interface, keeping its connection open between queries.
+
+See https://clickhouse.com/docs/en/interfaces/http
+"""
+import http.client
+import json
+import logging
+
+from typing import Dict, List, Optional
+from urllib import parse
+
+
+class ClickHouseError(Exception):
+    """
+    Query answered with an error, the message ClickHouse sent is the exception's
+    """
+
+
+class ClickHouseClient:
+    def __init__(self, url: str, user: str = 'default', password: str = '', timeout: float = 300):
+        url_parts = parse.urlsplit(url)
+        self.connection_class = http.client.HTTPSConnection if url_parts.scheme == 'https' \
+            else http.client.HTTPConnection
+        self.host = url_parts.netloc
+        self.headers = {'X-ClickHouse-User': user}
+
+        if password:
+            self.headers['X-ClickHouse-Key'] = password
+
+        self.timeout = timeout
+        self.connection: Optional[http.client.HTTPConnection] = None
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def _post(self, path: str, body: bytes) -> http.client.HTTPResponse:
+        # A connection closed by the server while idle is only noticed when used, it is opened again once
+        for attempt in range(2):
+            if self.connection is None:
+                self.connection = self.connection_class(self.host, timeout=self.timeout)
+
+            try:
+                self.connection.request('POST', path, body=body, headers=self.headers)
+                return self.connection.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                self.close()
+
+                if attempt:
+                    raise
+
+    def execute(self, query: str, data: bytes = b'', **settings) -> bytes:
+        """
+        Runs a single statement and returns what ClickHouse answered. `data` is sent after `query`, the rows of an
+        `INSERT ... FORMAT`, and `settings` are ClickHouse settings of this query only
+        """
+        params = {name: str(value) for name, value in settings.items()}
+
+        if data:
+            params['query'] = query
+            body = data
+        else:
+            body = query.encode()
+
+        response = self._post(f'/?{parse.urlencode(params)}', body)
+        answer = response.read()
+
+        if response.status != 200:
+            raise ClickHouseError(answer.decode(errors='replace').strip())
+
+        return answer
+
+    def rows(self, query: str, **settings) -> List[Dict]:
+        """
+        Rows selected by `query`, which must not have a `FORMAT` clause
+        """
+        # Counts are UInt64, quoted in JSON by default
+        settings.setdefault('output_format_json_quote_64bit_integers', 0)
+        answer = self.execute(f'{query} FORMAT JSONEachRow', **settings)
+
+        return [json.loads(line) for line in answer.splitlines() if line]
+
+    def value(self, query: str, **settings):
+        """
+        First column of the first row selected by `query`, None without rows
+        """
+        rows = self.rows(query, **settings)
+
+        return next(iter(rows[0].values())) if rows else None
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
@@ -0,0 +1,419 @@
+"""
+Versioned migrations of the ClickHouse tables, applied in version order over the HTTP interface.
+
+Every directory of `CLICKHOUSE_MIGRATIONS_DIR` is a migration, its name starting with its version. Migrations whose
+`check.sql` selects 1 are already in place, the tables created by the `up.sql` files of fresh deployments are, and are
+only recorded. The others are either:
+- `up.sql` statements, applied once;
+- a rewrite of `flights` into a new layout, without downtime. `shadow.sql` creates `flights_next` and a view filling it
+  from the Kafka queue, so new rows go to both tables from then on. The rows scraped before are copied month by month,
+  then both tables are compared by scrape day, and once all the days match `swap.sql` swaps the tables. The old one is
+  kept as `flights_previous` until `drop-previous`.
+
+Tables aggregating `flights`, like the `daily_prices` rollup, are filled with the scrapes before their migration by its
+`rebuild.<table>.sql`, and `rebuild` fills them again from `flights` by the one of the last migration applied. They
+are rebuilt a month at a time into a staging table replacing the month's partition at once, the dashboards never see a
+month half rebuilt. `{{ kafka_consumers }}` in `up.sql` stands for the consumers of the deployed Kafka queue.
+
+The scrape day the shadow table was created on has rows only in `flights`, the ones scraped before, so it is copied
+again once its crawl is over: `up` stops before the swap until then, run it again the next day. Applied steps are
+recorded in `schema_migrations`, an interrupted `up` resumes where it stopped.
+
+Usage (from the `scrapers` directory):
+    python -m scrapers.clickhouse_migrate status
+    python -m scrapers.clickhouse_migrate up
+    python -m scrapers.clickhouse_migrate abort 0001_flights_route_first
+    python -m scrapers.clickhouse_migrate rebuild daily_prices --from-month 202307
+    python -m scrapers.clickhouse_migrate drop-previous
+"""
+import argparse
+import datetime
+import glob
+import logging
+import os
+import re
+import sys
+
+from typing import Dict, List, NamedTuple, Optional
+
+from . import clickhouse_http, settings
+
+TABLE = 'flights'
+# Tables of a rewrite of `TABLE`, before and after it is swapped
+NEXT_TABLE = 'flights_next'
+PREVIOUS_TABLE = 'flights_previous'
+
+# Steps recorded in `schema_migrations`
+SHADOW = 'shadow'
+BACKFILL_STARTED = 'backfill_started'
+BACKFILL = 'backfill'
+SWAP = 'swap'
+APPLIED = 'applied'
+
+# Placeholder of the consumers of the Kafka queue, in the files creating it
+KAFKA_CONSUMERS = '{{ kafka_consumers }}'
+
+
+class Migration(NamedTuple):
+    version: str
+    path: str
+
+    def sql(self, name: str) -> Optional[str]:
+        try:
+            with open(os.path.join(self.path, f'{name}.sql'), 'r') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    @property
+    def rewrite(self) -> bool:
+        return os.path.exists(os.path.join(self.path, 'shadow.sql'))
+
+    def rebuilds(self) -> List[str]:
+        """
+        Tables the migration fills from `flights`, each one by its `rebuild.<table>.sql`
+        """
+        return [
+            os.path.basename(path)[len('rebuild.'):-len('.sql')]
+            for path in sorted(glob.glob(os.path.join(self.path, 'rebuild.*.sql')))
+        ]
+
+
+def migrations(directory: str) -> List[Migration]:
+    return [
+        Migration(os.path.basename(path), path)
+        for path in sorted(glob.glob(os.path.join(directory, '[0-9]*'))) if os.path.isdir(path)
+    ]
+
+
+def statements(sql: str) -> List[str]:
+    """
+    Statements of a SQL file, the HTTP interface runs one per query
+    """
+    without_comments = re.sub(r'--[^\n]*', '', sql)
+
+    return [statement.strip() for statement in without_comments.split(';') if statement.strip()]
+
+
+def mismatched_days(
+    current: Dict[str, int],
+    copied: Dict[str, int],
+    before: datetime.date
+) -> List[datetime.date]:
+    """
+    Scrape days before `before` without the same number of rows in both tables, by their counts per ISO day
+    """
+    days = {day for day in current.keys() | copied.keys() if datetime.date.fromisoformat(day) < before}
+
+    return sorted(datetime.date.fromisoformat(day) for day in days if current.get(day, 0) != copied.get(day, 0))
+
+
+def clickhouse_quote(value: str) -> str:
+    return "'" + value.replace('\\', '\\\\').replace("'", "\\'") + "'"
+
+
+class MigrationError(Exception):
+    pass
+
+
+class Migrator:
+    def __init__(self, client: clickhouse_http.ClickHouseClient, database: str, today: Optional[datetime.date] = None):
+        self.client = client
+        self.database = database
+        self.today = today or datetime.date.today()
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def _run(self, sql: str):
+        for statement in statements(sql):
+            self.client.execute(statement)
+
+    def _render(self, sql: str) -> str:
+        """
+        `sql` with the Kafka consumers of the deployed queue, the `flights` files are templates rendered by
+        `pipeline.up.yml`, and so are the migrations creating the queue again
+        """
+        if KAFKA_CONSUMERS not in sql:
+            return sql
+
+        consumers = self.client.value(
+            f"SELECT extract(engine_full, 'kafka_num_consumers = ([0-9]+)') FROM system.tables "
+            f"WHERE database = {clickhouse_quote(self.database)} AND name = 'kafka_queue'"
+        )
+
+        return sql.replace(KAFKA_CONSUMERS, consumers or '1')
+
+    def _ensure_state_table(self):
+        self.client.execute(
+            f'CREATE TABLE IF NOT EXISTS {self.database}.schema_migrations '
+            f'(version String, step String, detail String, applied_at DateTime DEFAULT now()) '
+            f'ENGINE = MergeTree ORDER BY (version, step)'
+        )
+
+    def steps(self, version: str) -> Dict[str, List[str]]:
+        steps: Dict[str, List[str]] = {}
+        rows = self.client.rows(
+            f'SELECT step, detail FROM {self.database}.schema_migrations '
+            f'WHERE version = {clickhouse_quote(version)} ORDER BY applied_at'
+        )
+
+        for row in rows:
+            steps.setdefault(row['step'], []).append(row['detail'])
+
+        return steps
+
+    def _record(self, version: str, step: str, detail: str = ''):
+        self.client.execute(
+            f'INSERT INTO {self.database}.schema_migrations (version, step, detail) VALUES '
+            f'({clickhouse_quote(version)}, {clickhouse_quote(step)}, {clickhouse_quote(detail)})'
+        )
+
+    def up(self) -> bool:
+        """
+        Applies the migrations not applied yet, in order. False when a rewrite waits for its shadow day to be over
+        """
+        self._ensure_state_table()
+
+        for migration in migrations(settings.CLICKHOUSE_MIGRATIONS_DIR):
+            steps = self.steps(migration.version)
+
+            if APPLIED in steps:
+                continue
+
+            check = migration.sql('check')
+
+            if not steps and check is not None and self.client.value(statements(check)[0]) == 1:
+                self.logger.info(f'{migration.version} is already in place')
+                self._record(migration.version, APPLIED)
+                continue
+
+            if migration.rewrite:
+                if not self._rewrite(migration, steps):
+                    return False
+            else:
+                self.logger.info(f'Applying {migration.version}')
+                self._run(self._render(migration.sql('up')))
+
+                for table in migration.rebuilds():
+                    self._rebuild(migration, table)
+
+            self._record(migration.version, APPLIED)
+            self.logger.info(f'{migration.version} applied')
+
+        return True
+
+    def _columns(self, table: str) -> List[str]:
+        rows = self.client.rows(
+            f'SELECT name FROM system.columns WHERE database = {clickhouse_quote(self.database)} '
+            f'AND table = {clickhouse_quote(table)} ORDER BY position'
+        )
+
+        return [row['name'] for row in rows]
+
+    def _copy(self, condition: str):
+        next_columns = set(self._columns(NEXT_TABLE))
+        # Columns added by the rewrite get their default
+        columns = ', '.join(column for column in self._columns(TABLE) if column in next_columns)
+        self.client.execute(
+            f'INSERT INTO {self.database}.{NEXT_TABLE} ({columns}) '
+            f'SELECT {columns} FROM {self.database}.{TABLE} WHERE {condition}'
+        )
+
+    def _delete(self, condition: str):
+        # Waits for the mutation, the rows copied next must not be deleted with these
+        self.client.execute(
+            f'ALTER TABLE {self.database}.{NEXT_TABLE} DELETE WHERE {condition}', mutations_sync=2
+        )
+
+    def _counts(self, table: str, before: datetime.date) -> Dict[str, int]:
+        rows = self.client.rows(
+            f'SELECT toString(scrape_date) AS day, count() AS rows FROM {self.database}.{table} '
+            f'WHERE scrape_date < {clickhouse_quote(before.isoformat())} GROUP BY day'
+        )
+
+        return {row['day']: row['rows'] for row in rows}
+
+    def _rewrite(self, migration: Migration, steps: Dict[str, List[str]]) -> bool:
+        version = migration.version
+
+        if SHADOW not in steps:
+            self.logger.info(f'{version}: creating {NEXT_TABLE}, new rows go to both tables from now on')
+            self._run(migration.sql('shadow'))
+            self._record(version, SHADOW, self.today.isoformat())
+            steps[SHADOW] = [self.today.isoformat()]
+
+        shadow_day = datetime.date.fromisoformat(steps[SHADOW][0])
+        months = self.client.rows(
+            f'SELECT DISTINCT toYYYYMM(scrape_date) AS month FROM {self.database}.{TABLE} '
+            f'WHERE scrape_date < {clickhouse_quote(shadow_day.isoformat())} ORDER BY month'
+        )
+
+        for month in (str(row['month']) for row in months):
+            if month in steps.get(BACKFILL, []):
+                continue
+
+            condition = f'toYYYYMM(scrape_date) = {month} AND scrape_date < {clickhouse_quote(shadow_day.isoformat())}'
+
+            if month in steps.get(BACKFILL_STARTED, []):
+                # Whatever an interrupted copy inserted
+                self._delete(condition)
+
+            self.logger.info(f'{version}: copying the scrapes of {month}')
+            self._record(version, BACKFILL_STARTED, month)
+            self._copy(condition)
+            self._record(version, BACKFILL, month)
+
+        # Today's rows may still be arriving, they go to both tables anyway
+        mismatched = mismatched_days(self._counts(TABLE, self.today), self._counts(NEXT_TABLE, self.today), self.today)
+
+        if shadow_day in mismatched:
+            self.logger.info(f'{version}: copying again the scrapes of {shadow_day}, the day {NEXT_TABLE} was created')
+            condition = f'scrape_date = {clickhouse_quote(shadow_day.isoformat())}'
+            self._delete(condition)
+            self._copy(condition)
+            after = shadow_day + datetime.timedelta(days=1)
+
+            if shadow_day not in mismatched_days(self._counts(TABLE, after), self._counts(NEXT_TABLE, after), after):
+                mismatched.remove(shadow_day)
+
+        if mismatched:
+            raise MigrationError(
+                f'{version}: {TABLE} and {NEXT_TABLE} have different rows scraped on {", ".join(map(str, mismatched))}'
+            )
+
+        if shadow_day >= self.today:
+            self.logger.warning(f'{version}: waiting for the scrapes of {shadow_day} to be over before swapping the '
+                                f'tables, run again tomorrow')
+            return False
+
+        self.logger.info(f'{version}: swapping {TABLE} and {NEXT_TABLE}, the old table is kept as {PREVIOUS_TABLE}')
+        self._run(migration.sql('swap'))
+        self._record(version, SWAP)
+        return True
+
+    def _rebuild(self, migration: Migration, table: str, from_month: Optional[int] = None):
+        rows = self.client.rows(
+            f'SELECT DISTINCT toYYYYMM(scrape_date) AS month FROM {self.database}.{TABLE} '
+            f'WHERE toYYYYMM(scrape_date) >= {from_month or 0} ORDER BY month'
+        )
+        yesterday = clickhouse_quote((self.today - datetime.timedelta(days=1)).isoformat())
+        sql = migration.sql(f'rebuild.{table}')
+        staging = f'{self.database}.{table}_rebuild'
+        self.client.execute(f'DROP TABLE IF EXISTS {staging}')
+        self.client.execute(f'CREATE TABLE {staging} AS {self.database}.{table}')
+
+        for month in (row['month'] for row in rows):
+            self.logger.info(f'{migration.version}: rebuilding the scrapes of {month} into {table}')
+            self.client.execute(f'TRUNCATE TABLE {staging}')
+            self._run(sql.format(table=staging, condition=f'toYYYYMM(scrape_date) = {month}'))
+            self.client.execute(f'ALTER TABLE {self.database}.{table} REPLACE PARTITION {month} FROM {staging}')
+            # Rows inserted by the view after they were aggregated into the staging table
+            self._run(sql.format(
+                table=f'{self.database}.{table}',
+                condition=f'toYYYYMM(scrape_date) = {month} AND scrape_date >= {yesterday}',
+            ))
+
+        self.client.execute(f'DROP TABLE {staging}')
+
+    def _migration(self, version: str) -> Migration:
+        migration = next((m for m in migrations(settings.CLICKHOUSE_MIGRATIONS_DIR) if m.version == version), None)
+
+        if migration is None:
+            raise MigrationError(f'No migration {version} in {settings.CLICKHOUSE_MIGRATIONS_DIR}')
+
+        return migration
+
+    def rebuild(self, table: str, from_month: Optional[int] = None):
+        """
+        Fills `table` again from `flights`, the scrapes of `from_month` and after only, by the `rebuild.<table>.sql`
+        of the last migration applied that has one
+        """
+        self._ensure_state_table()
+        migration = next((
+            m for m in reversed(migrations(settings.CLICKHOUSE_MIGRATIONS_DIR))
+            if table in m.rebuilds() and APPLIED in self.steps(m.version)
+        ), None)
+
+        if migration is None:
+            raise MigrationError(f'No migration applied rebuilds {table}')
+
+        self._rebuild(migration, table, from_month)
+
+    def abort(self, version: str):
+        """
+        Gives up on a migration not applied yet
+        """
+        self._ensure_state_table()
+        migration = self._migration(version)
+        steps = self.steps(version)
+
+        if SWAP in steps or APPLIED in steps:
+            raise MigrationError(f'{version} is applied already')
+
+        self._run(migration.sql('down') or '')
+        self.client.execute(
+            f'ALTER TABLE {self.database}.schema_migrations DELETE WHERE version = {clickhouse_quote(version)}',
+            mutations_sync=2,
+        )
+        self.logger.info(f'{version} aborted')
+
+    def drop_previous(self):
+        self.client.execute(f'DROP TABLE IF EXISTS {self.database}.{PREVIOUS_TABLE}')
+
+    def status(self) -> List[str]:
+        self._ensure_state_table()
+        lines = []
+
+        for migration in migrations(settings.CLICKHOUSE_MIGRATIONS_DIR):
+            steps = self.steps(migration.version)
+
+            if APPLIED in steps:
+                state = 'applied'
+            elif SHADOW in steps:
+                state = f'shadow table since {steps[SHADOW][0]}, {len(steps.get(BACKFILL, []))} months copied'
+            else:
+                state = 'pending'
+
+            lines.append(f'{migration.version:<40} {state}')
+
+        return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default=settings.CLICKHOUSE_URL, help='ClickHouse HTTP interface')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('status', help='Migrations and how far they got')
+    commands.add_parser('up', help='Apply the pending migrations')
+    abort = commands.add_parser('abort', help='Give up on a rewrite before its swap')
+    abort.add_argument('version')
+    rebuild = commands.add_parser('rebuild', help='Fill a table aggregating flights again from flights')
+    rebuild.add_argument('table')
+    rebuild.add_argument('--from-month', type=int, help='First month of scrapes to rebuild, as YYYYMM')
+    commands.add_parser('drop-previous', help=f'Drop {PREVIOUS_TABLE}, the table the last rewrite replaced')
+    args = parser.parse_args()
+
+    logging.basicConfig(format=settings.LOG_FORMAT, level=settings.LOG_LEVEL)
+    client = clickhouse_http.ClickHouseClient(args.url, settings.CLICKHOUSE_USER, settings.CLICKHOUSE_PASSWORD)
+    migrator = Migrator(client, settings.CLICKHOUSE_DATABASE)
+
+    try:
+        if args.command == 'status':
+            print('\n'.join(migrator.status()))
+        elif args.command == 'up':
+            # 2 when waiting, so scripts can tell it from an error
+            sys.exit(0 if migrator.up() else 2)
+        elif args.command == 'abort':
+            migrator.abort(args.version)
+        elif args.command == 'rebuild':
+            migrator.rebuild(args.table, args.from_month)
+        else:
+            migrator.drop_previous()
+    except (MigrationError, clickhouse_http.ClickHouseError) as e:
+        logging.getLogger('clickhouse_migrate').error(str(e))
+        sys.exit(1)
+    finally:
+        client.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,345 @@
+"""
+On-demand crawls started through the API server.
+
+Every job runs in a fresh process of a bounded pool: the Twisted reactor cannot be restarted, and a crawl must not
+block the server's event loop. Crawling processes report their progress and their metrics through a queue, drained by
+a thread of the server process into the jobs and the server's metrics.
+"""
+import asyncio
+import concurrent.futures
+import dataclasses
+import datetime
+import fcntl
+import functools
+import logging
+import os
+import threading
+import time
+import uuid
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from scrapy import crawler, signals
+from scrapy.utils import project
+
+from . import airline_route, metrics
+
+QUEUED = 'queued'
+RUNNING = 'running'
+FINISHED = 'finished'
+FAILED = 'failed'
+
+# Seconds between two progress reports of a crawling process
+PROGRESS_INTERVAL = 1.0
+
+# Finished jobs kept around for their status to be polled, the oldest ones are forgotten first
+MAX_FINISHED_JOBS = 1000
+
+# Crawl stats worth returning to the server once a job is done
+REPORTED_STATS = ['elapsed_time_seconds', 'item_scraped_count', 'downloader/request_count', 'finish_reason']
+
+
+@dataclasses.dataclass
+class Job:
+    id: str
+    spider: str
+    # None for all the routes of the spider
+    routes: Optional[List[airline_route.Route]]
+    # `SINK` of the crawl, the one of the settings when None
+    sink: Optional[str] = None
+    status: str = QUEUED
+    created_at: datetime.datetime = dataclasses.field(default_factory=datetime.datetime.now)
+    started_at: Optional[datetime.datetime] = None
+    finished_at: Optional[datetime.datetime] = None
+    progress: Dict[str, Any] = dataclasses.field(default_factory=dict)
+    error: Optional[str] = None
+
+    def route_keys(self) -> List[Optional[str]]:
+        """
+        What the job crawls, as compared to find duplicates. None stands for all the routes
+        """
+        return [route.key() for route in self.routes] if self.routes is not None else [None]
+
+    def to_dict(self) -> dict:
+        d = dataclasses.asdict(self)
+        d['routes'] = [route.key() for route in self.routes] if self.routes is not None else None
+
+        return d
+
+
+def lock_worker_state(state_dir: str, workers: int):
+    """
+    Locks the state directory of the first of the `workers` slots not used by another crawl and returns it, along with
+    the file holding the lock. The stores of a crawl are not shared by the processes crawling at the same time, like the
+    shards of `scrapers.runner`, and still carry over from one job to the next
+    """
+    for slot in range(workers):
+        directory = os.path.join(state_dir, f'api-worker-{slot}')
+        os.makedirs(directory, exist_ok=True)
+        lock = open(os.path.join(directory, 'lock'), 'a')
+
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            continue
+
+        return directory, lock
+
+    raise RuntimeError(f'All the {workers} state directories of {state_dir} are in use')
+
+
+def isolate_state(settings, workers: int):
+    """
+    Moves every path of `settings` kept in their `STATE_DIR` to the state directory of a free worker slot, and returns
+    the file holding its lock
+    """
+    state_dir = settings.get('STATE_DIR')
+    directory, lock = lock_worker_state(state_dir, workers)
+
+    for name, value in list(settings.items()):
+        if isinstance(value, str) and value.startswith(state_dir + os.sep):
+            settings.set(name, os.path.join(directory, os.path.relpath(value, state_dir)), priority='cmdline')
+
+    settings.set('STATE_DIR', directory, priority='cmdline')
+
+    return lock
+
+
+def run_crawl(
+        job_id: str,
+        spider: str,
+        routes: Optional[List[str]],
+        progress,
+        sink: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Crawls `spider` in the current process, which it should be the only one to, and returns some of its stats
+    """
+    progress.put((job_id, {'status': RUNNING}))
+
+    settings = project.get_project_settings()
+    if sink is not None:
+        settings.set('SINK', sink, priority='cmdline')
+
+    # Held until the crawl is over, by the process crawling
+    state_lock = isolate_state(settings, settings.getint('CRAWL_API_WORKERS'))
+
+    process = crawler.CrawlerProcess(settings)
+    c = process.create_crawler(spider)
+    counts = {'responses': 0, 'items': 0}
+    reported = [time.monotonic()]
+
+    def count(key: str):
+        counts[key] += 1
+
+        if time.monotonic() - reported[0] >= PROGRESS_INTERVAL:
+            reported[0] = time.monotonic()
+            progress.put((job_id, {'progress': dict(counts), 'metrics': metrics.REGISTRY.snapshot()}))
+
+    # Signals keep weak references to their receivers, these live until the crawl is over
+    def on_response(**_kwargs):
+        count('responses')
+
+    def on_item(**_kwargs):
+        count('items')
+
+    c.signals.connect(on_response, signal=signals.response_received)
+    c.signals.connect(on_item, signal=signals.item_scraped)
+
+    failures = []
+    process.crawl(c, **({'routes': ','.join(routes)} if routes is not None else {})).addErrback(failures.append)
+    process.start()
+    state_lock.close()
+
+    if failures:
+        # The failure itself might not be picklable
+        raise RuntimeError(f'Crawl of {spider} failed: {failures[0].value!r}')
+
+    stats = c.stats.get_stats()
+
+    return {
+        'progress': counts,
+        'metrics': metrics.REGISTRY.snapshot(),
+        **{key: stats.get(key) for key in REPORTED_STATS},
+    }
+
+
+class JobQueue:
+    """
+    Jobs of the server, queued to the pool of crawling processes.
+
+    A route asked for while a queued job already covers it is not queued again, the job covering it is returned
+    instead. Running jobs only count for the very same routes, they might be past some of them already.
+    """
+
+    def __init__(
+            self,
+            executor: concurrent.futures.Executor,
+            progress,
+            run: Callable[..., Dict[str, Any]] = run_crawl
+    ):
+        self.executor = executor
+        # Queue shared with the crawling processes, holding (job id, update) pairs
+        self.progress = progress
+        self.run = run
+        self.jobs: Dict[str, Job] = {}
+        # Metrics of all the crawls, and the last snapshot received from every running one
+        self.metrics = metrics.Registry()
+        self.job_metrics: Dict[str, metrics.Snapshot] = {}
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.reader: Optional[threading.Thread] = None
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.reader = threading.Thread(target=self._read_progress, name='JobQueueProgress', daemon=True)
+        self.reader.start()
+
+    def stop(self):
+        try:
+            # Wakes the reader up so it can exit
+            self.progress.put(None)
+        except (EOFError, OSError):
+            # The queue's process is already gone, along with the reader
+            pass
+
+        self.reader.join()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def _read_progress(self):
+        while True:
+            try:
+                update = self.progress.get()
+            except (EOFError, OSError):
+                # Interrupted along with the whole process group
+                return
+
+            if update is None:
+                return
+
+            # All the changes of the jobs happen in the event loop
+            self.loop.call_soon_threadsafe(self._apply, *update)
+
+    def _apply(self, job_id: str, update: Dict[str, Any]):
+        job = self.jobs.get(job_id)
+
+        if job is None or job.status in (FINISHED, FAILED):
+            return
+
+        if update.get('status') == RUNNING:
+            job.status = RUNNING
+            job.started_at = datetime.datetime.now()
+
+        if 'progress' in update:
+            job.progress = update['progress']
+
+        if 'metrics' in update:
+            self._merge_metrics(job, update['metrics'])
+
+    def _merge_metrics(self, job: Job, snapshot: metrics.Snapshot):
+        self.metrics.merge(snapshot, self.job_metrics.get(job.id))
+        self.job_metrics[job.id] = snapshot
+
+    def _running_identical(self, spider: str, keys: List[Optional[str]], sink: Optional[str]) -> Optional[Job]:
+        for job in self.jobs.values():
+            if job.spider != spider or job.status != RUNNING or job.sink != sink:
+                continue
+
+            if set(job.route_keys()) == set(keys):
+                return job
+
+        return None
+
+    def _queued_covering(self, spider: str, key: Optional[str], sink: Optional[str]) -> Optional[Job]:
+        for job in self.jobs.values():
+            # Fares going elsewhere do not cover the route
+            if job.spider != spider or job.status != QUEUED or job.sink != sink:
+                continue
+
+            job_keys = job.route_keys()
+
+            # A job crawling all the routes covers every single one of them
+            if key in job_keys or None in job_keys:
+                return job
+
+        return None
+
+    def submit(
+            self,
+            spider: str,
+            routes: Optional[List[airline_route.Route]] = None,
+            sink: Optional[str] = None
+    ) -> Tuple[Optional[Job], List[Job]]:
+        """
+        Queues a crawl of `routes` of `spider`, or all of them, writing its fares to `sink`, and returns it along with
+        the queued jobs already covering some of the routes. No job is queued when all of them are covered, or when a
+        running job crawls the very same routes
+        """
+        # A running job might be past some of the routes, but crawling all of them again right away is no use
+        running = self._running_identical(
+            spider, [route.key() for route in routes] if routes is not None else [None], sink
+        )
+        if running is not None:
+            return None, [running]
+
+        duplicates: Dict[str, Job] = {}
+        remaining = []
+
+        for route in routes if routes is not None else [None]:
+            covering = self._queued_covering(spider, route.key() if route is not None else None, sink)
+
+            if covering is not None:
+                duplicates[covering.id] = covering
+            else:
+                remaining.append(route)
+
+        if not remaining:
+            return None, list(duplicates.values())
+
+        job = Job(uuid.uuid4().hex, spider, remaining if routes is not None else None, sink)
+        self.jobs[job.id] = job
+
+        future = self.loop.run_in_executor(
+            self.executor,
+            self.run,
+            job.id,
+            spider,
+            [route.key() for route in job.routes] if job.routes is not None else None,
+            self.progress,
+            sink,
+        )
+        future.add_done_callback(functools.partial(self._done, job))
+
+        self.logger.info(f'Queued job {job.id} crawling {job.route_keys()} of {spider}')
+
+        return job, list(duplicates.values())
+
+    def _done(self, job: Job, future: asyncio.Future):
+        job.finished_at = datetime.datetime.now()
+
+        if future.cancelled():
+            job.status, job.error = FAILED, 'cancelled'
+        elif future.exception() is not None:
+            job.status, job.error = FAILED, repr(future.exception())
+        else:
+            result = future.result()
+            job.status = FINISHED
+            self._merge_metrics(job, result.pop('metrics'))
+            job.progress = {**result.pop('progress'), **result}
+
+        self.job_metrics.pop(job.id, None)
+
+        self.logger.info(f'Job {job.id} of {job.spider} {job.status}')
+
+        finished = [j for j in self.jobs.values() if j.status in (FINISHED, FAILED)]
+
+        # Jobs are kept in creation order
+        for forgotten in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[forgotten.id]
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.jobs.get(job_id)
+
+    def list(self, spider: Optional[str] = None) -> List[Job]:
+        return [job for job in self.jobs.values() if spider is None or job.spider == spider]
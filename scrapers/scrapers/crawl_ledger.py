@@ -0,0 +1,92 @@
+"""
+Ledger of the route windows every crawl of the day scraped or failed to scrape.
+
+A crawl records every window whose response reached the spider as done, and every window it gave up on as failed with
+its last error. A crawl resumed the same day, after the previous one died or gave up on some windows, only requests the
+windows not done yet.
+
+Spiders report the windows they gave up on with the `window_failed` signal, from their errback.
+"""
+import datetime
+
+from typing import Dict, Optional, Set
+
+from . import airline_route, sqlite_state
+
+# Sent by spiders with the `request` and the `failure` of a window that could not be scraped
+window_failed = object()
+
+DONE = 'done'
+FAILED = 'failed'
+
+
+class CrawlLedger:
+    def __init__(self, path: str, keep_days: int = 7, commit_every: int = 100):
+        self.commit_every = commit_every
+        self.uncommitted = 0
+        self.connection = sqlite_state.connect(path)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS cells ('
+            '   crawl_date TEXT NOT NULL,'
+            '   airline TEXT NOT NULL,'
+            '   route_window TEXT NOT NULL,'
+            '   status TEXT NOT NULL,'
+            '   attempts INTEGER NOT NULL,'
+            '   error TEXT,'
+            '   PRIMARY KEY (crawl_date, airline, route_window)'
+            ') WITHOUT ROWID'
+        )
+        # Only the crawls of the same day are resumed, the older ones are only kept to look into
+        self.connection.execute(
+            'DELETE FROM cells WHERE crawl_date < ?',
+            ((datetime.date.today() - datetime.timedelta(days=keep_days)).isoformat(),)
+        )
+        self.connection.commit()
+
+    def _record(self, window: airline_route.RouteWindow, crawl_date: datetime.date, status: str, attempts: int,
+                error: Optional[str] = None):
+        self.connection.execute(
+            'INSERT INTO cells (crawl_date, airline, route_window, status, attempts, error) VALUES (?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT (crawl_date, airline, route_window) DO UPDATE SET status = excluded.status, '
+            '   attempts = attempts + excluded.attempts, error = excluded.error',
+            (crawl_date.isoformat(), window.airline, window.key(), status, attempts, error)
+        )
+        self.uncommitted += 1
+
+        # Commits often, what was not committed when a crawl dies is requested again by the next one
+        if self.uncommitted >= self.commit_every:
+            self.commit()
+
+    def done(self, window: airline_route.RouteWindow, crawl_date: datetime.date, attempts: int = 1):
+        self._record(window, crawl_date, DONE, attempts)
+
+    def failed(self, window: airline_route.RouteWindow, crawl_date: datetime.date, error: str, attempts: int = 1):
+        self._record(window, crawl_date, FAILED, attempts, error)
+
+    def done_windows(self, airline: str, crawl_date: datetime.date) -> Set[str]:
+        """
+        Keys of the windows of `airline` done by the crawls of `crawl_date`
+        """
+        return {
+            key for key, in self.connection.execute(
+                'SELECT route_window FROM cells WHERE crawl_date = ? AND airline = ? AND status = ?',
+                (crawl_date.isoformat(), airline, DONE)
+            )
+        }
+
+    def counts(self, airline: str, crawl_date: datetime.date) -> Dict[str, int]:
+        """
+        Windows of `airline` in the crawls of `crawl_date`, by status
+        """
+        return dict(self.connection.execute(
+            'SELECT status, COUNT(*) FROM cells WHERE crawl_date = ? AND airline = ? GROUP BY status',
+            (crawl_date.isoformat(), airline)
+        ))
+
+    def commit(self):
+        self.connection.commit()
+        self.uncommitted = 0
+
+    def close(self):
+        self.commit()
+        sqlite_state.release(self.connection)
@@ -0,0 +1,78 @@
+"""
+On-disk index of the last price emitted for every (company, source, destination, flight_date).
+"""
+import datetime
+
+from typing import Optional
+
+from . import items, sqlite_state
+
+# Prices closer than this are considered equal, airlines round to cents
+PRICE_TOLERANCE = 0.005
+
+
+class FareIndex:
+    def __init__(self, path: str, commit_every: int = 10000):
+        self.commit_every = commit_every
+        self.uncommitted = 0
+        self.connection = sqlite_state.connect(path)
+        self.connection.executescript(
+            'CREATE TABLE IF NOT EXISTS fares ('
+            '   company TEXT NOT NULL,'
+            '   source TEXT NOT NULL,'
+            '   destination TEXT NOT NULL,'
+            '   flight_date TEXT NOT NULL,'
+            '   price REAL NOT NULL,'
+            '   currency TEXT NOT NULL,'
+            '   PRIMARY KEY (company, source, destination, flight_date)'
+            ') WITHOUT ROWID;'
+            'CREATE TABLE IF NOT EXISTS snapshots ('
+            '   company TEXT PRIMARY KEY,'
+            '   snapshot_on TEXT NOT NULL'
+            ');'
+        )
+
+    def update(self, record: items.FareRecord) -> bool:
+        """
+        Stores `record` as the last known fare of its flight and returns whether it differs from the previous one
+        """
+        key = (record.company, record.source, record.destination, record.flight_date)
+        previous = self.connection.execute(
+            'SELECT price, currency FROM fares WHERE company = ? AND source = ? AND destination = ? AND flight_date = ?',
+            key
+        ).fetchone()
+
+        if previous is not None and previous[1] == record.currency \
+                and abs(previous[0] - record.price) < PRICE_TOLERANCE:
+            return False
+
+        self.connection.execute(
+            'INSERT OR REPLACE INTO fares (company, source, destination, flight_date, price, currency) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            key + (record.price, record.currency)
+        )
+        self.uncommitted += 1
+
+        if self.uncommitted >= self.commit_every:
+            self.commit()
+
+        return True
+
+    def last_snapshot(self, company: str) -> Optional[datetime.date]:
+        row = self.connection.execute('SELECT snapshot_on FROM snapshots WHERE company = ?', (company,)).fetchone()
+
+        return datetime.date.fromisoformat(row[0]) if row is not None else None
+
+    def mark_snapshot(self, company: str, day: datetime.date):
+        self.connection.execute(
+            'INSERT OR REPLACE INTO snapshots (company, snapshot_on) VALUES (?, ?)', (company, day.isoformat())
+        )
+        self.commit()
+
+    def commit(self):
+        self.connection.commit()
+        self.uncommitted = 0
+
+    def close(self):
+        self.commit()
+        sqlite_state.release(self.connection)
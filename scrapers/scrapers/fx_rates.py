@@ -0,0 +1,122 @@
+"""
+Euro foreign exchange reference rates, by day, to convert the prices airlines answer in other currencies.
+
+WizzAir answers in the currency of the departure airport. The rates are the daily reference rates of the ECB, fetched
+at most once a day and kept in a JSON file with the rates of every day fetched so far, so fares are converted with the
+rates of their scrape day even when the crawl runs late, and crawls go on with the cached rates when the ECB is not
+reachable. Days without rates (weekends, holidays, the current day before the ECB publishes) use the rates of the last
+day before them.
+"""
+import bisect
+import datetime
+import json
+import os
+
+from http import client
+
+from typing import Dict, List, Optional
+from urllib import request
+from xml.etree import ElementTree
+
+# Rates of the last 90 days, the file of all days since 1999 is `eurofxref-hist.xml`
+ECB_RATES_URL = 'https://www.ecb.europa.eu/stats/eurofxref/eurofxref-hist-90d.xml'
+BASE_CURRENCY = 'EUR'
+
+_CUBE = '{http://www.ecb.int/vocabulary/2002-08-01/eurofxref}Cube'
+
+
+def parse_ecb_rates(document: bytes) -> Dict[str, Dict[str, float]]:
+    """
+    Units of every currency one euro buys, by ISO day, from an ECB `eurofxref` document
+    """
+    rates: Dict[str, Dict[str, float]] = {}
+
+    for day in ElementTree.fromstring(document).iter(_CUBE):
+        if 'time' in day.attrib:
+            rates[day.attrib['time']] = {cube.attrib['currency']: float(cube.attrib['rate']) for cube in day}
+
+    return rates
+
+
+class FxTable:
+    """
+    The rates of every day fetched so far, in a JSON file shared by all spiders
+    """
+    __slots__ = ['path', 'url', 'timeout', 'rates', 'days', 'fetched_on']
+
+    def __init__(self, path: str, url: str = ECB_RATES_URL, timeout: float = 10):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.url = url
+        self.timeout = timeout
+        self.rates: Dict[str, Dict[str, float]] = {}
+        self.days: List[str] = []
+        self.fetched_on: Optional[datetime.date] = None
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r') as f:
+                stored = json.load(f)
+
+            rates = stored['rates']
+            fetched_on = datetime.date.fromisoformat(stored['fetched_on'])
+        except (FileNotFoundError, ValueError, KeyError, TypeError):
+            # Fetched again, like the first time
+            return
+
+        self.rates = rates
+        self.days = sorted(self.rates)
+        self.fetched_on = fetched_on
+
+    def _store(self):
+        tmp_path = f'{self.path}.tmp'
+
+        with open(tmp_path, 'w') as f:
+            json.dump({'fetched_on': self.fetched_on.isoformat(), 'rates': self.rates}, f, sort_keys=True)
+
+        os.replace(tmp_path, self.path)
+
+    def refresh(self, today: datetime.date) -> bool:
+        """
+        Fetches the latest rates unless they were fetched `today` already, returns whether they were fetched. The rates
+        of the days fetched before are kept, `OSError` and `ValueError` are raised when the rates cannot be fetched
+        """
+        if self.fetched_on == today:
+            return False
+
+        try:
+            with request.urlopen(self.url, timeout=self.timeout) as response:
+                fetched = parse_ecb_rates(response.read())
+        except (client.HTTPException, ElementTree.ParseError, KeyError) as e:
+            raise ValueError(f'Invalid rates in {self.url}: {e!r}') from e
+
+        if not fetched:
+            raise ValueError(f'No rates in {self.url}')
+
+        self.rates.update(fetched)
+        self.days = sorted(self.rates)
+        self.fetched_on = today
+        self._store()
+
+        return True
+
+    def rates_day(self, day: str) -> Optional[str]:
+        """
+        ISO day whose rates stand for `day`, the last one up to it, None before the first day known
+        """
+        index = bisect.bisect_right(self.days, day[:10])
+
+        return self.days[index - 1] if index else None
+
+    def to_eur(self, currency: str, day: str) -> Optional[float]:
+        """
+        Euros one unit of `currency` was worth on the ISO `day`, None when its rate is not known
+        """
+        if currency == BASE_CURRENCY:
+            return 1.0
+
+        rates_day = self.rates_day(day)
+        rate = self.rates[rates_day].get(currency) if rates_day is not None else None
+
+        return 1 / rate if rate else None
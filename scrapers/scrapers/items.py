@@ -2,11 +2,84 @@
 #
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/items.html
+import dataclasses
+import functools
+import json
+import math
+import sys
 
-import scrapy
+from typing import Iterable, Optional
 
 
-class AirlineScraperItem(scrapy.Item):
-    # define the fields for your item here like:
-    # name = scrapy.Field()
-    pass
+@dataclasses.dataclass(slots=True)
+class FareRecord:
+    """
+    One scraped fare. Spiders produce thousands of them per crawl, so the record is slotted and its repeated strings
+    (airport codes, currency, company and scrape date) are interned to share a single copy between records.
+    """
+    flight_date: str
+    source: str
+    destination: str
+    price: float
+    currency: str
+    company: str
+    scrape_date: str
+    # Price in euros at the reference rate of the scrape day, set by `CurrencyNormalizationPipeline`, and for fares in
+    # euros whether it runs or not
+    price_eur: Optional[float] = None
+
+    def __post_init__(self):
+        # Would be written as `null`, `NaN` or `inf`, none of which ClickHouse takes as a price
+        if not isinstance(self.price, (int, float)) or not math.isfinite(self.price):
+            raise ValueError(f'Price of a fare must be a finite number, got {self.price!r}')
+
+        # The writers send `price_eur` even when null, so the default of `flights.price_eur` never applies
+        if self.price_eur is None and self.currency == 'EUR':
+            self.price_eur = self.price
+
+        self.source = sys.intern(self.source)
+        self.destination = sys.intern(self.destination)
+        self.currency = sys.intern(self.currency)
+        self.company = sys.intern(self.company)
+        self.scrape_date = sys.intern(self.scrape_date)
+
+
+# Column order matches `flight_data.kafka_queue`
+_JSON_ROW = '{"flight_date":%s,"source":%s,"destination":%s,"price":%r,"price_eur":%s,"currency":%s,"company":%s,' \
+            '"scrape_date":%s}'
+
+
+@functools.lru_cache(maxsize=8192)
+def _json_string(value: str) -> str:
+    # Only a handful of distinct strings are seen during a crawl, so every one is escaped once
+    return json.dumps(value)
+
+
+def _json_row(record: FareRecord) -> str:
+    return _JSON_ROW % (
+        _json_string(record.flight_date),
+        _json_string(record.source),
+        _json_string(record.destination),
+        float(record.price),
+        'null' if record.price_eur is None else repr(float(record.price_eur)),
+        _json_string(record.currency),
+        _json_string(record.company),
+        _json_string(record.scrape_date),
+    )
+
+
+def encode_json_row(record: FareRecord) -> bytes:
+    return _json_row(record).encode('utf-8')
+
+
+def encode_json_each_row(records: Iterable[FareRecord]) -> bytes:
+    """
+    Encodes the records in ClickHouse's `JSONEachRow` format, one record per line
+    """
+    rows = [_json_row(record) for record in records]
+
+    if not rows:
+        return b''
+
+    rows.append('')
+    return '\n'.join(rows).encode('utf-8')
@@ -0,0 +1,79 @@
+"""
+Helpers to decode only the parts of large JSON responses a spider needs.
+"""
+import json
+import re
+
+from typing import Any, Callable, Iterator, Optional
+
+try:
+    # Parses whole documents several times faster than the standard library, when installed
+    import orjson
+
+    loads: Callable[[bytes], Any] = orjson.loads
+except ImportError:
+    loads = json.loads
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_BYTES_WHITESPACE = re.compile(rb'[ \t\n\r]*')
+
+
+def _decode_at(decoder: json.JSONDecoder, body: bytes, start: int, chunk_size: int):
+    size = chunk_size
+
+    while True:
+        # A multibyte character cut at the end of the chunk can only be past the value, so it is safe to ignore
+        chunk = body[start:start + size].decode('utf-8', errors='ignore')
+        begin = _WHITESPACE.match(chunk).end()
+
+        try:
+            value, end = decoder.raw_decode(chunk, begin)
+            return value, start + len(chunk[:end].encode('utf-8'))
+        except json.JSONDecodeError:
+            if start + size >= len(body):
+                raise
+
+            size *= 4
+
+
+def _find_key(body: bytes, needle: bytes, start: int) -> int:
+    """
+    Position right after the `:` following the next `needle` that is a key, or -1
+    """
+    position = body.find(needle, start)
+
+    while position != -1:
+        after = _BYTES_WHITESPACE.match(body, position + len(needle)).end()
+
+        # An escaped quote means the needle is inside a string, a missing colon that it is a value
+        if body[position - 1:position] != b'\\' and body[after:after + 1] == b':':
+            return after + 1
+
+        position = body.find(needle, position + 1)
+
+    return -1
+
+
+def iter_values(
+        body: bytes,
+        key: str,
+        object_hook: Optional[Callable[[dict], Any]] = None,
+        limit: Optional[int] = None,
+        chunk_size: int = 64 * 1024
+) -> Iterator[Any]:
+    """
+    Decodes the value of every `key` found in `body` (at any depth, up to `limit` of them), without decoding the rest
+    of the document. Values are decoded from chunks of `chunk_size` bytes, grown until they hold the whole value, so
+    this is meant for objects and arrays much smaller than the document. `object_hook` is applied while decoding, like
+    in `json.loads`.
+    """
+    needle = b'"' + key.encode('utf-8') + b'"'
+    decoder = json.JSONDecoder(object_hook=object_hook)
+    found = 0
+    start = _find_key(body, needle, 0)
+
+    while start != -1 and (limit is None or found < limit):
+        value, end = _decode_at(decoder, body, start, chunk_size)
+        found += 1
+        yield value
+        start = _find_key(body, needle, end)
@@ -0,0 +1,20 @@
+# Define here how scrapy's events are logged
+#
+# See documentation in:
+# https://docs.scrapy.org/en/latest/topics/logging.html#custom-log-formats
+import logging
+
+from scrapy import logformatter
+
+from . import pipelines
+
+
+class AirlineScraperLogFormatter(logformatter.LogFormatter):
+    def dropped(self, item, exception, response, spider):
+        entry = super().dropped(item, exception, response, spider)
+
+        # Most fares are unchanged in price delta mode, logging each one as a warning would flood the logs
+        if isinstance(exception, pipelines.UnchangedFare):
+            entry['level'] = logging.DEBUG
+
+        return entry
@@ -0,0 +1,195 @@
+"""
+In-process metrics of the crawls, rendered in the text format of Prometheus.
+
+Series are identified by their metric name, declared in `METRICS`, and their labels. `REGISTRY` holds the series of the
+process. Crawls run by the API server happen in other processes, which send snapshots of their registry to the server
+where they are merged into a registry of its own.
+"""
+import bisect
+import threading
+
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+COUNTER = 'counter'
+GAUGE = 'gauge'
+HISTOGRAM = 'histogram'
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+PARSE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+COUNT_BUCKETS = (0, 1, 5, 10, 25, 50, 100, 250, 1000)
+SEND_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 1)
+
+
+class Metric(NamedTuple):
+    kind: str
+    help: str
+    buckets: Tuple[float, ...] = ()
+
+
+METRICS: Dict[str, Metric] = {
+    'scrapers_download_seconds': Metric(
+        HISTOGRAM, 'Time from sending a request to receiving its response', LATENCY_BUCKETS
+    ),
+    'scrapers_response_bytes': Metric(HISTOGRAM, 'Size of the response bodies, as received', SIZE_BUCKETS),
+    'scrapers_responses_total': Metric(COUNTER, 'Responses by status, including the ones retried'),
+    'scrapers_download_errors_total': Metric(COUNTER, 'Requests that failed without a response, by error'),
+    'scrapers_parse_seconds': Metric(HISTOGRAM, 'Time spent in the spider callback of a response', PARSE_BUCKETS),
+    'scrapers_items_per_response': Metric(HISTOGRAM, 'Items yielded by the callback of a response', COUNT_BUCKETS),
+    'scrapers_pipeline_send_seconds': Metric(
+        HISTOGRAM, 'Time spent handing an item to the Kafka producer or to the spool', SEND_BUCKETS
+    ),
+    'scrapers_pipeline_queue_depth': Metric(
+        GAUGE, 'Items handed to the Kafka producer or to the spool not delivered yet'
+    ),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+# Values of the series, by metric name and labels. Histograms hold the count of every bucket, then of the values above
+# the last bucket, then the sum of the values
+Snapshot = Dict[Tuple[str, Labels], object]
+
+
+def _labels(labels: Dict[str, object]) -> Labels:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra is not None else [])
+
+    if not pairs:
+        return ''
+
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Registry:
+    """
+    Thread-safe, Kafka delivery callbacks record from the producer's I/O thread
+    """
+
+    def __init__(self, metrics: Optional[Dict[str, Metric]] = None):
+        self.metrics = metrics if metrics is not None else METRICS
+        self.lock = threading.Lock()
+        self.values: Snapshot = {}
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, _labels(labels))
+
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        with self.lock:
+            self.values[(name, _labels(labels))] = value
+
+    def observe(self, name: str, value: float, **labels):
+        buckets = self.metrics[name].buckets
+        key = (name, _labels(labels))
+
+        with self.lock:
+            counts = self.values.get(key)
+
+            if counts is None:
+                counts = self.values[key] = [0] * (len(buckets) + 1) + [0.0]
+
+            counts[bisect.bisect_left(buckets, value)] += 1
+            counts[-1] += value
+
+    def snapshot(self) -> Snapshot:
+        with self.lock:
+            return {key: list(value) if isinstance(value, list) else value for key, value in self.values.items()}
+
+    def merge(self, snapshot: Snapshot, previous: Optional[Snapshot] = None):
+        """
+        Adds what the counters and histograms of `snapshot` gained since `previous`, another snapshot of the same
+        registry, and takes the gauges of `snapshot`
+        """
+        previous = previous or {}
+
+        with self.lock:
+            for key, value in snapshot.items():
+                kind = self.metrics[key[0]].kind
+                before = previous.get(key)
+
+                if kind == GAUGE:
+                    self.values[key] = value
+                elif kind == COUNTER:
+                    self.values[key] = self.values.get(key, 0) + value - (before or 0)
+                else:
+                    counts = self.values.setdefault(key, [0] * (len(value) - 1) + [0.0])
+
+                    for i, count in enumerate(value):
+                        counts[i] += count - (before[i] if before is not None else 0)
+
+    def total(self, name: str, **only) -> Tuple[float, float]:
+        """
+        Sum of the series of `name` having the labels `only`, as (count, sum) for histograms and (value, value) for the
+        others
+        """
+        count, total = 0, 0.0
+
+        for _, value in self._series(name, _labels(only)):
+            if isinstance(value, list):
+                count += sum(value[:-1])
+                total += value[-1]
+            else:
+                count += value
+                total += value
+
+        return count, total
+
+    def _series(self, name: str, only: Labels) -> List[Tuple[Labels, object]]:
+        with self.lock:
+            return sorted(
+                (labels, list(value) if isinstance(value, list) else value)
+                for (series_name, labels), value in self.values.items()
+                if series_name == name and set(only) <= set(labels)
+            )
+
+    def _render_metric(self, name: str, metric: Metric, only: Labels) -> Iterator[str]:
+        series = self._series(name, only)
+
+        if not series:
+            return
+
+        yield f'# HELP {name} {metric.help}'
+        yield f'# TYPE {name} {metric.kind}'
+
+        for labels, value in series:
+            if metric.kind != HISTOGRAM:
+                yield f'{name}{_format_labels(labels)} {_format_value(value)}'
+                continue
+
+            cumulative = 0
+
+            for bound, count in zip(list(metric.buckets) + ['+Inf'], value[:-1]):
+                cumulative += count
+                le = bound if isinstance(bound, str) else _format_value(bound)
+                yield f'{name}_bucket{_format_labels(labels, ("le", le))} {cumulative}'
+
+            yield f'{name}_sum{_format_labels(labels)} {_format_value(value[-1])}'
+            yield f'{name}_count{_format_labels(labels)} {cumulative}'
+
+    def render(self, **only) -> str:
+        """
+        Series having the labels `only`, all of them by default, in the text format of Prometheus
+        """
+        only_labels = _labels(only)
+
+        return ''.join(
+            f'{line}\n'
+            for name, metric in self.metrics.items()
+            for line in self._render_metric(name, metric, only_labels)
+        )
+
+
+REGISTRY = Registry()
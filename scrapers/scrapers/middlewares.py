@@ -3,101 +3,636 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
-from scrapy import signals
+import datetime
+import os
+import time
+
+from urllib import parse
+
+from scrapy import exceptions, signals
+from scrapy.core import downloader as core_downloader
+from scrapy.spidermiddlewares import httperror
+from scrapy.utils import httpobj
+from twisted.internet import defer, error
 
 # useful for handling different item types with a single interface
-from itemadapter import is_item, ItemAdapter
+from itemadapter import is_item
+
+from . import (
+    airline_route, crawl_ledger, fare_index, items, metrics, rate_control, response_cache, route_history,
+    window_planner, wizzair_session,
+)
+
+
+def endpoint(request) -> str:
+    """
+    Host and path of the request, with the airports of its route window replaced so every route has the same endpoint
+    """
+    url = parse.urlsplit(request.url)
+    window = request.meta.get('route_window')
+
+    if window is None:
+        return f'{url.netloc}{url.path}'
+
+    replaced = {window.source: '{source}', window.destination: '{destination}'}
+
+    return url.netloc + '/'.join(replaced.get(part, part) for part in url.path.split('/'))
 
 
 class AirlineScraperSpiderMiddleware:
-    # Not all methods need to be defined. If a method is not defined,
-    # scrapy acts as if the spider middleware does not modify the
-    # passed objects.
+    """
+    Records the time spent in the spider callback of every response and the items it yields. The metrics of the
+    airline are written to `METRICS_DUMP_DIR` when its spider closes.
+
+    Placed the closest to the spider, so the time spent in the other middlewares is left out.
+    """
+
+    def __init__(self, registry: metrics.Registry, dump_dir: str):
+        self.registry = registry
+        self.dump_dir = dump_dir
 
     @classmethod
     def from_crawler(cls, crawler):
-        # This method is used by Scrapy to create your spiders.
-        s = cls()
-        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        settings = crawler.settings
+
+        if not settings.getbool('METRICS_ENABLED'):
+            raise exceptions.NotConfigured
+
+        s = cls(metrics.REGISTRY, settings.get('METRICS_DUMP_DIR'))
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
         return s
 
-    def process_spider_input(self, response, spider):
-        # Called for each response that goes through the spider
-        # middleware and into the spider.
+    def process_spider_output(self, response, result, spider):
+        parsing, yielded = 0.0, 0
+        result = iter(result)
 
-        # Should return None or raise an exception.
-        return None
+        while True:
+            # Only the time spent producing the results is the spider's, not the time the consumers take
+            started = time.perf_counter()
+
+            try:
+                i = next(result)
+            except StopIteration:
+                parsing += time.perf_counter() - started
+                break
+
+            parsing += time.perf_counter() - started
+
+            if is_item(i):
+                yielded += 1
+
+            yield i
+
+        self.registry.observe('scrapers_parse_seconds', parsing, airline=spider.name)
+        self.registry.observe('scrapers_items_per_response', yielded, airline=spider.name)
+
+    def spider_closed(self, spider):
+        os.makedirs(self.dump_dir, exist_ok=True)
+        path = os.path.join(self.dump_dir, f'{spider.name}.prom')
+
+        with open(f'{path}.tmp', 'w') as f:
+            f.write(self.registry.render(airline=spider.name))
+
+        os.replace(f'{path}.tmp', path)
+
+        responses, download_seconds = self.registry.total('scrapers_download_seconds', airline=spider.name)
+        parsed, parse_seconds = self.registry.total('scrapers_parse_seconds', airline=spider.name)
+        sent, send_seconds = self.registry.total('scrapers_pipeline_send_seconds', airline=spider.name)
+        spider.logger.info(
+            f'Spent {download_seconds:.1f}s downloading {responses} responses, {parse_seconds:.1f}s parsing {parsed} '
+            f'of them and {send_seconds:.1f}s sending {sent} items, metrics written to {path}'
+        )
+
+
+class AirlineScraperDownloaderMiddleware:
+    """
+    Records the latency, the size and the status of every response and the download errors, by airline and endpoint.
+
+    Placed the closest to the downloader, so it sees the responses before they are retried or decompressed.
+    """
+
+    def __init__(self, registry: metrics.Registry):
+        self.registry = registry
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('METRICS_ENABLED'):
+            raise exceptions.NotConfigured
+
+        return cls(metrics.REGISTRY)
+
+    def process_response(self, request, response, spider):
+        labels = {'airline': spider.name, 'endpoint': endpoint(request)}
+        latency = request.meta.get('download_latency')
+
+        if latency is not None:
+            self.registry.observe('scrapers_download_seconds', latency, **labels)
+
+        self.registry.observe('scrapers_response_bytes', len(response.body), **labels)
+        self.registry.inc('scrapers_responses_total', status=response.status, **labels)
+
+        return response
+
+    def process_exception(self, request, exception, spider):
+        self.registry.inc(
+            'scrapers_download_errors_total',
+            airline=spider.name,
+            endpoint=endpoint(request),
+            error=type(exception).__name__,
+        )
+
+
+class ResponseCacheMiddleware:
+    """
+    Skips parsing a response identical to the one seen for the same route window by a previous crawl, and so emitting
+    its fares again. Identical responses are still parsed and emitted once their last emission is
+    `RESPONSE_CACHE_MAX_AGE` days old, so the stored fares never get too stale.
+
+    The last day a skipped response covers is set in its `covered_until` meta from the cache, for
+    `WindowPlannerMiddleware` to request the days missing from it. Responses whose callback yields requests of its own
+    (searches to retry) are not stored, the next crawls parse them again.
+    """
+
+    def __init__(self, cache: response_cache.ResponseCache, stats):
+        self.cache = cache
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+
+        if not settings.getbool('RESPONSE_CACHE_ENABLED'):
+            raise exceptions.NotConfigured
+
+        s = cls(
+            response_cache.ResponseCache(
+                settings.get('RESPONSE_CACHE_PATH'),
+                datetime.timedelta(days=settings.getint('RESPONSE_CACHE_MAX_AGE')),
+            ),
+            crawler.stats,
+        )
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
 
     def process_spider_output(self, response, result, spider):
-        # Called with the results returned from the Spider, after
-        # it has processed the response.
+        window = response.meta.get('route_window')
+
+        if window is None:
+            yield from result
+            return
+
+        today = datetime.date.today()
+        body_digest = response_cache.digest(spider.normalized_body(response))
+
+        if self.cache.is_unchanged(window, body_digest, today):
+            self.cache.confirm_unchanged(window, today)
+            self.stats.inc_value('response_cache/unchanged', spider=spider)
+            spider.logger.debug(f'Response for {window.key()} is unchanged, skipping it')
+
+            # The callback is never run, only what the crawl parsing the response learnt is used
+            covered_until = self.cache.covered_until(window)
+            if covered_until is not None:
+                response.meta['covered_until'] = covered_until
+
+            return
+
+        requests = 0
 
-        # Must return an iterable of Request, or item objects.
         for i in result:
+            if not is_item(i):
+                requests += 1
+
             yield i
 
-    def process_spider_exception(self, response, exception, spider):
-        # Called when a spider or process_spider_input() method
-        # (from other spider middleware) raises an exception.
+        if requests:
+            return
+
+        # Stored only once the whole response was parsed and emitted
+        self.cache.store(window, body_digest, today, response.meta.get('covered_until'))
+        self.stats.inc_value('response_cache/changed', spider=spider)
+
+    def spider_closed(self, spider):
+        self.cache.close()
+
 
-        # Should return either None or an iterable of Request or item objects.
-        pass
+class RouteHistoryMiddleware:
+    """
+    Records in the route history when every route was scraped and how many of its fares changed since the previous
+    crawl, which the spiders use to prioritize their requests.
 
-    def process_start_requests(self, start_requests, spider):
-        # Called with the start requests of the spider, and works
-        # similarly to the process_spider_output() method, except
-        # that it doesn’t have a response associated.
+    Placed before `ResponseCacheMiddleware`, so the windows skipped as unchanged are recorded too, without changes.
+    """
 
-        # Must return only requests (not items).
-        for r in start_requests:
-            yield r
+    def __init__(self, history: route_history.RouteHistory, fares: fare_index.FareIndex):
+        self.history = history
+        # Last price of every fare, only to tell which changed
+        self.fares = fares
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        s = cls(
+            route_history.RouteHistory(settings.get('ROUTE_HISTORY_PATH')),
+            fare_index.FareIndex(settings.get('ROUTE_HISTORY_FARES_PATH')),
+        )
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def process_spider_output(self, response, result, spider):
+        window = response.meta.get('route_window')
+
+        if window is None:
+            yield from result
+            return
+
+        fares, changed = 0, 0
+
+        for i in result:
+            if isinstance(i, items.FareRecord):
+                fares += 1
+                changed += self.fares.update(i)
+
+            yield i
+
+        self.history.record(window, fares, changed, datetime.date.today())
+
+    def spider_closed(self, spider):
+        self.history.close()
+        self.fares.close()
+
+
+class CrawlLedgerMiddleware:
+    """
+    Records in the crawl ledger the windows whose response reached the spider, and sends the windows the spider gave
+    up on again later instead of leaving them to the next crawl: `CRAWL_LEDGER_RETRY_DELAY` seconds after the first
+    failure, then twice as long after every next one, up to `CRAWL_LEDGER_MAX_ATTEMPTS` attempts. The spider is kept
+    open while windows wait to be sent again.
+
+    Placed before `RouteHistoryMiddleware` and `ResponseCacheMiddleware`, so windows skipped as unchanged count as
+    done.
+    """
+    ATTEMPTS_META_KEY = 'crawl_ledger_attempts'
+
+    def __init__(self, crawler, ledger: crawl_ledger.CrawlLedger, max_attempts: int, retry_delay: float):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.ledger = ledger
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        # Day the crawl started, windows done after midnight still count for it
+        self.crawl_date = datetime.date.today()
+        # Requests of the failed windows waiting to be sent again, by their delayed call
+        self.pending = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+
+        if not settings.getbool('CRAWL_LEDGER_ENABLED'):
+            raise exceptions.NotConfigured
+
+        s = cls(
+            crawler,
+            crawl_ledger.CrawlLedger(settings.get('CRAWL_LEDGER_PATH')),
+            settings.getint('CRAWL_LEDGER_MAX_ATTEMPTS'),
+            settings.getfloat('CRAWL_LEDGER_RETRY_DELAY'),
+        )
+        crawler.signals.connect(s.window_failed, signal=crawl_ledger.window_failed)
+        crawler.signals.connect(s.spider_idle, signal=signals.spider_idle)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def process_spider_output(self, response, result, spider):
+        yield from result
+
+        window = response.meta.get('route_window')
+
+        # Error responses get here from the errback, which reports them as failed
+        if window is not None and 200 <= response.status < 300:
+            self.ledger.done(window, self.crawl_date, response.meta.get(self.__class__.ATTEMPTS_META_KEY, 1))
+            self.stats.inc_value('crawl_ledger/done', spider=spider)
+
+    def _retryable(self, failure, spider) -> bool:
+        if not failure.check(httperror.HttpError):
+            return True
+
+        status = failure.value.response.status
+
+        return status in spider.BACKOFF_STATUSES or status in self.crawler.settings.getlist('RETRY_HTTP_CODES')
+
+    def window_failed(self, request, failure, spider):
+        window = request.meta.get('route_window')
+
+        if window is None:
+            return
+
+        attempts = request.meta.get(self.__class__.ATTEMPTS_META_KEY, 1)
+
+        if attempts >= self.max_attempts or not self._retryable(failure, spider):
+            self.ledger.failed(window, self.crawl_date, repr(failure.value), attempts)
+            self.stats.inc_value('crawl_ledger/failed', spider=spider)
+            spider.logger.warning(f'Gave up on {window.key()} after {attempts} attempts: {failure.value!r}')
+            return
+
+        delay = self.retry_delay * 2 ** (attempts - 1)
+        # Scrapy's own retries start over with the new attempt
+        meta = {key: value for key, value in request.meta.items() if key != 'retry_times'}
+        meta[self.__class__.ATTEMPTS_META_KEY] = attempts + 1
+        retry = request.replace(meta=meta, dont_filter=True)
+
+        from twisted.internet import reactor
+
+        def send():
+            del self.pending[call]
+            self.crawler.engine.crawl(retry)
+
+        call = reactor.callLater(delay, send)
+        self.pending[call] = retry
+        self.stats.inc_value('crawl_ledger/retried', spider=spider)
+        spider.logger.info(f'Sending {window.key()} again in {delay:.0f}s, attempt {attempts + 1}')
+
+    def spider_idle(self, spider):
+        if self.pending:
+            raise exceptions.DontCloseSpider
+
+    def spider_closed(self, spider):
+        # Closed before their retry, by a timeout or a shutdown
+        for call, request in self.pending.items():
+            call.cancel()
+            self.ledger.failed(request.meta['route_window'], self.crawl_date, 'Closed before the retry', 0)
+
+        self.pending.clear()
+        counts = self.ledger.counts(spider.name, self.crawl_date)
+        self.ledger.close()
+
+        if counts.get(crawl_ledger.FAILED):
+            spider.logger.warning(
+                f'{counts[crawl_ledger.FAILED]} windows failed today and {counts.get(crawl_ledger.DONE, 0)} are done, '
+                f'resume with CRAWL_RESUME=true to request only the windows not done'
+            )
+
+
+class WindowPlannerMiddleware:
+    """
+    Sets the window size of the spider planned by `window_planner` from what the previous crawls learnt, requests the
+    days missing from the responses clipped before the end of their window, and stores what this crawl learnt when the
+    spider closes. Only enabled for spiders with a `MAX_WINDOW_SIZE`, their callbacks set the last day a response
+    covers in its `covered_until` meta.
+
+    Placed before `ResponseCacheMiddleware`, further from the spider, so the days missing from the responses it skips
+    as unchanged are still requested from the `covered_until` it restores.
+    """
+
+    def __init__(self, store: window_planner.WindowStore, stats):
+        self.store = store
+        self.stats = stats
+        self.planner = None
+        self.crawl_date = datetime.date.today()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+
+        if not settings.getbool('WINDOW_PLANNER_ENABLED') or getattr(crawler.spidercls, 'MAX_WINDOW_SIZE', None) is None:
+            raise exceptions.NotConfigured
+
+        s = cls(window_planner.WindowStore(settings.get('WINDOW_PLANNER_PATH')), crawler.stats)
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
 
     def spider_opened(self, spider):
-        spider.logger.info('Spider opened: %s' % spider.name)
+        self.planner = window_planner.WindowPlanner(
+            self.store.get(spider.name), spider.WINDOW_SIZE.days, spider.MAX_WINDOW_SIZE.days
+        )
+        spider.window_size = datetime.timedelta(days=self.planner.size(self.crawl_date))
+        self.stats.set_value('window_planner/window_size', spider.window_size.days, spider=spider)
+        spider.logger.info(f'Searching windows of {spider.window_size.days} days')
 
+    def process_spider_output(self, response, result, spider):
+        yield from result
 
-class AirlineScraperDownloaderMiddleware:
-    # Not all methods need to be defined. If a method is not defined,
-    # scrapy acts as if the downloader middleware does not modify the
-    # passed objects.
+        window = response.meta.get('route_window')
+        covered_until = response.meta.get('covered_until')
+
+        if window is None or not 200 <= response.status < 300:
+            return
+
+        days = (window.end - window.start).days + 1
+
+        # Responses not telling the days they cover, or covering none of them, are taken as whole
+        if covered_until is None or covered_until >= window.end or covered_until < window.start:
+            self.planner.on_full(days)
+            return
+
+        self.planner.on_clipped(days, (covered_until - window.start).days + 1)
+        self.stats.inc_value('window_planner/clipped', spider=spider)
+        spider.logger.debug(f'Response for {window.key()} stops on {covered_until}, requesting the days after it')
+
+        route = airline_route.Route(window.source, window.destination)
+
+        for request in spider.prepare_request(route, covered_until + datetime.timedelta(days=1), window.end):
+            request.priority = response.request.priority
+            self.stats.inc_value('window_planner/split_requests', spider=spider)
+            yield request
+
+    def spider_closed(self, spider):
+        limit = self.planner.learnt(self.crawl_date)
+        self.store.put(spider.name, limit)
+
+        if limit.clipped is not None and limit.clipped <= spider.window_size.days:
+            spider.logger.warning(f'Windows of {limit.clipped} days or more are clipped, the next crawls search '
+                                  f'{window_planner.planned_size(limit.accepted, limit.clipped, self.planner.ceiling)} '
+                                  f'days at a time')
+
+
+class AdaptiveRateMiddleware:
+    """
+    Drives the concurrency and delay of the airline's download slot with a `rate_control.RateController`, replacing
+    the static `DOWNLOAD_DELAY` and AutoThrottle. Statuses in the spider's `BACKOFF_STATUSES` and download errors cut
+    the rate, quick successes raise it.
+
+    Runs after `RetryMiddleware` in the response chain, so it sees the responses that are about to be retried. Spiders
+    crawling a shard out of several get their share of the rate, see `rate_control.shard_budget`. Not enabled along
+    with AutoThrottle, which drives the same slots, nor with slots by IP (`CONCURRENT_REQUESTS_PER_IP`).
+    """
+    EPOCH_META_KEY = 'rate_control_epoch'
+
+    # Download errors of an overloaded or throttling airline
+    BACKOFF_EXCEPTIONS = (
+        defer.TimeoutError,
+        error.TimeoutError,
+        error.TCPTimedOutError,
+        error.ConnectionRefusedError,
+        error.ConnectionLost,
+    )
+
+    def __init__(self, crawler, store: rate_control.RateStore, limits: rate_control.RateLimits,
+                 start_rate: rate_control.Rate):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.store = store
+        self.limits = limits
+        self.start_rate = start_rate
+        self.store_key = None
+        self.controller = None
 
     @classmethod
     def from_crawler(cls, crawler):
-        # This method is used by Scrapy to create your spiders.
-        s = cls()
+        settings = crawler.settings
+
+        if not settings.getbool('RATE_CONTROL_ENABLED'):
+            raise exceptions.NotConfigured
+
+        if settings.getbool('AUTOTHROTTLE_ENABLED'):
+            raise exceptions.NotConfigured(
+                'AutoThrottle drives the download slots already, turn AUTOTHROTTLE_ENABLED off'
+            )
+
+        if settings.getint('CONCURRENT_REQUESTS_PER_IP'):
+            raise exceptions.NotConfigured(
+                'Download slots by IP are not supported, turn CONCURRENT_REQUESTS_PER_IP off'
+            )
+
+        s = cls(
+            crawler,
+            rate_control.RateStore(settings.get('RATE_CONTROL_PATH')),
+            rate_control.RateLimits(
+                min_delay=settings.getfloat('RATE_CONTROL_MIN_DELAY'),
+                max_delay=settings.getfloat('RATE_CONTROL_MAX_DELAY'),
+                max_concurrency=settings.getint('RATE_CONTROL_MAX_CONCURRENCY'),
+                delay_step=settings.getfloat('RATE_CONTROL_DELAY_STEP'),
+                increase_every=settings.getint('RATE_CONTROL_INCREASE_EVERY'),
+                target_latency=settings.getfloat('RATE_CONTROL_TARGET_LATENCY'),
+            ),
+            # Used for airlines crawled for the first time
+            rate_control.Rate(settings.getint('CONCURRENT_REQUESTS_PER_DOMAIN'), settings.getfloat('DOWNLOAD_DELAY')),
+        )
         crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
         return s
 
+    def spider_opened(self, spider):
+        shards = spider.shard.count if hasattr(spider, 'shard') else 1
+        limits, start_rate = rate_control.shard_budget(self.limits, self.start_rate, shards)
+        # The safe rate of a shard only holds for the same number of shards
+        self.store_key = spider.name if shards == 1 else f'{spider.name}/{shards}'
+
+        rate = self.store.get(self.store_key) or start_rate
+        self.controller = rate_control.RateController(rate, limits)
+        spider.logger.info(f'Starting at {self.controller.rate.concurrency} concurrent requests '
+                           f'every {self.controller.rate.delay:.2f}s')
+
+    def _update_stats(self, spider):
+        self.stats.set_value('rate_control/concurrency', self.controller.rate.concurrency, spider=spider)
+        self.stats.set_value('rate_control/delay', self.controller.rate.delay, spider=spider)
+
+    def _apply_rate(self, request, spider):
+        # The downloader only sets the `download_slot` of a request, and creates its slot, after the middlewares, so
+        # the slot is looked up by the same key, and created with the rate when it does not exist yet
+        downloader = self.crawler.engine.downloader
+        key = request.meta.get(core_downloader.Downloader.DOWNLOAD_SLOT)
+        if key is None:
+            key = httpobj.urlparse_cached(request).hostname or ''
+
+        concurrency, delay = self.controller.rate
+        slot = downloader.slots.get(key)
+
+        if slot is None:
+            downloader.slots[key] = core_downloader.Slot(concurrency, delay, downloader.randomize_delay)
+        else:
+            slot.concurrency, slot.delay = concurrency, delay
+
     def process_request(self, request, spider):
-        # Called for each request that goes through the downloader
-        # middleware.
-
-        # Must either:
-        # - return None: continue processing this request
-        # - or return a Response object
-        # - or return a Request object
-        # - or raise IgnoreRequest: process_exception() methods of
-        #   installed downloader middleware will be called
+        self._apply_rate(request, spider)
+        request.meta[self.__class__.EPOCH_META_KEY] = self.controller.epoch
         return None
 
+    def _backoff(self, request, reason: str, spider):
+        if self.controller.on_backoff(request.meta[self.__class__.EPOCH_META_KEY]):
+            self._apply_rate(request, spider)
+            self.stats.inc_value('rate_control/backoffs', spider=spider)
+            self._update_stats(spider)
+            spider.logger.warning(f'Backing off to {self.controller.rate.concurrency} concurrent requests '
+                                  f'every {self.controller.rate.delay:.2f}s after {reason}')
+
     def process_response(self, request, response, spider):
-        # Called with the response returned from the downloader.
+        if self.__class__.EPOCH_META_KEY not in request.meta:
+            return response
+
+        if response.status in getattr(spider, 'BACKOFF_STATUSES', []):
+            self._backoff(request, f'status {response.status}', spider)
+        elif response.status < 400 \
+                and self.controller.on_success(request.meta[self.__class__.EPOCH_META_KEY],
+                                               request.meta.get('download_latency')):
+            self._apply_rate(request, spider)
+            self.stats.inc_value('rate_control/increases', spider=spider)
+            self._update_stats(spider)
+            spider.logger.debug(f'Increased to {self.controller.rate.concurrency} concurrent requests '
+                                f'every {self.controller.rate.delay:.2f}s')
 
-        # Must either;
-        # - return a Response object
-        # - return a Request object
-        # - or raise IgnoreRequest
         return response
 
     def process_exception(self, request, exception, spider):
-        # Called when a download handler or a process_request()
-        # (from other downloader middleware) raises an exception.
+        if self.__class__.EPOCH_META_KEY in request.meta \
+                and isinstance(exception, self.__class__.BACKOFF_EXCEPTIONS):
+            self._backoff(request, repr(exception), spider)
+
+    def spider_closed(self, spider):
+        if self.controller is None:
+            return
+
+        self.store.put(self.store_key, self.controller.safe_rate, datetime.date.today())
+        spider.logger.info(f'Next crawl starts at {self.controller.safe_rate.concurrency} concurrent requests '
+                           f'every {self.controller.safe_rate.delay:.2f}s')
+
+
+class WizzAirSessionMiddleware:
+    """
+    Holds the requests of the spider until its `wizzair_session.WizzAirSession` is ready, then sends them under the
+    current version of the API with the latest token. Only enabled for spiders finding the version of their API at a
+    `BUILD_NUMBER_URL`.
+
+    Runs before `RetryMiddleware` in the response chain, so 404s of a version gone are sent again under the new one
+    instead of being retried.
+    """
+
+    def __init__(self, crawler, store: wizzair_session.VersionStore, max_age: datetime.timedelta):
+        self.crawler = crawler
+        self.store = store
+        self.max_age = max_age
+        self.session = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
 
-        # Must either:
-        # - return None: continue processing this exception
-        # - return a Response object: stops process_exception() chain
-        # - return a Request object: stops process_exception() chain
-        pass
+        if not settings.getbool('WIZZAIR_SESSION_ENABLED') or not hasattr(crawler.spidercls, 'BUILD_NUMBER_URL'):
+            raise exceptions.NotConfigured
+
+        s = cls(
+            crawler,
+            wizzair_session.VersionStore(settings.get('WIZZAIR_SESSION_PATH')),
+            datetime.timedelta(days=settings.getint('WIZZAIR_VERSION_MAX_AGE')),
+        )
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        return s
 
     def spider_opened(self, spider):
-        spider.logger.info('Spider opened: %s' % spider.name)
+        self.session = wizzair_session.WizzAirSession(
+            self.store, spider.BUILD_NUMBER_URL, wizzair_session.url_version(spider.API_ENDPOINT), self.max_age
+        )
+        spider.logger.info(f'Starting with API version {self.session.version}'
+                           f'{"" if self.session.discovered else ", to be looked up"}')
+
+    def _download(self, request):
+        return self.crawler.engine.download(request)
+
+    def process_request(self, request, spider):
+        return self.session.prepare(request, self._download)
+
+    def process_response(self, request, response, spider):
+        return self.session.on_response(request, response)
+
+    def process_exception(self, request, exception, spider):
+        self.session.on_failure(request)
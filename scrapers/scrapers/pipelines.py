@@ -2,43 +2,597 @@
 #
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: https://docs.scrapy.org/en/latest/topics/item-pipeline.html
+import datetime
+import functools
 import json
 import logging
 import os
+import time
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 # useful for handling different item types with a single interface
-from kafka import KafkaProducer
+from kafka import KafkaProducer, codec
+from scrapy import exceptions
+from twisted.internet import defer, threads
+from twisted.python import failure
+
+from . import clickhouse_http, fare_index, fx_rates, items, metrics, sinks, spool
+
+# Compression codecs supported by `kafka-python` and the check telling if the codec's library is installed
+COMPRESSION_CODECS: Dict[str, Callable[[], bool]] = {
+    'gzip': codec.has_gzip,
+    'snappy': codec.has_snappy,
+    'lz4': codec.has_lz4,
+    'zstd': codec.has_zstd,
+}
+
+# Used when the requested codec's library is not installed, it is part of the standard library
+FALLBACK_COMPRESSION_TYPE = 'gzip'
+
+_JSON_ENCODER = json.JSONEncoder(separators=(',', ':'))
+
+
+def serialize_value(value: Any) -> bytes:
+    if isinstance(value, items.FareRecord):
+        return items.encode_json_row(value)
+
+    return _JSON_ENCODER.encode(value).encode('utf-8')
+
+
+@functools.lru_cache(maxsize=65536)
+def _route_key(source: str, destination: str) -> bytes:
+    return f'{source}-{destination}'.encode('utf-8')
+
+
+def route_key(value: Any) -> Optional[bytes]:
+    """
+    Kafka key of an item, its directed route: the fares of a route go to the same partition, in the order they were
+    scraped, while the routes are spread over all the partitions and the ClickHouse consumers reading them
+    """
+    if isinstance(value, items.FareRecord):
+        return _route_key(value.source, value.destination)
+
+    if isinstance(value, dict) and 'source' in value and 'destination' in value:
+        return _route_key(value['source'], value['destination'])
+
+    return None
+
+
+# Value of `SINK` sending the fares to Kafka through `AirlineScraperPipeline`, the others are bulk sinks
+KAFKA_SINK = 'kafka'
+BULK_SINKS = ['parquet', 'arrow', 'clickhouse']
+SINKS = [KAFKA_SINK, *BULK_SINKS]
+
+
+def compression_type(requested: Optional[str], logger: logging.Logger) -> Optional[str]:
+    if not requested:
+        return None
+
+    if requested not in COMPRESSION_CODECS:
+        raise ValueError(f'Unknown Kafka compression type {requested}, expected one of {list(COMPRESSION_CODECS)}')
+
+    if COMPRESSION_CODECS[requested]() is False:
+        logger.warning(
+            f'Libraries for {requested} compression are not installed, falling back to {FALLBACK_COMPRESSION_TYPE}'
+        )
+        return FALLBACK_COMPRESSION_TYPE
+
+    return requested
+
+
+class UnchangedFare(exceptions.DropItem):
+    """
+    Raised for fares already emitted with the same price, logged at debug level by `AirlineScraperLogFormatter`
+    """
+
+
+class PriceDeltaPipeline:
+    """
+    Lets through only the fares that are new or whose price changed since they were last emitted, plus every fare
+    of the periodic full snapshots, which also cover the fares that disappeared in between.
+    """
+    __slots__ = (
+        "index_path",
+        "snapshot_interval",
+        "index",
+        "snapshot",
+        "today",
+        "stats",
+        "logger",
+    )
+
+    def __init__(self, index_path: str, snapshot_interval: datetime.timedelta, stats=None):
+        self.index_path = index_path
+        self.snapshot_interval = snapshot_interval
+        self.index = None
+        self.snapshot = True
+        self.today = None
+        self.stats = stats
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+
+        if not settings.getbool('PRICE_DELTA_ENABLED'):
+            raise exceptions.NotConfigured
+
+        return cls(
+            settings.get('PRICE_DELTA_INDEX_PATH'),
+            datetime.timedelta(days=settings.getint('PRICE_DELTA_SNAPSHOT_INTERVAL')),
+            crawler.stats,
+        )
+
+    def open_spider(self, spider):
+        self.index = fare_index.FareIndex(self.index_path)
+        self.today = datetime.date.today()
+        last_snapshot = self.index.last_snapshot(spider.name)
+        self.snapshot = last_snapshot is None or self.today - last_snapshot >= self.snapshot_interval
+
+        if self.snapshot:
+            self.logger.info(f'Spider {spider.name} emits a full snapshot, the last one was on {last_snapshot}')
+        else:
+            self.logger.info(f'Spider {spider.name} emits only price changes since the {last_snapshot} snapshot')
+
+    def process_item(self, item, _spider):
+        if not isinstance(item, items.FareRecord):
+            return item
+
+        # The index is updated in both cases, so it also reflects the fares of a snapshot
+        if self.index.update(item) or self.snapshot:
+            if self.stats is not None:
+                self.stats.inc_value('price_delta/emitted')
+
+            return item
+
+        if self.stats is not None:
+            self.stats.inc_value('price_delta/unchanged')
+
+        raise UnchangedFare(f'Price of {item} did not change')
+
+    def close_spider(self, spider):
+        if self.snapshot:
+            self.index.mark_snapshot(spider.name, self.today)
+
+        self.index.close()
+
+
+class CurrencyNormalizationPipeline:
+    """
+    Sets the euro price of every fare from the rates of `fx_rates.FxTable`, refreshed when the spider opens. A crawl
+    sees a handful of currencies and scrape days, so the rate of every (currency, scrape day) is looked up once and
+    converting a fare is a single multiplication. Fares whose currency has no rate keep `price_eur` unset
+    """
+    __slots__ = (
+        "path",
+        "url",
+        "table",
+        "factors",
+        "stats",
+        "logger",
+    )
+
+    def __init__(self, path: str, url: str = fx_rates.ECB_RATES_URL, stats=None):
+        self.path = path
+        self.url = url
+        self.table = None
+        self.factors: Dict[Tuple[str, str], Optional[float]] = {}
+        self.stats = stats
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+
+        if not settings.getbool('FX_NORMALIZATION_ENABLED'):
+            raise exceptions.NotConfigured
+
+        return cls(settings.get('FX_RATES_PATH'), settings.get('FX_RATES_URL'), crawler.stats)
+
+    def open_spider(self, spider):
+        self.table = fx_rates.FxTable(self.path, self.url)
+        self.factors = {}
+
+        try:
+            self.table.refresh(datetime.date.today())
+        except (OSError, ValueError) as e:
+            converted = (
+                f'converts prices with the rates fetched on {self.table.fetched_on}' if self.table.fetched_on
+                else 'leaves the euro prices unset'
+            )
+            self.logger.warning(
+                f'Could not fetch the exchange rates from {self.url}, spider {spider.name} {converted}: {e!r}'
+            )
+
+    def _factor(self, currency: str, scrape_date: str) -> Optional[float]:
+        factor = self.table.to_eur(currency, scrape_date)
+
+        if factor is None:
+            self.logger.warning(f'No exchange rate of {currency} for {scrape_date}, its prices are not converted')
+
+        self.factors[(currency, scrape_date)] = factor
+
+        return factor
+
+    def process_item(self, item, _spider):
+        if not isinstance(item, items.FareRecord):
+            return item
+
+        try:
+            factor = self.factors[(item.currency, item.scrape_date)]
+        except KeyError:
+            factor = self._factor(item.currency, item.scrape_date)
+
+        if factor is not None:
+            item.price_eur = round(item.price * factor, 2)
+        elif self.stats is not None:
+            self.stats.inc_value(f'fx/unconverted/{item.currency}')
+
+        return item
+
+
+class SharedProducer:
+    """
+    Producer factory handing out the same producer to the pipelines of every crawl of a long-lived process, so they
+    share its connections. Pipelines only flush it when their spider closes, the process closes it when it exits.
+    """
+    __slots__ = ('factory', 'producer')
+
+    def __init__(self, factory: Callable[..., KafkaProducer] = KafkaProducer):
+        self.factory = factory
+        self.producer = None
+
+    def __call__(self, **configs) -> KafkaProducer:
+        # Pipelines of the same process are configured from the same settings, so the first configs stand for all
+        if self.producer is None:
+            self.producer = self.factory(**configs)
+
+        return self.producer
+
+    def close(self):
+        if self.producer is not None:
+            self.producer.flush()
+            self.producer.close()
+            self.producer = None
 
 
 class AirlineScraperPipeline:
     __slots__ = (
         "producer",
+        "producer_factory",
+        "producer_config",
         "topic",
-        "logger"
+        "bootstrap_servers",
+        "stats",
+        "logger",
+        "delivered",
+        "delivered_bytes",
+        "failed",
+        "spool",
+        "spool_config",
+        "drainer",
+        "registry",
+        "airline",
+        "sent",
     )
 
-    def __init__(self):
+    def __init__(
+            self,
+            producer_config: Optional[Dict[str, Any]] = None,
+            stats=None,
+            producer_factory: Callable[..., KafkaProducer] = KafkaProducer,
+            spool_config: Optional[Dict[str, Any]] = None,
+            registry: Optional[metrics.Registry] = None
+    ):
         self.topic = os.environ['KAFKA_TOPIC']
+        self.bootstrap_servers = os.environ['KAFKA_BOOTSTRAP_BROKERS'].split(',')
         self.logger = logging.getLogger(self.__class__.__name__)
+        self.producer = None
+        self.producer_factory = producer_factory
+        self.producer_config = producer_config or {}
+        self.stats = stats
+        # When set, items are written to an on-disk spool and a background drainer delivers them to Kafka
+        self.spool_config = spool_config
+        self.spool = None
+        self.drainer = None
+        # Records the send times and the items not delivered yet when set
+        self.registry = registry
+        self.airline = None
+        self.sent = 0
+
+        # Updated from the producer's I/O thread through the delivery callbacks
+        self.delivered = 0
+        self.delivered_bytes = 0
+        self.failed = 0
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        logger = logging.getLogger(cls.__name__)
+
+        # Fares go to a bulk sink instead, see `BulkSinkPipeline`
+        if settings.get('SINK', KAFKA_SINK) != KAFKA_SINK:
+            raise exceptions.NotConfigured
+
+        return cls(
+            # Set by the runner hosting several crawls in the same process
+            producer_factory=getattr(crawler, 'shared_producer', KafkaProducer),
+            producer_config={
+                'batch_size': settings.getint('KAFKA_BATCH_SIZE'),
+                'linger_ms': settings.getint('KAFKA_LINGER_MS'),
+                'buffer_memory': settings.getint('KAFKA_BUFFER_MEMORY'),
+                'compression_type': compression_type(settings.get('KAFKA_COMPRESSION_TYPE'), logger),
+            },
+            stats=crawler.stats,
+            spool_config={
+                'directory': settings.get('KAFKA_SPOOL_DIR'),
+                'segment_size': settings.getint('KAFKA_SPOOL_SEGMENT_SIZE'),
+                'drain_timeout': settings.getint('KAFKA_SPOOL_DRAIN_TIMEOUT'),
+            } if settings.get('KAFKA_SPOOL_DIR') else None,
+            registry=metrics.REGISTRY if settings.getbool('METRICS_ENABLED') else None,
+        )
 
     def process_item(self, item, _spider):
-        self.producer.send(self.topic, item)
+        started = time.perf_counter()
+        self.sent += 1
 
-    def open_spider(self, spider):
-        self.producer = KafkaProducer(
-            bootstrap_servers=os.environ['KAFKA_BOOTSTRAP_BROKERS'].split(','),
+        if self.spool is not None:
+            self.spool.append(serialize_value(item), route_key(item))
+        else:
+            # `send` only appends the record to the producer's batch, delivery is confirmed by the callbacks
+            self.producer.send(self.topic, item, key=route_key(item)) \
+                .add_callback(self._on_delivery) \
+                .add_errback(self._on_delivery_error)
+
+        if self.registry is not None:
+            self.registry.observe('scrapers_pipeline_send_seconds', time.perf_counter() - started, airline=self.airline)
+            self._record_queue_depth()
+
+        return item
+
+    def _record_queue_depth(self):
+        if self.registry is not None:
+            # Spooled items left by a previous crawl are delivered too, they do not make this crawl's queue negative
+            self.registry.set(
+                'scrapers_pipeline_queue_depth', max(0, self.sent - self.delivered - self.failed), airline=self.airline
+            )
+
+    def _on_delivery(self, record_metadata):
+        self.delivered += 1
+        self.delivered_bytes += record_metadata.serialized_value_size
+        self._record_queue_depth()
+
+        if self.stats is not None:
+            self.stats.inc_value('kafka/delivered')
+            self.stats.inc_value('kafka/delivered_bytes', record_metadata.serialized_value_size)
+
+    def _on_delivery_error(self, exception: Exception):
+        self.failed += 1
+        self._record_queue_depth()
+
+        if self.stats is not None:
+            self.stats.inc_value('kafka/failed')
+
+        self.logger.error(f'Kafka delivery to {self.topic} failed: {exception!r}')
+
+    def _create_producer(self, factory: Optional[Callable[..., KafkaProducer]] = None, **configs) -> KafkaProducer:
+        return (factory or self.producer_factory)(
+            bootstrap_servers=self.bootstrap_servers,
             security_protocol='PLAINTEXT',
-            value_serializer=lambda v: json.dumps(v).encode('utf-8'),
+            **self.producer_config,
+            **configs,
         )
 
+    def _create_drainer_producer(self) -> KafkaProducer:
+        # The drainer closes its producer when it stops and sends values serialized already, so it never gets the
+        # producer shared with the other crawls of the process
+        factory = self.producer_factory
+        if isinstance(factory, SharedProducer):
+            factory = factory.factory
+
+        return self._create_producer(factory)
+
+    def open_spider(self, spider):
+        self.airline = spider.name
+
+        if self.spool_config is not None:
+            self._open_spool(spider)
+            return
+
+        self.producer = self._create_producer(value_serializer=serialize_value)
+
         if self.producer.bootstrap_connected() is False:
             raise ConnectionError(
                 f'Kafka producer could not connect to {os.environ["KAFKA_BOOTSTRAP_BROKERS"]} for spider {spider.name}'
             )
 
         self.logger.info(
-            f'Kafka producer connected to {os.environ["KAFKA_BOOTSTRAP_BROKERS"]} for spider {spider.name}'
+            f'Kafka producer connected to {os.environ["KAFKA_BOOTSTRAP_BROKERS"]} for spider {spider.name} '
+            f'with {self.producer_config}'
         )
 
-    def close_spider(self, _spider):
-        self.producer.close()
+    def _open_spool(self, spider):
+        # Every spider has a spool of its own, spiders crawling at the same time would overwrite each other's segments
+        directory = os.path.join(self.spool_config['directory'], spider.name)
+        self.spool = spool.Spool(directory, self.spool_config['segment_size'])
+        self.drainer = spool.SpoolDrainer(
+            self.spool,
+            self.topic,
+            # Spooled values are already serialized
+            producer_factory=self._create_drainer_producer,
+            on_delivery=self._on_delivery,
+            on_error=self._on_delivery_error,
+        )
+        self.drainer.start()
+
+        self.logger.info(f'Spider {spider.name} spools Kafka deliveries in {directory}')
+
+    def _close_spool(self, spider):
+        if self.drainer.stop(self.spool_config['drain_timeout']) is False:
+            self.logger.warning(
+                f'Spool of spider {spider.name} still holds {self.spool.pending_bytes()} undelivered bytes, '
+                f'they will be delivered by the next crawl'
+            )
+
+        if self.stats is not None:
+            self.stats.set_value('kafka/spool_pending_bytes', self.spool.pending_bytes())
+
+        self.spool.close()
+
+    def close_spider(self, spider):
+        if self.spool is not None:
+            self._close_spool(spider)
+        elif self.producer is not None:
+            # Pushes out the batches still lingering in the producer, so the counters below are final
+            self.producer.flush()
+
+            if not isinstance(self.producer_factory, SharedProducer):
+                self.producer.close()
+
+        self.logger.info(
+            f'Kafka producer for spider {spider.name} delivered {self.delivered} items '
+            f'({self.delivered_bytes} bytes) and failed to deliver {self.failed} items'
+        )
+
+
+class BulkSinkPipeline:
+    """
+    Writes the fares to the bulk sink of `scrapers.sinks` named by `SINK`, `batch_size` at a time. Batches are written
+    by a thread of the reactor's pool, one at a time: the next batch fills while one is written, and the crawl waits
+    for the batch being written only when the next one is full already
+    """
+    __slots__ = (
+        "sink_name",
+        "sink_config",
+        "batch_size",
+        "sink",
+        "batch",
+        "lock",
+        "stats",
+        "logger",
+        "written",
+        "failed",
+        "sink_factory",
+        "run_in_thread",
+    )
+
+    def __init__(
+            self,
+            sink_name: str,
+            sink_config: Dict[str, Any],
+            batch_size: int = 100000,
+            stats=None,
+            sink_factory: Optional[Callable[[Any], sinks.Sink]] = None,
+            run_in_thread: Callable[..., defer.Deferred] = threads.deferToThread,
+    ):
+        if sink_name not in BULK_SINKS:
+            raise ValueError(f'Unknown sink {sink_name}, expected {KAFKA_SINK} or one of {BULK_SINKS}')
+
+        if sink_name in ('parquet', 'arrow') and not sinks.has_pyarrow():
+            raise ValueError(f'The {sink_name} sink needs pyarrow, install it with `pip install pyarrow`')
+
+        self.sink_name = sink_name
+        self.sink_config = sink_config
+        self.batch_size = batch_size
+        self.sink = None
+        self.batch = []
+        self.lock = defer.DeferredLock()
+        self.stats = stats
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.written = 0
+        self.failed = 0
+        # Creates the sink of a spider, from `sink_config` by default
+        self.sink_factory = sink_factory or self._create_sink
+        self.run_in_thread = run_in_thread
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        sink_name = settings.get('SINK', KAFKA_SINK)
+
+        if sink_name == KAFKA_SINK:
+            raise exceptions.NotConfigured
+
+        return cls(
+            sink_name,
+            {
+                'directory': settings.get('SINK_DIR'),
+                'url': settings.get('CLICKHOUSE_URL'),
+                'user': settings.get('CLICKHOUSE_USER'),
+                'password': settings.get('CLICKHOUSE_PASSWORD'),
+                'table': f'{settings.get("CLICKHOUSE_DATABASE")}.flights',
+                'insert_format': settings.get('SINK_CLICKHOUSE_FORMAT'),
+            },
+            settings.getint('SINK_BATCH_SIZE'),
+            crawler.stats,
+        )
+
+    def _create_sink(self, spider) -> sinks.Sink:
+        config = self.sink_config
+
+        if self.sink_name == 'clickhouse':
+            return sinks.ClickHouseSink(
+                clickhouse_http.ClickHouseClient(config['url'], config['user'], config['password']),
+                config['table'],
+                config['insert_format'],
+            )
+
+        sink_class = sinks.ParquetSink if self.sink_name == 'parquet' else sinks.ArrowSink
+
+        return sink_class(config['directory'], spider.name, datetime.datetime.now())
+
+    def open_spider(self, spider):
+        self.sink = self.sink_factory(spider)
+        self.logger.info(f'Spider {spider.name} writes its fares to the {self.sink_name} sink')
+
+    def _written(self, result, count: int):
+        if isinstance(result, failure.Failure):
+            self.failed += count
+            self.logger.error(f'Could not write {count} fares to the {self.sink_name} sink: {result.value!r}')
+        else:
+            self.written += count
+
+        if self.stats is not None:
+            self.stats.set_value('sink/written', self.written)
+            self.stats.set_value('sink/failed', self.failed)
+
+    def _write(self, _lock, batch: List[items.FareRecord]):
+        written = self.run_in_thread(self.sink.write, batch)
+        written.addBoth(self._written, len(batch))
+        written.addBoth(lambda _: self.lock.release())
+        # Not returned, the crawl goes on while the batch is written
+
+    def process_item(self, item, _spider):
+        if not isinstance(item, items.FareRecord):
+            return item
+
+        self.batch.append(item)
+
+        if len(self.batch) < self.batch_size:
+            return item
+
+        batch, self.batch = self.batch, []
+
+        # Fires right away unless the previous batch is still being written
+        return self.lock.acquire().addCallback(self._write, batch).addCallback(lambda _: item)
+
+    def _close(self, batch: List[items.FareRecord]):
+        try:
+            if batch:
+                self.sink.write(batch)
+        finally:
+            self.sink.close()
+
+    def close_spider(self, spider):
+        batch, self.batch = self.batch, []
+        closed = self.lock.acquire()
+        closed.addCallback(lambda _: self.run_in_thread(self._close, batch))
+        closed.addBoth(self._written, len(batch))
+        closed.addBoth(lambda _: self.lock.release())
+        closed.addCallback(lambda _: self.logger.info(
+            f'Spider {spider.name} wrote {self.written} fares to the {self.sink_name} sink and failed to write '
+            f'{self.failed} fares'
+        ))
+
+        return closed
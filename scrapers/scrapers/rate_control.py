@@ -0,0 +1,155 @@
+"""
+Per airline request rate, adjusted from the responses the airline sends back.
+
+The rate is a number of concurrent requests and a delay between them. It grows additively while the airline keeps
+answering, first by shortening the delay, then by adding concurrent requests, and is cut multiplicatively as soon as the
+airline pushes back (throttling statuses, server errors, timeouts). The last rate found safe is stored between crawls,
+so the next crawl starts from it instead of from the static settings.
+"""
+import datetime
+import json
+import os
+
+from typing import Dict, NamedTuple, Optional, Tuple
+
+
+class Rate(NamedTuple):
+    concurrency: int
+    delay: float
+
+
+class RateLimits(NamedTuple):
+    min_delay: float
+    max_delay: float
+    max_concurrency: int
+    # Delay removed on every increase, and the smallest delay a backoff sets
+    delay_step: float
+    # Consecutive quick successes needed before the rate is increased
+    increase_every: int
+    # Successes slower than this, in seconds, hold the rate instead of counting towards an increase
+    target_latency: float
+
+
+def shard_budget(limits: RateLimits, start_rate: Rate, shards: int) -> Tuple[RateLimits, Rate]:
+    """
+    Limits and start rate of one out of `shards` crawlers of the same airline, so together they stay within the budget
+    of a single one: each gets its share of the concurrency, and waits that many times longer between requests
+    """
+    if shards == 1:
+        return limits, start_rate
+
+    return (
+        limits._replace(
+            min_delay=limits.min_delay * shards,
+            max_delay=max(limits.max_delay, limits.min_delay * shards),
+            max_concurrency=max(1, limits.max_concurrency // shards),
+            delay_step=limits.delay_step * shards,
+        ),
+        Rate(max(1, start_rate.concurrency // shards), start_rate.delay * shards),
+    )
+
+
+class RateController:
+    """
+    AIMD control of the rate of a single airline.
+
+    Responses to requests sent before the last change of rate do not count, the same way TCP backs off at most once per
+    round trip: a burst of errors caused by a too high rate halves it once, not once per error.
+    """
+    __slots__ = ['limits', 'rate', 'safe_rate', 'epoch', 'successes']
+
+    def __init__(self, rate: Rate, limits: RateLimits):
+        self.limits = limits
+        self.rate = self._bounded(rate)
+        # Last rate the airline was seen to tolerate
+        self.safe_rate = self.rate
+        # Incremented on every change of rate
+        self.epoch = 0
+        self.successes = 0
+
+    def _bounded(self, rate: Rate) -> Rate:
+        return Rate(
+            concurrency=min(max(1, rate.concurrency), self.limits.max_concurrency),
+            delay=min(max(self.limits.min_delay, rate.delay), self.limits.max_delay)
+        )
+
+    def _change(self, rate: Rate):
+        self.rate = self._bounded(rate)
+        self.epoch += 1
+        self.successes = 0
+
+    def on_success(self, epoch: int, latency: Optional[float]) -> bool:
+        """
+        Returns whether the rate was increased
+        """
+        if epoch != self.epoch:
+            return False
+
+        if latency is not None and latency > self.limits.target_latency:
+            self.successes = 0
+            return False
+
+        self.successes += 1
+
+        if self.successes < self.limits.increase_every:
+            return False
+
+        self.safe_rate = self.rate
+
+        if self.rate.delay > self.limits.min_delay:
+            self._change(Rate(self.rate.concurrency, self.rate.delay - self.limits.delay_step))
+        elif self.rate.concurrency < self.limits.max_concurrency:
+            self._change(Rate(self.rate.concurrency + 1, self.rate.delay))
+        else:
+            self.successes = 0
+            return False
+
+        return True
+
+    def on_backoff(self, epoch: int) -> bool:
+        """
+        Returns whether the rate was decreased
+        """
+        if epoch != self.epoch:
+            return False
+
+        self._change(Rate(self.rate.concurrency // 2, max(self.rate.delay * 2, self.limits.delay_step)))
+        # Not known to be safe either, but it is the best guess until the airline accepts it
+        self.safe_rate = self.rate
+
+        return True
+
+
+class RateStore:
+    """
+    The safe rate of every airline, in a JSON file shared by all spiders
+    """
+    __slots__ = ['path']
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+
+    def _load(self) -> Dict[str, dict]:
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def get(self, airline: str) -> Optional[Rate]:
+        stored = self._load().get(airline)
+
+        return Rate(stored['concurrency'], stored['delay']) if stored is not None else None
+
+    def put(self, airline: str, rate: Rate, today: datetime.date):
+        # Read again right before writing, other airlines may be crawled at the same time
+        rates = self._load()
+        rates[airline] = {'concurrency': rate.concurrency, 'delay': rate.delay, 'updated_on': today.isoformat()}
+
+        tmp_path = f'{self.path}.tmp'
+
+        with open(tmp_path, 'w') as f:
+            json.dump(rates, f, indent=2, sort_keys=True)
+
+        os.replace(tmp_path, self.path)
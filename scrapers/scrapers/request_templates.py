@@ -0,0 +1,77 @@
+"""
+JSON request bodies serialized once per spider, with only their variable fields spliced in for every request.
+
+Search bodies of an airline differ only by a few short strings, the route and the dates, while the rest of them (the
+GraphQL query of EasyJet is 3 KB) would be copied and encoded again for every request. A `BodyTemplate` encodes its
+body once with `Field`s in place of the variable values, and `render` joins the encoded parts with the encoded values.
+Rendered bodies are the same bytes `json.dumps` gives for the whole body.
+"""
+import json
+
+from json import encoder
+from typing import Any, List
+
+
+class Field:
+    """
+    Placeholder of a variable value in the body of a `BodyTemplate`, rendered with the value of its name
+    """
+    __slots__ = ['name']
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __repr__(self) -> str:
+        return f'Field({self.name!r})'
+
+
+def _encode(value: Any) -> str:
+    # Fields are mostly airport codes and dates, encoded like `json.dumps` does, without its overhead
+    if isinstance(value, str):
+        return encoder.encode_basestring_ascii(value)
+
+    return json.dumps(value)
+
+
+class BodyTemplate:
+    __slots__ = ['parts', 'names']
+
+    def __init__(self, body: Any, **dumps_kwargs):
+        """
+        `body` holds `Field`s where the values of every request go, `dumps_kwargs` are passed to `json.dumps` as
+        the request would (`JsonRequest` sorts keys)
+        """
+        fields: List[Field] = []
+
+        def placeholder(obj):
+            if not isinstance(obj, Field):
+                raise TypeError(f'{obj!r} is not JSON serializable')
+
+            fields.append(obj)
+            # Control characters are always escaped by `json.dumps`, so the marker cannot be part of other values
+            return f'\x00{len(fields) - 1}\x00'
+
+        encoded = json.dumps(body, default=placeholder, **dumps_kwargs)
+        self.parts: List[str] = []
+        self.names: List[str] = []
+        rest = encoded
+
+        for i, field in enumerate(fields):
+            before, _, rest = rest.partition(_encode(f'\x00{i}\x00'))
+            self.parts.append(before)
+            self.names.append(field.name)
+
+        self.parts.append(rest)
+
+    def render(self, **values) -> bytes:
+        """
+        Body with the value of every field, `KeyError` if one is missing
+        """
+        parts, names = self.parts, self.names
+        chunks = [parts[0]]
+
+        for i, name in enumerate(names):
+            chunks.append(_encode(values[name]))
+            chunks.append(parts[i + 1])
+
+        return ''.join(chunks).encode()
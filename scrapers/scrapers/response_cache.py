@@ -0,0 +1,94 @@
+"""
+Persistent digests of the airline responses, keyed by route window.
+
+A crawl compares every response with the digest stored by the previous one. When they match, the fares are the same
+as the ones already emitted, so the response is neither parsed nor emitted again and the window is only marked as
+confirmed unchanged. The last day the response covers is stored along with its digest, so the days missing from a
+clipped response are still requested without parsing it.
+"""
+import datetime
+import hashlib
+
+from typing import Optional
+
+from . import airline_route, sqlite_state
+
+
+def digest(body: bytes) -> bytes:
+    return hashlib.blake2b(body, digest_size=16).digest()
+
+
+class ResponseCache:
+    def __init__(self, path: str, max_age: datetime.timedelta):
+        self.max_age = max_age
+        self.connection = sqlite_state.connect(path)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS responses ('
+            '   route_window TEXT PRIMARY KEY,'
+            '   digest BLOB NOT NULL,'
+            # Last time the fares of the window were emitted
+            '   emitted_on TEXT NOT NULL,'
+            # Last time the response was found identical to the emitted one
+            '   confirmed_on TEXT,'
+            # Last day the response covers, when its callback tells
+            '   covered_until TEXT'
+            ')'
+        )
+
+        # Caches of the crawls before the days covered were stored
+        columns = [row[1] for row in self.connection.execute('PRAGMA table_info(responses)')]
+        if 'covered_until' not in columns:
+            self.connection.execute('ALTER TABLE responses ADD COLUMN covered_until TEXT')
+
+        self.connection.commit()
+
+    def is_unchanged(self, window: airline_route.RouteWindow, body_digest: bytes, today: datetime.date) -> bool:
+        """
+        Whether the fares of `window` were emitted from an identical response recently enough to be skipped
+        """
+        row = self.connection.execute(
+            'SELECT digest, emitted_on FROM responses WHERE route_window = ?', (window.key(),)
+        ).fetchone()
+
+        if row is None or row[0] != body_digest:
+            return False
+
+        return today - datetime.date.fromisoformat(row[1]) < self.max_age
+
+    def confirm_unchanged(self, window: airline_route.RouteWindow, today: datetime.date):
+        self.connection.execute(
+            'UPDATE responses SET confirmed_on = ? WHERE route_window = ?', (today.isoformat(), window.key())
+        )
+        self.connection.commit()
+
+    def store(
+            self,
+            window: airline_route.RouteWindow,
+            body_digest: bytes,
+            today: datetime.date,
+            covered_until: Optional[datetime.date] = None
+    ):
+        self.connection.execute(
+            'INSERT INTO responses (route_window, digest, emitted_on, covered_until) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT (route_window) DO UPDATE SET digest = excluded.digest, emitted_on = excluded.emitted_on, '
+            '   confirmed_on = NULL, covered_until = excluded.covered_until',
+            (window.key(), body_digest, today.isoformat(), covered_until.isoformat() if covered_until else None)
+        )
+        self.connection.commit()
+
+    def confirmed_on(self, window: airline_route.RouteWindow) -> Optional[datetime.date]:
+        row = self.connection.execute(
+            'SELECT confirmed_on FROM responses WHERE route_window = ?', (window.key(),)
+        ).fetchone()
+
+        return datetime.date.fromisoformat(row[0]) if row is not None and row[0] is not None else None
+
+    def covered_until(self, window: airline_route.RouteWindow) -> Optional[datetime.date]:
+        row = self.connection.execute(
+            'SELECT covered_until FROM responses WHERE route_window = ?', (window.key(),)
+        ).fetchone()
+
+        return datetime.date.fromisoformat(row[0]) if row is not None and row[0] is not None else None
+
+    def close(self):
+        sqlite_state.release(self.connection)
@@ -0,0 +1,145 @@
+"""
+Routes every airline is scraped on, read from the routes files once per process.
+
+Spiders scrape every route in both directions, so the catalog keeps every pair of airports once, in the direction it
+was first listed: a pair listed in both directions, or listed twice, would have all its windows requested twice.
+Airport codes are validated as IATA codes and interned, so the routes of all the airlines share their strings.
+
+`ROUTES_FILE` is a routes file, a directory of them or a comma separated list of both, the routes of an airline found
+in several files are merged.
+"""
+import collections
+import functools
+import glob
+import logging
+import os
+import re
+import sys
+
+from typing import Dict, Iterable, List, NamedTuple, Set, Tuple
+
+from . import airline_route, json_stream
+
+AIRPORT_CODE = re.compile(r'[A-Z]{3}')
+
+
+class CatalogStats(NamedTuple):
+    # Entries of the routes files
+    listed: int = 0
+    # Entries whose pair of airports was listed before in the other direction
+    mirrored: int = 0
+    # Entries listed before in the same direction
+    duplicated: int = 0
+    # Entries with an invalid airport code, or the same airport twice
+    invalid: int = 0
+
+    @property
+    def redundant(self) -> int:
+        return self.mirrored + self.duplicated
+
+
+class RouteCatalog:
+    def __init__(self):
+        self._routes: Dict[str, List[airline_route.Route]] = {}
+        # Pairs of airports of every airline, in the direction they were first listed
+        self._pairs: Dict[str, Set[Tuple[str, str]]] = {}
+        # Fields of `CatalogStats` of every airline
+        self._counts: Dict[str, collections.Counter] = {}
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def add(self, airline: str, source: str, destination: str):
+        counts, pairs = self._counts.get(airline), self._pairs.get(airline)
+
+        if counts is None:
+            counts, pairs = self._counts[airline], self._pairs[airline] = collections.Counter(), set()
+
+        counts['listed'] += 1
+        source, destination = source.strip().upper(), destination.strip().upper()
+
+        if not AIRPORT_CODE.fullmatch(source) or not AIRPORT_CODE.fullmatch(destination) or source == destination:
+            self.logger.warning(f'Invalid route {source}-{destination} of {airline} skipped')
+            counts['invalid'] += 1
+        elif (source, destination) in pairs:
+            counts['duplicated'] += 1
+        elif (destination, source) in pairs:
+            counts['mirrored'] += 1
+        else:
+            source, destination = sys.intern(source), sys.intern(destination)
+            pairs.add((source, destination))
+            self._routes.setdefault(airline, []).append(airline_route.Route(source, destination))
+
+    def add_file(self, path: str):
+        with open(path, 'rb') as f:
+            airlines: Dict[str, List[dict]] = json_stream.loads(f.read())
+
+        for airline, routes in airlines.items():
+            for route in routes:
+                try:
+                    self.add(airline, route['source'], route['destination'])
+                except (KeyError, TypeError, AttributeError):
+                    self.logger.error(f'{route} of {airline} in {path} is not a route')
+                    self._counts.setdefault(airline, collections.Counter()).update(listed=1, invalid=1)
+
+    def routes(self, airline: str) -> List[airline_route.Route]:
+        return list(self._routes.get(airline, []))
+
+    def stats(self, airline: str) -> CatalogStats:
+        counts = self._counts.get(airline, {})
+
+        return CatalogStats(*(counts.get(field, 0) for field in CatalogStats._fields))
+
+    def contains(self, airline: str, route: airline_route.Route) -> bool:
+        """
+        Whether `route` is scraped for `airline`, in either direction
+        """
+        pairs = self._pairs.get(airline, ())
+
+        return (route.source, route.destination) in pairs or (route.destination, route.source) in pairs
+
+    @staticmethod
+    def from_keys(airline: str, keys: Iterable[str]) -> 'RouteCatalog':
+        """
+        Catalog of the `SRC-DST` routes of a single airline
+        """
+        catalog = RouteCatalog()
+
+        for key in keys:
+            source, _, destination = key.partition('-')
+            catalog.add(airline, source, destination)
+
+        return catalog
+
+
+def route_files(spec: str) -> List[str]:
+    """
+    Routes files of `ROUTES_FILE`, the JSON files of its directories in name order
+    """
+    paths = []
+
+    for part in (part.strip() for part in spec.split(',')):
+        if not part:
+            continue
+
+        paths.extend(sorted(glob.glob(os.path.join(part, '*.json'))) if os.path.isdir(part) else [part])
+
+    return paths
+
+
+@functools.lru_cache(maxsize=4)
+def _load(paths: Tuple[str, ...], _mtimes: Tuple[float, ...]) -> RouteCatalog:
+    catalog = RouteCatalog()
+
+    for path in paths:
+        catalog.add_file(path)
+
+    return catalog
+
+
+def load(spec: str) -> RouteCatalog:
+    """
+    Catalog of the routes files of `spec`, read again only once one of them is modified. Spiders of the same process
+    share it, so it must not be modified
+    """
+    paths = tuple(route_files(spec))
+
+    return _load(paths, tuple(os.path.getmtime(path) for path in paths))
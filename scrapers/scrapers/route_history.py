@@ -0,0 +1,74 @@
+"""
+What past crawls learnt about every route: when it was last scraped and how often its prices change.
+
+Spiders use it to scrape first what is the most likely to be out of date.
+"""
+import datetime
+
+from typing import Dict, NamedTuple, Tuple
+
+from . import airline_route, sqlite_state
+
+# Weight of the latest crawl in the volatility of a route
+VOLATILITY_SMOOTHING = 0.3
+
+
+class RouteStats(NamedTuple):
+    last_scraped: datetime.date
+    # Moving average of the fraction of fares whose price changed between crawls, from 0 to 1
+    volatility: float
+
+
+class RouteHistory:
+    def __init__(self, path: str, commit_every: int = 1000):
+        self.commit_every = commit_every
+        self.uncommitted = 0
+        self.connection = sqlite_state.connect(path)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS routes ('
+            '   airline TEXT NOT NULL,'
+            '   source TEXT NOT NULL,'
+            '   destination TEXT NOT NULL,'
+            '   last_scraped TEXT NOT NULL,'
+            '   volatility REAL NOT NULL,'
+            '   PRIMARY KEY (airline, source, destination)'
+            ') WITHOUT ROWID'
+        )
+        self.connection.commit()
+
+    def record(self, window: airline_route.RouteWindow, fares: int, changed: int, today: datetime.date):
+        """
+        Records the scrape of `window`, in which `changed` out of `fares` fares were new or had a different price
+        """
+        changed_fraction = changed / fares if fares else 0.0
+
+        self.connection.execute(
+            'INSERT INTO routes (airline, source, destination, last_scraped, volatility) VALUES (?, ?, ?, ?, ?) '
+            'ON CONFLICT (airline, source, destination) DO UPDATE SET last_scraped = excluded.last_scraped, '
+            '   volatility = volatility * ? + excluded.volatility * ?',
+            (window.airline, window.source, window.destination, today.isoformat(), changed_fraction,
+             1 - VOLATILITY_SMOOTHING, VOLATILITY_SMOOTHING)
+        )
+        self.uncommitted += 1
+
+        if self.uncommitted >= self.commit_every:
+            self.commit()
+
+    def routes(self, airline: str) -> Dict[Tuple[str, str], RouteStats]:
+        """
+        Stats of every route of `airline` scraped before, keyed by (source, destination)
+        """
+        return {
+            (source, destination): RouteStats(datetime.date.fromisoformat(last_scraped), volatility)
+            for source, destination, last_scraped, volatility in self.connection.execute(
+                'SELECT source, destination, last_scraped, volatility FROM routes WHERE airline = ?', (airline,)
+            )
+        }
+
+    def commit(self):
+        self.connection.commit()
+        self.uncommitted = 0
+
+    def close(self):
+        self.commit()
+        sqlite_state.release(self.connection)
@@ -0,0 +1,264 @@
+"""
+Long-lived process crawling all the airlines, instead of a cold `scrapy crawl` process per airline and per run.
+
+All the spiders run in the same reactor and deliver through a single Kafka producer, the interpreter, Scrapy and the
+routes file are loaded once. Crawls are triggered every day at the times of `CRAWL_SCHEDULE`, a trigger firing while
+the previous run is still going is skipped.
+
+The routes can be split between several runners, each crawling a shard of them, see `scrapers.sharding`. With
+`--processes`, the runner starts that many runners crawling a shard of its own shard each, with a state directory of
+their own, and reports their progress.
+
+With `METRICS_PORT`, the metrics of every crawl of the process are served at `/metrics` on that port, in the text
+format of Prometheus. The runners of `--processes` serve theirs on the ports from `METRICS_PORT` on.
+
+Usage (from the directory holding `scrapy.cfg`):
+    python -m scrapers.runner                   # every airline, on schedule
+    python -m scrapers.runner --now             # also right away
+    python -m scrapers.runner --once WizzAir    # a single run of WizzAir, then exit
+    python -m scrapers.runner --shard 1/4       # the second quarter of the routes, on schedule
+    python -m scrapers.runner --once --processes 4
+    python -m scrapers.runner --once --sink parquet   # fares to Parquet files instead of Kafka, see `scrapers.sinks`
+"""
+import time
+
+# Taken before the heavy imports below, so the reported startup time includes them
+STARTED = time.perf_counter()
+
+import argparse  # noqa: E402
+import datetime  # noqa: E402
+import logging  # noqa: E402
+import os  # noqa: E402
+import subprocess  # noqa: E402
+import sys  # noqa: E402
+
+from typing import List, Optional  # noqa: E402
+
+from scrapy import crawler  # noqa: E402
+from scrapy.utils import project, reactor as scrapy_reactor  # noqa: E402
+from twisted.internet import defer  # noqa: E402
+from twisted.web import resource, server  # noqa: E402
+
+from . import metrics, pipelines, sharding  # noqa: E402
+
+
+def parse_schedule(schedule: str) -> List[datetime.time]:
+    """
+    Comma separated `HH:MM` times of the day
+    """
+    return sorted(datetime.time.fromisoformat(at.strip()) for at in schedule.split(',') if at.strip())
+
+
+def next_trigger(now: datetime.datetime, schedule: List[datetime.time]) -> datetime.datetime:
+    for at in schedule:
+        candidate = datetime.datetime.combine(now.date(), at)
+
+        if candidate > now:
+            return candidate
+
+    return datetime.datetime.combine(now.date() + datetime.timedelta(days=1), schedule[0])
+
+
+class CrawlRunner:
+    def __init__(self, process: crawler.CrawlerProcess, spiders: List[str], schedule: List[datetime.time],
+                 shard: Optional[sharding.Shard] = None):
+        self.process = process
+        self.spiders = spiders
+        self.schedule = schedule
+        # Spiders take theirs from the settings when not given
+        self.shard = shard
+        self.logger = logging.getLogger(self.__class__.__name__)
+        # Shared by the pipelines of every crawl, connected by the first one
+        self.producer = pipelines.SharedProducer()
+        self.running: Optional[defer.Deferred] = None
+        self.runs = 0
+
+    def run(self) -> defer.Deferred:
+        """
+        Crawls all the spiders concurrently, the deferred fires once all of them finished
+        """
+        if self.running is not None:
+            self.logger.warning('Previous run is still going, skipping this one')
+            return self.running
+
+        self.runs += 1
+        started = time.perf_counter()
+        crawlers = []
+
+        for name in self.spiders:
+            c = self.process.create_crawler(name)
+            c.shared_producer = self.producer
+            crawlers.append(c)
+
+        self.logger.info(f'Run {self.runs} started for {", ".join(self.spiders)}'
+                         f'{f", shard {self.shard}" if self.shard is not None else ""}')
+        spider_args = {'shard': str(self.shard)} if self.shard is not None else {}
+        self.running = defer.DeferredList(
+            [self.process.crawl(c, **spider_args) for c in crawlers], consumeErrors=True
+        )
+        self.running.addCallback(lambda results: self._report(crawlers, results, time.perf_counter() - started))
+
+        return self.running
+
+    def _report(self, crawlers: List[crawler.Crawler], results: list, elapsed: float):
+        self.running = None
+
+        for c, (success, result) in zip(crawlers, results):
+            stats = c.stats.get_stats()
+
+            if not success:
+                self.logger.error(f'Crawl of {c.spidercls.name} failed: {result.value!r}')
+                continue
+
+            self.logger.info(
+                f'Crawl of {c.spidercls.name} took {stats.get("elapsed_time_seconds", 0):.1f}s, '
+                f'{stats.get("item_scraped_count", 0)} items, {stats.get("downloader/request_count", 0)} requests, '
+                f'finished with {stats.get("finish_reason")}'
+            )
+
+        self.logger.info(f'Run {self.runs} took {elapsed:.1f}s')
+
+    def schedule_next(self):
+        if not self.schedule:
+            return
+
+        from twisted.internet import reactor
+
+        trigger = next_trigger(datetime.datetime.now(), self.schedule)
+        self.logger.info(f'Next run at {trigger}')
+        reactor.callLater((trigger - datetime.datetime.now()).total_seconds(), self._on_trigger)
+
+    def _on_trigger(self):
+        self.run()
+        self.schedule_next()
+
+
+class MetricsResource(resource.Resource):
+    """
+    Series of every crawl of the process, in the text format of Prometheus
+    """
+    isLeaf = True
+
+    def __init__(self, registry: metrics.Registry):
+        super().__init__()
+        self.registry = registry
+
+    def render_GET(self, request) -> bytes:
+        request.setHeader(b'Content-Type', b'text/plain; version=0.0.4')
+        return self.registry.render().encode()
+
+
+def serve_metrics(port: int, registry: metrics.Registry = metrics.REGISTRY):
+    from twisted.internet import reactor
+
+    root = resource.Resource()
+    root.putChild(b'metrics', MetricsResource(registry))
+
+    return reactor.listenTCP(port, server.Site(root))
+
+
+def run_shards(argv: List[str], shard: sharding.Shard, processes: int, state_dir: str, progress_dir: str,
+               interval: float, metrics_port: int = 0) -> int:
+    """
+    Runs `processes` runners with the arguments `argv`, each crawling its own part of `shard` with a state directory of
+    its own and serving its metrics on a port of its own from `metrics_port` on, and logs the progress of their shards
+    until they all exit
+    """
+    logger = logging.getLogger('CrawlRunner')
+    count = shard.count * processes
+    children = []
+
+    for offset, index in enumerate(range(shard.index * processes, (shard.index + 1) * processes)):
+        env = {
+            **os.environ,
+            'STATE_DIR': os.path.join(state_dir, f'shard-{index}'),
+            'SHARD_PROGRESS_DIR': progress_dir,
+            'METRICS_PORT': str(metrics_port + offset if metrics_port else 0),
+        }
+        children.append(subprocess.Popen(
+            [sys.executable, '-m', 'scrapers.runner', *argv, '--shard', f'{index}/{count}'], env=env
+        ))
+
+    logger.info(f'Started {processes} runners for shards {shard.index * processes} to '
+                f'{(shard.index + 1) * processes - 1} out of {count}')
+
+    try:
+        while any(child.poll() is None for child in children):
+            time.sleep(interval)
+
+            for progress in sharding.read_progress(progress_dir):
+                if not progress['shard'].endswith(f'/{count}'):
+                    continue
+
+                logger.info(
+                    f'Shard {progress["shard"]} of {progress["airline"]}: {progress["windows_started"]} out of '
+                    f'{progress["windows"]} windows started, {progress["done"]} done, {progress["failed"]} failed, '
+                    f'{progress["items"]} items{", " + progress["finish_reason"] if progress["finish_reason"] else ""}'
+                )
+    except KeyboardInterrupt:
+        for child in children:
+            child.terminate()
+
+    return max(child.wait() for child in children)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('spiders', nargs='*', help='Spiders to run, all of them by default')
+    parser.add_argument('--now', action='store_true', help='Run right away, then on schedule')
+    parser.add_argument('--once', action='store_true', help='Run right away, then exit')
+    parser.add_argument('--shard', type=sharding.Shard.parse,
+                        help='Shard of the routes to crawl, `index/count` from `0/count`, SHARD_INDEX/SHARD_COUNT '
+                             'by default')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='Split the shard between this many runner processes')
+    parser.add_argument('--sink', choices=pipelines.SINKS,
+                        help='Where the fares go, SINK by default')
+    args = parser.parse_args()
+
+    settings = project.get_project_settings()
+    if args.sink is not None:
+        settings.set('SINK', args.sink, priority='cmdline')
+
+    if args.processes > 1:
+        shard = args.shard or sharding.Shard(settings.getint('SHARD_INDEX'), settings.getint('SHARD_COUNT'))
+        logging.basicConfig(
+            format=settings.get('LOG_FORMAT'), datefmt=settings.get('LOG_DATEFORMAT'), level=settings.get('LOG_LEVEL')
+        )
+        argv = args.spiders + [flag for flag, on in [('--now', args.now), ('--once', args.once)] if on]
+        argv += ['--sink', args.sink] if args.sink is not None else []
+        sys.exit(run_shards(
+            argv, shard, args.processes, settings.get('STATE_DIR'), settings.get('SHARD_PROGRESS_DIR'),
+            settings.getfloat('SHARD_PROGRESS_INTERVAL') or 30, settings.getint('METRICS_PORT'),
+        ))
+
+    # Crawlers install it only when created, the runner needs it before
+    scrapy_reactor.install_reactor(settings.get('TWISTED_REACTOR'), settings.get('ASYNCIO_EVENT_LOOP'))
+    process = crawler.CrawlerProcess(settings)
+    runner = CrawlRunner(
+        process,
+        args.spiders or process.spider_loader.list(),
+        [] if args.once else parse_schedule(settings.get('CRAWL_SCHEDULE')),
+        args.shard,
+    )
+
+    from twisted.internet import reactor
+
+    if settings.getbool('METRICS_ENABLED') and settings.getint('METRICS_PORT'):
+        serve_metrics(settings.getint('METRICS_PORT'))
+        runner.logger.info(f'Serving the metrics of the crawls on port {settings.getint("METRICS_PORT")}')
+
+    # After the crawls were stopped, so the producer is flushed with everything they scraped
+    reactor.addSystemEventTrigger('after', 'shutdown', runner.producer.close)
+
+    runner.logger.info(f'Runner started in {time.perf_counter() - STARTED:.2f}s')
+
+    if args.now or args.once:
+        runner.run()
+
+    runner.schedule_next()
+    process.start(stop_after_crawl=args.once)
+
+
+if __name__ == '__main__':
+    main()
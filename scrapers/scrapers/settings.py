@@ -28,6 +28,7 @@ ROBOTSTXT_OBEY = False
 # Configure a delay for requests for the same website (default: 0)
 # See https://docs.scrapy.org/en/latest/topics/settings.html#download-delay
 # See also autothrottle settings and docs
+# With rate control enabled, these two are only the starting rate of airlines crawled for the first time
 DOWNLOAD_DELAY = 10
 # The download delay setting will honor only one of:
 CONCURRENT_REQUESTS_PER_DOMAIN = 2
@@ -47,9 +48,14 @@ CONCURRENT_REQUESTS_PER_DOMAIN = 2
 
 # Enable or disable spider middlewares
 # See https://docs.scrapy.org/en/latest/topics/spider-middleware.html
-# SPIDER_MIDDLEWARES = {
-#    'scrapers.middlewares.AirlineScraperSpiderMiddleware': 543,
-# }
+SPIDER_MIDDLEWARES = {
+   'scrapers.middlewares.CrawlLedgerMiddleware': 541,
+   'scrapers.middlewares.RouteHistoryMiddleware': 542,
+   'scrapers.middlewares.WindowPlannerMiddleware': 543,
+   'scrapers.middlewares.ResponseCacheMiddleware': 544,
+   # The closest to the spider, to time only its callbacks
+   'scrapers.middlewares.AirlineScraperSpiderMiddleware': 950,
+}
 
 # Enable or disable downloader middlewares
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
@@ -59,19 +65,54 @@ CONCURRENT_REQUESTS_PER_DOMAIN = 2
 
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
-# EXTENSIONS = {
-#    'scrapy.extensions.telnet.TelnetConsole': None,
-# }
+EXTENSIONS = {
+    'scrapers.sharding.ShardProgress': 500,
+}
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 ITEM_PIPELINES = {
-    'scrapers.pipelines.AirlineScraperPipeline': 0,
+    'scrapers.pipelines.PriceDeltaPipeline': 300,
+    'scrapers.pipelines.CurrencyNormalizationPipeline': 400,
+    'scrapers.pipelines.AirlineScraperPipeline': 900,
+    'scrapers.pipelines.BulkSinkPipeline': 900,
 }
 
+# Kafka producer delivery tuning
+# See https://kafka-python.readthedocs.io/en/master/apidoc/KafkaProducer.html
+# Upper bound, in bytes, of a record batch sent to a partition. Default 16384
+KAFKA_BATCH_SIZE = int(os.environ.get('KAFKA_BATCH_SIZE', 256 * 1024))
+# How long the producer waits for a batch to fill up before sending it. Default 0
+KAFKA_LINGER_MS = int(os.environ.get('KAFKA_LINGER_MS', 200))
+# Memory used to buffer records waiting to be sent, `send` blocks when it is exhausted. Default 32MB
+KAFKA_BUFFER_MEMORY = int(os.environ.get('KAFKA_BUFFER_MEMORY', 32 * 1024 * 1024))
+# One of `gzip`, `snappy`, `lz4`, `zstd` or empty for no compression.
+# Falls back to `gzip` when the codec's library is not installed
+KAFKA_COMPRESSION_TYPE = os.environ.get('KAFKA_COMPRESSION_TYPE', 'lz4')
+
+# Directory of the on-disk outbox items are written to before a background thread delivers them to Kafka.
+# Undelivered items survive restarts and broker outages. Every spider spools in a directory of its own, which a single
+# process at a time can use. Leave empty to send items straight to Kafka
+KAFKA_SPOOL_DIR = os.environ.get('KAFKA_SPOOL_DIR', '')
+KAFKA_SPOOL_SEGMENT_SIZE = int(os.environ.get('KAFKA_SPOOL_SEGMENT_SIZE', 64 * 1024 * 1024))
+# Seconds a closing spider waits for its spool to be delivered, what is left is delivered by the next crawl
+KAFKA_SPOOL_DRAIN_TIMEOUT = int(os.environ.get('KAFKA_SPOOL_DRAIN_TIMEOUT', 300))
+
+# ClickHouse HTTP interface, used by `python -m scrapers.clickhouse_migrate` and the `clickhouse` sink
+CLICKHOUSE_URL = os.environ.get('CLICKHOUSE_URL', 'http://localhost:18123')
+CLICKHOUSE_USER = os.environ.get('CLICKHOUSE_USER', 'default')
+CLICKHOUSE_PASSWORD = os.environ.get('CLICKHOUSE_PASSWORD', '')
+CLICKHOUSE_DATABASE = os.environ.get('CLICKHOUSE_DATABASE', 'flight_data')
+# Versioned migrations of the tables of `CLICKHOUSE_DATABASE`
+CLICKHOUSE_MIGRATIONS_DIR = os.environ.get('CLICKHOUSE_MIGRATIONS_DIR', os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'clickhouse', 'flight_data',
+    'migrations'
+))
+
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
-AUTOTHROTTLE_ENABLED = True
+# Disable it when enabling the rate control below, both would drive the delay of the same download slots
+AUTOTHROTTLE_ENABLED = os.environ.get('AUTOTHROTTLE_ENABLED', True)
 
 # The initial download delay.
 # Default 5
@@ -105,15 +146,129 @@ RANDOMIZE_DOWNLOAD_DELAY = True
 RETRY_TIMES = 2
 
 DOWNLOADER_MIDDLEWARES = {
+    # After RetryMiddleware (550) in the response chain, to see the responses being retried
+    'scrapers.middlewares.AdaptiveRateMiddleware': 800,
+    # Before RetryMiddleware (550) in the response chain, to send 404s of a gone API version again under the new one
+    'scrapers.middlewares.WizzAirSessionMiddleware': 560,
+    # The closest to the downloader, to see every response before it is retried or decompressed
+    'scrapers.middlewares.AirlineScraperDownloaderMiddleware': 950,
 }
 
 
 LOG_LEVEL = os.environ.get('LOG_LEVEL', logging.INFO)
+LOG_FORMATTER = 'scrapers.logformatter.AirlineScraperLogFormatter'
 LOG_FORMAT = os.environ.get('LOG_FORMAT', '[%(name)s] %(asctime)s %(levelname)s: %(message)s')
 
-ROUTES_FILE = os.path.join(
-    os.path.dirname(os.path.abspath(__file__)), os.environ.get('ROUTES_FILE', 'airline_routes.json')
+# Where spiders keep what they learn between crawls
+STATE_DIR = os.environ.get('STATE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.state'))
+
+# Skip parsing and emitting the fares of responses identical to the previous crawl's
+RESPONSE_CACHE_ENABLED = os.environ.get('RESPONSE_CACHE_ENABLED', False)
+RESPONSE_CACHE_PATH = os.path.join(STATE_DIR, 'response_cache.sqlite')
+# Fares of unchanged responses are emitted again once their last emission is this many days old
+RESPONSE_CACHE_MAX_AGE = int(os.environ.get('RESPONSE_CACHE_MAX_AGE', 7))
+
+# Emit only new fares and fares whose price changed, plus a full snapshot every `PRICE_DELTA_SNAPSHOT_INTERVAL` days.
+# Queries then have to look for the latest price scraped up to a date instead of the prices of a single scrape date
+PRICE_DELTA_ENABLED = os.environ.get('PRICE_DELTA_ENABLED', False)
+PRICE_DELTA_SNAPSHOT_INTERVAL = int(os.environ.get('PRICE_DELTA_SNAPSHOT_INTERVAL', 7))
+PRICE_DELTA_INDEX_PATH = os.path.join(STATE_DIR, 'fare_index.sqlite')
+
+# Adjust the concurrency and delay of every airline from its responses: additive increase after
+# `RATE_CONTROL_INCREASE_EVERY` quick successes, halving on the spider's `BACKOFF_STATUSES` and download errors.
+# The last safe rate of every airline is stored in `RATE_CONTROL_PATH` and the next crawl starts from it.
+# Off by default, enable it with `AUTOTHROTTLE_ENABLED` off. The limits are meant for the live airline APIs, raise them
+# only for airlines known to take more
+RATE_CONTROL_ENABLED = os.environ.get('RATE_CONTROL_ENABLED', False)
+RATE_CONTROL_PATH = os.path.join(STATE_DIR, 'rate_control.json')
+RATE_CONTROL_MIN_DELAY = float(os.environ.get('RATE_CONTROL_MIN_DELAY', 2))
+RATE_CONTROL_MAX_DELAY = float(os.environ.get('RATE_CONTROL_MAX_DELAY', 100))
+RATE_CONTROL_MAX_CONCURRENCY = int(os.environ.get('RATE_CONTROL_MAX_CONCURRENCY', 4))
+# Seconds removed from the delay on every increase
+RATE_CONTROL_DELAY_STEP = float(os.environ.get('RATE_CONTROL_DELAY_STEP', 1))
+RATE_CONTROL_INCREASE_EVERY = int(os.environ.get('RATE_CONTROL_INCREASE_EVERY', 10))
+# Responses slower than this many seconds hold the rate
+RATE_CONTROL_TARGET_LATENCY = float(os.environ.get('RATE_CONTROL_TARGET_LATENCY', 10))
+
+# Record which route windows the crawls of the day scraped in `CRAWL_LEDGER_PATH`, and send the windows given up on
+# again `CRAWL_LEDGER_RETRY_DELAY` seconds later, doubling the delay every time, up to `CRAWL_LEDGER_MAX_ATTEMPTS`
+# attempts. `CRAWL_RESUME` requests only the windows not scraped yet by the crawls of the day
+CRAWL_LEDGER_ENABLED = os.environ.get('CRAWL_LEDGER_ENABLED', True)
+CRAWL_LEDGER_PATH = os.path.join(STATE_DIR, 'crawl_ledger.sqlite')
+CRAWL_LEDGER_MAX_ATTEMPTS = int(os.environ.get('CRAWL_LEDGER_MAX_ATTEMPTS', 3))
+CRAWL_LEDGER_RETRY_DELAY = float(os.environ.get('CRAWL_LEDGER_RETRY_DELAY', 60))
+CRAWL_RESUME = os.environ.get('CRAWL_RESUME', False)
+
+# Search the airlines by windows of departure dates as large as they answer in full, up to the `MAX_WINDOW_SIZE` of
+# every spider, see `scrapers.window_planner`. The limits learnt are stored in `WINDOW_PLANNER_PATH`
+WINDOW_PLANNER_ENABLED = os.environ.get('WINDOW_PLANNER_ENABLED', True)
+WINDOW_PLANNER_PATH = os.path.join(STATE_DIR, 'window_planner.json')
+
+# Set the euro price of every fare from the daily reference rates of the ECB, fetched once a day from `FX_RATES_URL`
+# and cached with the rates of every day fetched before in `FX_RATES_PATH`, see `scrapers.fx_rates`. Off by default,
+# crawls do not reach out to other hosts than the airlines' unless asked to. Fares keep `price_eur` unset when the
+# rates cannot be fetched
+FX_NORMALIZATION_ENABLED = os.environ.get('FX_NORMALIZATION_ENABLED', False)
+FX_RATES_PATH = os.path.join(STATE_DIR, 'fx_rates.json')
+FX_RATES_URL = os.environ.get('FX_RATES_URL', 'https://www.ecb.europa.eu/stats/eurofxref/eurofxref-hist-90d.xml')
+
+# When every route was last scraped and how often its prices change, used to prioritize requests
+ROUTE_HISTORY_PATH = os.path.join(STATE_DIR, 'route_history.sqlite')
+ROUTE_HISTORY_FARES_PATH = os.path.join(STATE_DIR, 'route_history_fares.sqlite')
+
+# Requests are scheduled by a score between 0 and 1, the weighted sum of how soon the window departs, how long ago its
+# route was scraped and how often the prices of its route change
+SCHEDULE_PROXIMITY_WEIGHT = float(os.environ.get('SCHEDULE_PROXIMITY_WEIGHT', 0.5))
+SCHEDULE_STALENESS_WEIGHT = float(os.environ.get('SCHEDULE_STALENESS_WEIGHT', 0.3))
+SCHEDULE_VOLATILITY_WEIGHT = float(os.environ.get('SCHEDULE_VOLATILITY_WEIGHT', 0.2))
+# Routes not scraped for this many days, or never, are the stalest
+SCHEDULE_STALE_AFTER = timedelta(days=int(os.environ.get('SCHEDULE_STALE_AFTER', 7)))
+
+# Record download latencies, response sizes and statuses, parse times and Kafka send times. They are served by the
+# `/metrics` endpoint of the API server, by the one of `scrapers.runner` on `METRICS_PORT` when set, and written in
+# Prometheus' text format to `METRICS_DUMP_DIR` when a spider closes
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', True)
+METRICS_DUMP_DIR = os.environ.get('METRICS_DUMP_DIR', os.path.join(STATE_DIR, 'metrics'))
+METRICS_PORT = int(os.environ.get('METRICS_PORT', 0))
+
+# A routes file, a directory of them or a comma separated list of both, relative to this directory
+ROUTES_FILE = ','.join(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), path)
+    for path in os.environ.get('ROUTES_FILE', 'airline_routes.json').split(',')
 )
 
+# Look the WizzAir API version up and send back the token WizzAir sets to every request. The version found is stored in
+# `WIZZAIR_SESSION_PATH` and looked up again once it is `WIZZAIR_VERSION_MAX_AGE` days old, or when the API answers 404s
+WIZZAIR_SESSION_ENABLED = os.environ.get('WIZZAIR_SESSION_ENABLED', True)
+WIZZAIR_SESSION_PATH = os.path.join(STATE_DIR, 'wizzair_session.json')
+WIZZAIR_VERSION_MAX_AGE = int(os.environ.get('WIZZAIR_VERSION_MAX_AGE', 1))
+
+# Searches packed into a single EasyJet request, each one for a different day. 1 sends one search per request
+EASYJET_SEARCHES_PER_REQUEST = int(os.environ.get('EASYJET_SEARCHES_PER_REQUEST', 10))
+
+# Shard of the routes of every airline crawled by this worker, from 0 to `SHARD_COUNT` - 1, see `scrapers.sharding`.
+# Shards also split the request rate budget of every airline, so set `SHARD_COUNT` to the number of workers sharing it
+SHARD_INDEX = int(os.environ.get('SHARD_INDEX', 0))
+SHARD_COUNT = int(os.environ.get('SHARD_COUNT', 1))
+# Where every shard writes its progress every `SHARD_PROGRESS_INTERVAL` seconds, 0 disables it
+SHARD_PROGRESS_DIR = os.environ.get('SHARD_PROGRESS_DIR', os.path.join(STATE_DIR, 'shards'))
+SHARD_PROGRESS_INTERVAL = float(os.environ.get('SHARD_PROGRESS_INTERVAL', 30))
+
+# Comma separated `HH:MM` times of the day `python -m scrapers.runner` crawls all the airlines at
+CRAWL_SCHEDULE = os.environ.get('CRAWL_SCHEDULE', '18:20')
+
+# Crawls the API server runs at the same time, each one in its own process, and with the stores of its own
+# `STATE_DIR/api-worker-<slot>` directory
+CRAWL_API_WORKERS = int(os.environ.get('CRAWL_API_WORKERS', 2))
+
 # Want to scrape 6 months in advance
-DAYS_TO_SCRAPE = timedelta(days=os.environ.get('DAYS_TO_SCRAPE', 180))
+DAYS_TO_SCRAPE = timedelta(days=int(os.environ.get('DAYS_TO_SCRAPE', 180)))
+
+# Where the fares go: `kafka`, or a bulk sink writing them in batches of `SINK_BATCH_SIZE`, see `scrapers.sinks`:
+# `parquet` or `arrow` files in `SINK_DIR`, or `clickhouse` inserts into `flights` in `SINK_CLICKHOUSE_FORMAT`
+# (`RowBinary` or `JSONEachRow`). A single crawl picks its own with `-s SINK=...`, the `--sink` of the runner or the
+# `sink` of a crawl started through the API server
+SINK = os.environ.get('SINK', 'kafka')
+SINK_BATCH_SIZE = int(os.environ.get('SINK_BATCH_SIZE', 100000))
+SINK_DIR = os.environ.get('SINK_DIR', os.path.join(STATE_DIR, 'fares'))
+SINK_CLICKHOUSE_FORMAT = os.environ.get('SINK_CLICKHOUSE_FORMAT', 'RowBinary')
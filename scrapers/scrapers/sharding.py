@@ -0,0 +1,164 @@
+"""
+Deterministic split of the routes of every airline between shards, crawled by different workers or processes.
+
+Routes are hashed by airline, source and destination onto a ring where every shard owns `VIRTUAL_NODES` points, and
+belong to the shard owning the first point after them (consistent hashing). Every worker computes the same split
+without talking to the others, and going from N to N + 1 shards moves only about 1 / (N + 1) of the routes, the
+others keep the state their shard learnt about them. Shards split the request rate budget of every airline as well,
+see `AdaptiveRateMiddleware`.
+
+`ShardProgress` writes the progress of every shard to `SHARD_PROGRESS_DIR`, `python -m scrapers.runner --processes`
+reports it.
+"""
+import bisect
+import datetime
+import functools
+import glob
+import hashlib
+import json
+import os
+
+from typing import List, NamedTuple, Tuple
+
+from scrapy import exceptions, signals
+from twisted.internet import task
+
+from . import airline_route
+
+# Points of every shard on the ring, more points spread the routes more evenly
+VIRTUAL_NODES = 128
+
+
+class Shard(NamedTuple):
+    # From 0 to `count` - 1
+    index: int
+    count: int
+
+    def __str__(self) -> str:
+        return f'{self.index}/{self.count}'
+
+    @staticmethod
+    def parse(value: str) -> 'Shard':
+        """
+        `index/count`, `1/4` is the second shard out of 4
+        """
+        index, count = (int(part) for part in value.split('/'))
+
+        if not 0 <= index < count:
+            raise ValueError(f'Shard {value} is not between 0/{count} and {count - 1}/{count}')
+
+        return Shard(index, count)
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big')
+
+
+@functools.lru_cache(maxsize=8)
+def _ring(count: int) -> Tuple[List[int], List[int]]:
+    """
+    Sorted points of the ring and the shard owning every one of them
+    """
+    points = sorted((_hash(f'shard-{index}-{node}'), index) for index in range(count) for node in range(VIRTUAL_NODES))
+
+    return [point for point, _ in points], [index for _, index in points]
+
+
+def shard_of(airline: str, route: airline_route.Route, count: int) -> int:
+    if count == 1:
+        return 0
+
+    points, owners = _ring(count)
+    i = bisect.bisect(points, _hash(f'{airline}/{route.source}-{route.destination}'))
+
+    return owners[i % len(points)]
+
+
+def routes_of(shard: Shard, airline: str, routes: List[airline_route.Route]) -> List[airline_route.Route]:
+    return [route for route in routes if shard_of(airline, route, shard.count) == shard.index]
+
+
+def progress_path(directory: str, airline: str, shard: Shard) -> str:
+    return os.path.join(directory, f'{airline}-{shard.index}-of-{shard.count}.json')
+
+
+def read_progress(directory: str) -> List[dict]:
+    """
+    Last progress written by every shard of every airline
+    """
+    progress = []
+
+    for path in sorted(glob.glob(os.path.join(directory, '*.json'))):
+        try:
+            with open(path, 'r') as f:
+                progress.append(json.load(f))
+        except (FileNotFoundError, json.JSONDecodeError):
+            continue
+
+    return progress
+
+
+class ShardProgress:
+    """
+    Writes the routes and the windows of the spider's shard, and how far the spider got through them, every
+    `SHARD_PROGRESS_INTERVAL` seconds and when the spider closes. Only enabled for spiders crawling a shard out of
+    several.
+    """
+
+    def __init__(self, stats, directory: str, interval: float):
+        self.stats = stats
+        self.directory = directory
+        self.interval = interval
+        self.task = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+
+        if not settings.getfloat('SHARD_PROGRESS_INTERVAL'):
+            raise exceptions.NotConfigured
+
+        s = cls(crawler.stats, settings.get('SHARD_PROGRESS_DIR'), settings.getfloat('SHARD_PROGRESS_INTERVAL'))
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def spider_opened(self, spider):
+        shard = getattr(spider, 'shard', None)
+
+        if shard is None or shard.count == 1:
+            return
+
+        os.makedirs(self.directory, exist_ok=True)
+        self.task = task.LoopingCall(self.write, spider)
+        self.task.start(self.interval)
+
+    def write(self, spider, finish_reason=None):
+        stats = self.stats.get_stats(spider)
+        path = progress_path(self.directory, spider.name, spider.shard)
+
+        with open(f'{path}.tmp', 'w') as f:
+            json.dump({
+                'airline': spider.name,
+                'shard': str(spider.shard),
+                'routes': len(spider.routes),
+                # Windows of `window_size` days to scrape, known once the spider started sending its requests, and the
+                # ones whose requests were sent
+                'windows': stats.get('scheduling/windows'),
+                'windows_started': stats.get('scheduling/windows_started', 0),
+                # Responses of the windows, several per window for airlines searching a few days per request
+                'done': stats.get('crawl_ledger/done', 0),
+                'failed': stats.get('crawl_ledger/failed', 0),
+                'items': stats.get('item_scraped_count', 0),
+                'finish_reason': finish_reason,
+                'updated_at': datetime.datetime.now().isoformat(timespec='seconds'),
+            }, f)
+
+        os.replace(f'{path}.tmp', path)
+
+    def spider_closed(self, spider, reason):
+        if self.task is None:
+            return
+
+        self.task.stop()
+        self.write(spider, reason)
@@ -0,0 +1,249 @@
+"""
+Bulk sinks the fares of a crawl are written to in batches, instead of Kafka, for deployments and backfills not worth a
+Kafka broker and its ClickHouse consumers. `BulkSinkPipeline` collects the fares and hands them to the sink
+`SINK` names, `SINK_BATCH_SIZE` at a time:
+- `parquet` and `arrow` write a Parquet or an Arrow IPC file per crawl to `SINK_DIR`, a row group or a record batch
+  per batch. Files are written under a temporary name and renamed once the crawl is over. Both need `pyarrow`;
+- `clickhouse` inserts every batch into `flights` over the HTTP interface, in `SINK_CLICKHOUSE_FORMAT`, on a connection
+  kept open for the whole crawl.
+"""
+import abc
+import datetime
+import importlib.util
+import os
+import struct
+import zoneinfo
+
+from typing import Callable, Dict, List, Optional
+
+from . import clickhouse_http, items
+
+# Columns of `flights`, in the order the sinks write them
+COLUMNS = ['flight_date', 'source', 'destination', 'price', 'price_eur', 'currency', 'company', 'scrape_date']
+
+_EPOCH = datetime.date(1970, 1, 1)
+_FLOAT32 = struct.Struct('<f')
+_NULLABLE_FLOAT32 = struct.Struct('<Bf')
+_UINT32 = struct.Struct('<I')
+_UINT16 = struct.Struct('<H')
+
+
+class Sink(abc.ABC):
+    """
+    Destination of the fares of a crawl, `write` is called with every batch and `close` once the crawl is over. They
+    are called outside of the reactor, from any thread of its pool, but one at a time
+    """
+
+    @abc.abstractmethod
+    def write(self, records: List[items.FareRecord]):
+        ...
+
+    def close(self):
+        pass
+
+
+def has_pyarrow() -> bool:
+    """
+    Whether pyarrow is installed, without importing it: it is only imported by the file sinks, crawls writing elsewhere
+    do not pay for its memory
+    """
+    return importlib.util.find_spec('pyarrow') is not None
+
+
+def _flight_datetime(value: str) -> datetime.datetime:
+    # Departures are local times, with seconds at most, or only a day
+    return datetime.datetime.fromisoformat(value[:19])
+
+
+def _array(values: list, arrow_type):
+    import pyarrow
+
+    if pyarrow.types.is_dictionary(arrow_type):
+        return pyarrow.array(values, arrow_type.value_type).dictionary_encode()
+
+    return pyarrow.array(values, arrow_type)
+
+
+class FileSink(Sink):
+    """
+    Fares of a crawl in a columnar file of `directory`, named after the spider and when the crawl started
+    """
+    EXTENSION = ''
+    # Whether the strings are dictionary encoded, every batch having its own dictionary
+    DICTIONARY_STRINGS = True
+
+    def __init__(self, directory: str, spider: str, started: datetime.datetime):
+        try:
+            import pyarrow
+        except ImportError:
+            raise RuntimeError(f'{self.__class__.__name__} needs pyarrow, install it with `pip install pyarrow`')
+
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f'{spider}-{started:%Y%m%dT%H%M%S}.{self.EXTENSION}')
+        self.tmp_path = f'{self.path}.tmp'
+        string = pyarrow.string()
+        if self.DICTIONARY_STRINGS:
+            string = pyarrow.dictionary(pyarrow.int32(), string)
+
+        self.schema = pyarrow.schema([
+            ('flight_date', pyarrow.timestamp('s')),
+            ('source', string),
+            ('destination', string),
+            ('price', pyarrow.float32()),
+            ('price_eur', pyarrow.float32()),
+            ('currency', string),
+            ('company', string),
+            ('scrape_date', pyarrow.date32()),
+        ])
+        self.writer = None
+
+    @abc.abstractmethod
+    def _open_writer(self):
+        ...
+
+    def _batch(self, records: List[items.FareRecord]):
+        import pyarrow
+
+        columns = [
+            [_flight_datetime(r.flight_date) for r in records],
+            [r.source for r in records],
+            [r.destination for r in records],
+            [r.price for r in records],
+            [r.price_eur for r in records],
+            [r.currency for r in records],
+            [r.company for r in records],
+            [datetime.date.fromisoformat(r.scrape_date) for r in records],
+        ]
+
+        return pyarrow.record_batch(
+            [_array(column, field.type) for column, field in zip(columns, self.schema)], schema=self.schema
+        )
+
+    def write(self, records: List[items.FareRecord]):
+        if self.writer is None:
+            self.writer = self._open_writer()
+
+        self.writer.write_batch(self._batch(records))
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            os.replace(self.tmp_path, self.path)
+
+
+class ParquetSink(FileSink):
+    EXTENSION = 'parquet'
+
+    def __init__(self, directory: str, spider: str, started: datetime.datetime, compression: str = 'zstd'):
+        super().__init__(directory, spider, started)
+        self.compression = compression
+
+    def _open_writer(self):
+        from pyarrow import parquet
+
+        return parquet.ParquetWriter(self.tmp_path, self.schema, compression=self.compression)
+
+
+class ArrowSink(FileSink):
+    EXTENSION = 'arrow'
+    # Arrow files hold a single dictionary per column for all their batches
+    DICTIONARY_STRINGS = False
+
+    def _open_writer(self):
+        from pyarrow import ipc
+
+        return ipc.new_file(self.tmp_path, self.schema)
+
+
+def _row_binary_string(value: str) -> bytes:
+    # Preceded by its length in bytes, as a LEB128 varint
+    encoded = value.encode('utf-8')
+    length, prefix = len(encoded), bytearray()
+
+    while True:
+        byte = length & 0x7f
+        length >>= 7
+        prefix.append(byte | (0x80 if length else 0))
+
+        if not length:
+            return bytes(prefix) + encoded
+
+
+class RowBinaryEncoder:
+    """
+    Fares in ClickHouse's `RowBinary` format, in the order of `COLUMNS`. `DateTime` values are seconds since the
+    epoch, the flight dates are local times of the airports, read as times of `timezone` like the server does with
+    the text formats
+    """
+
+    def __init__(self, timezone: str = 'UTC'):
+        self.timezone = zoneinfo.ZoneInfo(timezone)
+        # Repeated a lot within a crawl: a few airports, currencies, companies and scrape days
+        self.strings: Dict[str, bytes] = {}
+        self.days: Dict[str, bytes] = {}
+
+    def _string(self, value: str) -> bytes:
+        try:
+            return self.strings[value]
+        except KeyError:
+            encoded = self.strings[value] = _row_binary_string(value)
+            return encoded
+
+    def _day(self, value: str) -> bytes:
+        try:
+            return self.days[value]
+        except KeyError:
+            encoded = self.days[value] = _UINT16.pack((datetime.date.fromisoformat(value) - _EPOCH).days)
+            return encoded
+
+    def encode(self, records: List[items.FareRecord]) -> bytes:
+        chunks = []
+        string, day = self._string, self._day
+
+        for record in records:
+            flight_date = _flight_datetime(record.flight_date).replace(tzinfo=self.timezone)
+            chunks.append(_UINT32.pack(int(flight_date.timestamp())))
+            chunks.append(string(record.source))
+            chunks.append(string(record.destination))
+            chunks.append(_FLOAT32.pack(record.price))
+            chunks.append(b'\x01' if record.price_eur is None else _NULLABLE_FLOAT32.pack(0, record.price_eur))
+            chunks.append(string(record.currency))
+            chunks.append(string(record.company))
+            chunks.append(day(record.scrape_date))
+
+        return b''.join(chunks)
+
+
+class ClickHouseSink(Sink):
+    """
+    Inserts every batch into `table` in a single `INSERT`, in `RowBinary` or `JSONEachRow`
+    """
+    FORMATS = ['RowBinary', 'JSONEachRow']
+
+    def __init__(self, client: clickhouse_http.ClickHouseClient, table: str, insert_format: str = 'RowBinary'):
+        if insert_format not in self.FORMATS:
+            raise ValueError(f'Unknown insert format {insert_format}, expected one of {self.FORMATS}')
+
+        self.client = client
+        self.query = f'INSERT INTO {table} ({", ".join(COLUMNS)}) FORMAT {insert_format}'
+        self.encode: Optional[Callable[[List[items.FareRecord]], bytes]] = None
+        self.insert_format = insert_format
+        # Bytes of the inserts sent so far
+        self.sent = 0
+
+    def _encoder(self) -> Callable[[List[items.FareRecord]], bytes]:
+        if self.insert_format == 'JSONEachRow':
+            return items.encode_json_each_row
+
+        return RowBinaryEncoder(self.client.value('SELECT timezone()')).encode
+
+    def write(self, records: List[items.FareRecord]):
+        if self.encode is None:
+            self.encode = self._encoder()
+
+        body = self.encode(records)
+        self.client.execute(self.query, body)
+        self.sent += len(body)
+
+    def close(self):
+        self.client.close()
@@ -1,15 +1,109 @@
 import datetime
-from typing import List, Optional, Tuple, Set
+import functools
+import json
+from typing import Iterator, List, Optional
 
 import scrapy
 from scrapy import http
-from .. import airline_route
+from scrapy.spidermiddlewares import httperror
+from twisted.python import failure
+
+from .. import airline_route, items, json_stream, request_templates, settings
 from . import base_spider
 
+# Fragments shared by the single and the batched searches
+OFFER_FRAGMENTS = "fragment Offer on Offer {  id  price  pricePerPerson  currency  transferURL  duration  itinerary {  " \
+                  "  ...Itinerary  }}        fragment Itinerary on Itinerary {  outbound {    ...Route  }  homebound " \
+                  "{    ...Route  }}        fragment Route on Route {  id  origin {    code    name    city    " \
+                  "country  }  destination {    code    name    city    country  }  departure  arrival  duration  " \
+                  "operatingCarrier {    name    code    flightNumber  }  marketingCarrier {    name    code    " \
+                  "flightNumber  }  legs {    ...Leg  }}        fragment Leg on Leg {  id  duration  origin {    " \
+                  "code    name    city    country  }  destination {    code    name    city    country  }  " \
+                  "departure  arrival  carrierType  operatingCarrier {    name    code    flightNumber  }  " \
+                  "marketingCarrier {    name    code    flightNumber  }}"
+
+SEARCH_QUERY = "query searchResult($partner: Partner!, $origin: String!, $destination: String!, " \
+               "$passengerAges: [PositiveInt!]!, $metadata: Metadata!, $departureDateString: " \
+               "String!, $returnDateString: String, $sort: Sort, $limit: PositiveInt, " \
+               "$filters: OfferFiltersInput) {  search(    partner: $partner    origin: $origin " \
+               "   destination: $destination    passengerAges: $passengerAges    metadata: " \
+               "$metadata    departureDateString: $departureDateString    returnDateString: " \
+               "$returnDateString    sort: $sort    limit: $limit    filters: $filters  ) {    " \
+               "numberOfPages    offersFilters {      overnightStay      overnightFlight      " \
+               "connectionTime {        min        max      }      landing {        outbound {  " \
+               "        min          max        }        homebound {          min          max  " \
+               "      }      }      takeoff {        outbound {          min          max       " \
+               " }        homebound {          min          max        }      }    }    " \
+               "bestOffers {      RECOMMENDED {        ...Offer      }      QUICKEST {        " \
+               "...Offer      }      CHEAPEST {        ...Offer      }    }    offers {      " \
+               "...Offer    }    currency    residency  }}        " + OFFER_FRAGMENTS
+
+
+@functools.lru_cache(maxsize=None)
+def batched_search_query(searches: int) -> str:
+    """
+    One query running `searches` aliased searches (`d0`, `d1`, ...) that differ only by their departure date.
+    Only `bestOffers` is selected, the only part of a search the spider parses.
+    """
+    dates = ', '.join(f'$d{i}: String!' for i in range(searches))
+    aliases = ''.join(
+        f'  d{i}: search(    partner: $partner    origin: $origin    destination: $destination    '
+        f'passengerAges: $passengerAges    metadata: $metadata    departureDateString: $d{i}    limit: $limit  ) {{'
+        f'    bestOffers {{      RECOMMENDED {{        ...Offer      }}      QUICKEST {{        ...Offer      }}'
+        f'      CHEAPEST {{        ...Offer      }}    }}  }}'
+        for i in range(searches)
+    )
+
+    return f'query searchResults($partner: Partner!, $origin: String!, $destination: String!, ' \
+           f'$passengerAges: [PositiveInt!]!, $metadata: Metadata!, $limit: PositiveInt, {dates}) {{{aliases}}}' \
+           f'        {OFFER_FRAGMENTS}'
+
+
+# Variables of every search, the departure dates aside
+SEARCH_VARIABLES = {
+    "partner": "easyjet",
+    "metadata": {
+        "language": "en",
+        "currency": "EUR",
+    },
+    "origin": request_templates.Field("origin"),
+    "destination": request_templates.Field("destination"),
+    "passengerAges": [
+        18
+    ],
+    "limit": 1
+}
+
+
+# Bodies are encoded like `JsonRequest` does, with sorted keys
+SEARCH_TEMPLATE = request_templates.BodyTemplate({
+    "query": SEARCH_QUERY,
+    "variables": {
+        **SEARCH_VARIABLES,
+        "departureDateString": request_templates.Field("day"),
+        "returnDateString": None,
+    },
+}, sort_keys=True)
+
+
+@functools.lru_cache(maxsize=None)
+def batched_search_template(searches: int) -> request_templates.BodyTemplate:
+    """
+    Body of `batched_search_query`, with the departure date of every search in its `d0`, `d1`, ... fields
+    """
+    return request_templates.BodyTemplate({
+        "query": batched_search_query(searches),
+        "variables": {
+            **SEARCH_VARIABLES,
+            **{f"d{i}": request_templates.Field(f"d{i}") for i in range(searches)},
+        },
+    }, sort_keys=True)
+
 
 class EasyJetSpider(base_spider.BaseSpider):
     name = 'EasyJet'
-    allowed_domains = ['easyjet.com/']
+    # Searches go to the gateway of Dohop, not to easyjet.com
+    allowed_domains = ['easyjet.com', 'dohop.net']
     start_url = 'http://easyjet.com/'
 
     WINDOW_SIZE = datetime.timedelta(days=30)
@@ -23,6 +117,9 @@ class EasyJetSpider(base_spider.BaseSpider):
 
     API_ENDPOINT = 'https://gateway.prod.dohop.net/api/graphql'
 
+    # Statuses the gateway answers with when it does not accept a batched search
+    BATCH_REJECTED_STATUSES = [400, 413, 422]
+
     custom_settings = {
         'AUTOTHROTTLE_TARGET_CONCURRENCY': 10,
         'AUTOTHROTTLE_ENABLED': False
@@ -30,129 +127,180 @@ class EasyJetSpider(base_spider.BaseSpider):
 
     def __init__(self, *_args, **kwargs):
         super().__init__(self.name, self.__class__.WINDOW_SIZE, **kwargs)
-        self.stations = self.stations_set()
+        # Drops to 1, one search per request, if the gateway rejects batched searches
+        self.searches_per_request = settings.EASYJET_SEARCHES_PER_REQUEST
 
-    def stations_set(self) -> Set[str]:
-        stations: Set[str] = set()
+    def _search_request(self, route: airline_route.Route, day: datetime.date, priority: int = 0) -> scrapy.Request:
+        return http.JsonRequest(
+            url=self.__class__.API_ENDPOINT,
+            method='POST',
+            callback=self.parse,
+            errback=self.error_callback,
+            priority=priority,
+            meta={'route_window': self.route_window(route, day, day)},
+            body=SEARCH_TEMPLATE.render(origin=route.source, destination=route.destination, day=f"{day}"),
+        )
 
-        for route in self.routes:
-            stations.add(route.source)
-            stations.add(route.destination)
+    def _batched_search_request(self, route: airline_route.Route, days: List[datetime.date]) -> scrapy.Request:
+        dates = {f"d{i}": f"{day}" for i, day in enumerate(days)}
 
-        return stations
+        return http.JsonRequest(
+            url=self.__class__.API_ENDPOINT,
+            method='POST',
+            callback=self.parse,
+            errback=self.batch_error_callback,
+            meta={
+                'route_window': self.route_window(route, days[0], days[-1]),
+                'route': route,
+                'dates': days,
+            },
+            body=batched_search_template(len(days)).render(
+                origin=route.source, destination=route.destination, **dates
+            ),
+        )
 
     def prepare_request(
-            self, 
-            route: airline_route.Route, 
-            left_date: datetime.date, 
+            self,
+            route: airline_route.Route,
+            left_date: datetime.date,
             right_date: datetime.date
         ) -> List[scrapy.Request]:
-        requests: List[scrapy.Request] = []
-        step = datetime.timedelta(days=1)
-
-        while left_date < right_date:
-            requests.append(
-                http.JsonRequest(
-                    url=self.__class__.API_ENDPOINT,
-                    method='POST',
-                    callback=self.parse,
-                    errback=self.error_callback,
-                    data={
-                        "query": "query searchResult($partner: Partner!, $origin: String!, $destination: String!, "
-                                 "$passengerAges: [PositiveInt!]!, $metadata: Metadata!, $departureDateString: "
-                                 "String!, $returnDateString: String, $sort: Sort, $limit: PositiveInt, "
-                                 "$filters: OfferFiltersInput) {  search(    partner: $partner    origin: $origin "
-                                 "   destination: $destination    passengerAges: $passengerAges    metadata: "
-                                 "$metadata    departureDateString: $departureDateString    returnDateString: "
-                                 "$returnDateString    sort: $sort    limit: $limit    filters: $filters  ) {    "
-                                 "numberOfPages    offersFilters {      overnightStay      overnightFlight      "
-                                 "connectionTime {        min        max      }      landing {        outbound {  "
-                                 "        min          max        }        homebound {          min          max  "
-                                 "      }      }      takeoff {        outbound {          min          max       "
-                                 " }        homebound {          min          max        }      }    }    "
-                                 "bestOffers {      RECOMMENDED {        ...Offer      }      QUICKEST {        "
-                                 "...Offer      }      CHEAPEST {        ...Offer      }    }    offers {      "
-                                 "...Offer    }    currency    residency  }}        fragment Offer on Offer {  id "
-                                 " price  pricePerPerson  currency  transferURL  duration  itinerary {    "
-                                 "...Itinerary  }}        fragment Itinerary on Itinerary {  outbound {    "
-                                 "...Route  }  homebound {    ...Route  }}        fragment Route on Route {  id  "
-                                 "origin {    code    name    city    country  }  destination {    code    name   "
-                                 " city    country  }  departure  arrival  duration  operatingCarrier {    name   "
-                                 " code    flightNumber  }  marketingCarrier {    name    code    flightNumber  } "
-                                 " legs {    ...Leg  }}        fragment Leg on Leg {  id  duration  origin {    "
-                                 "code    name    city    country  }  destination {    code    name    city    "
-                                 "country  }  departure  arrival  carrierType  operatingCarrier {    name    code "
-                                 "   flightNumber  }  marketingCarrier {    name    code    flightNumber  }}",
-                        "variables": {
-                            "partner": "easyjet",
-                            "metadata": {
-                                "language": "en",
-                                "currency": "EUR",
-                            },
-                            "origin": route.source,
-                            "destination": route.destination,
-                            "departureDateString": f"{left_date}",
-                            "returnDateString": None,
-                            "passengerAges": [
-                                18
-                            ],
-                            "limit": 1
-                        }
-                    },
-                )
-            )
-
-            left_date += step
-
-        return requests
-
-    # TODO: Look into why other stations are included
+        days = [left_date + datetime.timedelta(days=i) for i in range((right_date - left_date).days + 1)]
+
+        if self.searches_per_request <= 1:
+            return [self._search_request(route, day) for day in days]
+
+        return [
+            self._batched_search_request(route, days[i:i + self.searches_per_request])
+            for i in range(0, len(days), self.searches_per_request)
+        ]
+
+    def _stop_batching(self, reason: str):
+        if self.searches_per_request > 1:
+            self.logger.warning(f'Gateway rejected a batched search ({reason}), falling back to one search per request')
+
+        self.searches_per_request = 1
+
+    def batch_error_callback(self, f: failure.Failure):
+        if f.check(httperror.HttpError) and f.value.response.status in self.__class__.BATCH_REJECTED_STATUSES:
+            # Not a failed window: its days are searched one by one, and they record their own outcome in the ledger
+            self.logger.warning(f'Batched search failed with status {f.value.response.status}, searching its days')
+            self._stop_batching(f'status {f.value.response.status}')
+            route, days = f.request.meta['route'], f.request.meta['dates']
+            yield from (self._search_request(route, day, f.request.priority) for day in days)
+            return
+
+        self.error_callback(f)
+
+    @staticmethod
+    def _is_wanted(raw_offer: dict, window: airline_route.RouteWindow) -> bool:
+        """
+        Only direct flights of the searched route are kept, EasyJet also offers connections and nearby airports
+        """
+        legs = raw_offer['itinerary']['outbound'][0]['legs']
+
+        return len(legs) == 1 \
+            and legs[0]['origin']['code'] == window.source \
+            and legs[0]['destination']['code'] == window.destination
+
+    def _best_offers(self, response: http.TextResponse) -> Iterator[Optional[dict]]:
+        """
+        Decodes only the `bestOffers` of a single search, dropping unwanted offers while decoding. The much larger
+        `offers` list following them in the response is never decoded.
+        """
+        window: airline_route.RouteWindow = response.meta['route_window']
+
+        def drop_unwanted(obj: dict):
+            if 'itinerary' in obj and 'price' in obj:
+                return obj if self._is_wanted(obj, window) else None
+
+            return obj
+
+        try:
+            found = False
+
+            # The single search has a single `bestOffers`, so the rest of the response is not even scanned
+            for best_offers in json_stream.iter_values(
+                    response.body, 'bestOffers', object_hook=drop_unwanted, limit=1
+            ):
+                found = True
+                yield best_offers
+
+            if found:
+                return
+        except (json.JSONDecodeError, KeyError, IndexError, TypeError) as e:
+            self.logger.warning(f'Could not stream bestOffers from {response.url}, decoding all of it: {e!r}')
+
+        # Responses without `bestOffers` are errors, decoding all of them gets their error messages logged
+        yield from self._searches(response, json_stream.loads(response.body))
+
+    def _searches(self, response: http.TextResponse, data: dict) -> Iterator[Optional[dict]]:
+        if data.get('errors'):
+            self.logger.error(f'Search {response.meta["route_window"].key()} returned errors: {data["errors"]}')
+
+        # A single search is under `search`, batched ones under their `d0`, `d1`, ... aliases
+        for search in (data.get('data') or {}).values():
+            yield search['bestOffers'] if search is not None else None
+
     def parse(self, response: http.TextResponse, **kwargs):
-        def parse_offer(raw_offer: dict) -> Optional[Tuple[str, dict]]:
-            outbound = raw_offer['itinerary']['outbound'][0]
-
-            # Filter only direct flights
-            if len(outbound['legs']) > 1:
-                return None
-
-            return outbound['id'], {
-                'flight_date': datetime.datetime.fromisoformat(outbound['legs'][0]['departure'][:-1]).isoformat(),
-                'source': outbound['legs'][0]['origin']['code'],
-                'destination': outbound['legs'][0]['destination']['code'],
-                'price': raw_offer['price'],
-                'currency': raw_offer['currency'],
-                'company': self.__class__.name,
-                'scrape_date': scrape_date
-            }
-
-        data = response.json()
+        window: airline_route.RouteWindow = response.meta['route_window']
         scrape_date = datetime.date.today().isoformat()
         ids = set()
 
-        try:
-            best_offers = data['data']['search']['bestOffers']
+        if 'dates' in response.meta:
+            # Batched searches select only `bestOffers`, so they are small enough to be decoded at once
+            data = json_stream.loads(response.body)
+            yield from self._retry_failed_searches(response, data.get('data') or {}, data.get('errors'))
+            all_best_offers = self._searches(response, data)
+        else:
+            all_best_offers = self._best_offers(response)
 
+        for best_offers in all_best_offers:
             if best_offers is None:
-                return
+                continue
 
             for offer_type in EasyJetSpider.OFFER_TYPES:
                 try:
-                    parsed_offer = parse_offer(best_offers[offer_type])
+                    raw_offer = best_offers.get(offer_type)
+
+                    if raw_offer is None or not self._is_wanted(raw_offer, window):
+                        continue
 
-                    match parsed_offer:
-                        case None:
-                            continue
-                        case offer_id, offer:
-                            if offer_id in ids:
-                                continue
+                    outbound = raw_offer['itinerary']['outbound'][0]
 
-                            if offer['source'] not in self.stations or offer['destination'] not in self.stations:
-                                continue
+                    if outbound['id'] in ids:
+                        continue
 
-                            ids.add(offer_id)
+                    ids.add(outbound['id'])
 
-                            yield offer
+                    yield items.FareRecord(
+                        flight_date=datetime.datetime.fromisoformat(outbound['legs'][0]['departure'][:-1]).isoformat(),
+                        source=outbound['legs'][0]['origin']['code'],
+                        destination=outbound['legs'][0]['destination']['code'],
+                        price=raw_offer['price'],
+                        currency=raw_offer['currency'],
+                        company=self.__class__.name,
+                        scrape_date=scrape_date
+                    )
                 except KeyError as ke:
                     self.logger.error(repr(ke))
-        except KeyError as ke:
-            self.logger.error(repr(ke))
+                except ValueError as ve:
+                    # Offer without a price
+                    self.logger.warning(repr(ve))
+
+    def _retry_failed_searches(self, response: http.TextResponse, searches: dict, errors: Optional[list]):
+        """
+        Searches of a batch that came back empty because of an error are issued again, one per request
+        """
+        days: List[datetime.date] = response.meta['dates']
+        failed = [day for i, day in enumerate(days) if searches.get(f'd{i}') is None]
+
+        if not failed or not errors:
+            return
+
+        self.logger.error(f'{len(failed)} out of {len(days)} batched searches failed: {errors}')
+
+        if len(failed) == len(days):
+            self._stop_batching(f'{errors[0].get("message")}')
+
+        yield from (self._search_request(response.meta['route'], day, response.request.priority) for day in failed)
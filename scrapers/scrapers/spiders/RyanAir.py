@@ -1,7 +1,7 @@
 import scrapy
 import datetime
 from . import base_spider
-from .. import airline_route
+from .. import airline_route, items
 
 from scrapy import http
 from urllib import parse
@@ -14,6 +14,8 @@ class RyanairSpider(base_spider.BaseSpider):
     allowed_domains = ['ryanair.com']
 
     WINDOW_SIZE = datetime.timedelta(days=30)
+    # cheapestPerDay answers larger ranges, up to some limit the window planner learns from the days it returns
+    MAX_WINDOW_SIZE = datetime.timedelta(days=90)
 
     API_ENDPOINT_TEMPLATE = 'https://www.ryanair.com/api/farfnd/3/oneWayFares/{}/{}/cheapestPerDay'
 
@@ -31,6 +33,7 @@ class RyanairSpider(base_spider.BaseSpider):
             method='GET',
             callback=self.parse,
             errback=self.error_callback,
+            meta={'route_window': self.route_window(route, left_date, right_date)},
             formdata={
                 'outboundDateFrom': f'{left_date}',
                 'outboundDateTo': f'{right_date}'
@@ -48,6 +51,12 @@ class RyanairSpider(base_spider.BaseSpider):
         scrape_date = datetime.date.today().isoformat()
 
         try:
+            # Every day answered is listed, with or without fares, so the last one tells whether the window was clipped
+            days = [day_flight['day'] for day_flight in flights['outbound']['fares']]
+
+            if days:
+                response.meta['covered_until'] = datetime.date.fromisoformat(max(days))
+
             # RyanAir gets the whole month and every day might or might not have data
             available_flights = list(
                 filter(lambda day_flight: day_flight['unavailable'] is False, flights['outbound']['fares'])
@@ -55,14 +64,21 @@ class RyanairSpider(base_spider.BaseSpider):
             self.logger.info(f'Received {len(available_flights)} flights from {response.url}')
 
             for available_flight in available_flights:
-                yield {
-                    'flight_date': available_flight['departureDate'],
-                    'source': source,
-                    'destination': destination,
-                    'price': available_flight['price']['value'],
-                    'currency': available_flight['price']['currencyCode'],
-                    'company': self.name,
-                    'scrape_date': scrape_date
-                }
+                try:
+                    fare = items.FareRecord(
+                        flight_date=available_flight['departureDate'],
+                        source=source,
+                        destination=destination,
+                        price=available_flight['price']['value'],
+                        currency=available_flight['price']['currencyCode'],
+                        company=self.name,
+                        scrape_date=scrape_date
+                    )
+                except ValueError as ve:
+                    # Only the fare without a price is skipped, not the rest of the month
+                    self.logger.warning(repr(ve))
+                    continue
+
+                yield fare
         except KeyError as ke:
             self.logger.error(repr(ke))
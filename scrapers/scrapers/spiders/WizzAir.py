@@ -1,67 +1,60 @@
-import json
 
 import scrapy
 import datetime
 
 
-from typing import List, Dict
+from typing import List
 from scrapy import http
-from copy import deepcopy
 from . import base_spider
-from .. import airline_route
+from .. import airline_route, items, request_templates
+
+
+def timetable_template(price_type: dict) -> request_templates.BodyTemplate:
+    return request_templates.BodyTemplate({
+        "flightList": [
+            {
+                "departureStation": request_templates.Field("source"),
+                "arrivalStation": request_templates.Field("destination"),
+                "from": request_templates.Field("left"),
+                "to": request_templates.Field("right")
+            }
+        ],
+        "priceType": "",
+        "adultCount": 1,
+        "childCount": 0,
+        "infantCount": 0,
+        **price_type
+    })
 
 
 class WizzairSpider(base_spider.BaseSpider):
     name = 'WizzAir'
     allowed_domains = ['wizzair.com']
 
-    # Wizz Air - supports 42, but 30 just to be safe
+    # Wizz Air - supports 42, but 30 just to be safe. The timetable only lists the days with flights, so a response
+    # does not tell the last day it covers, and the window planner could not tell clipped responses: no MAX_WINDOW_SIZE
     WINDOW_SIZE = datetime.timedelta(days=30)
 
     PRICE_TYPES = [{'priceType': 'regular'}]
+    # A body per price type, each one searched by its own request
+    TIMETABLE_TEMPLATES = list(map(timetable_template, PRICE_TYPES))
 
     API_ENDPOINT = 'https://be.wizzair.com/19.1.0/Api/search/timetable'
 
-    def __init__(self, *_args, **kwargs):
-        super().__init__(self.name, self.__class__.WINDOW_SIZE, **kwargs)
-        self.cookies = {}
-
-    def _headers(self) -> Dict[str, str]:
-        headers = {
-            # From my experiments, this can also be empty
-            'Referer': 'https://wizzair.com/en-gb/flights/timetable',
-            'Content-Type': 'application/json',
-        }
-
-        if 'RequestVerificationToken' in self.cookies:
-            headers['X-Requestverificationtoken'] = self.cookies['RequestVerificationToken']
-
-        return headers
-
-    def _update_cookies(self, response: http.TextResponse):
-        for header_name, header_value in response.headers.items():
-            # If WizzAir server doesn't want a cookie to be set, then don't set it
-            if header_name.decode('utf-8') != 'Set-Cookie':
-                continue
+    # WizzAir answers too many requests with 400s rather than 429s
+    BACKOFF_STATUSES = base_spider.BaseSpider.BACKOFF_STATUSES + [400]
 
-            for cookie_to_be_set in header_value:
-                cookie_parts = cookie_to_be_set.decode('utf-8').split(';')
+    # Its text holds the url of the current API, see `wizzair_session`
+    BUILD_NUMBER_URL = 'https://wizzair.com/buildnumber'
 
-                for cookie_part in cookie_parts:
-                    # Take only first `=` into account
-                    name_and_value = cookie_part.strip().split('=', 1)
+    HEADERS = {
+        # From my experiments, this can also be empty
+        'Referer': 'https://wizzair.com/en-gb/flights/timetable',
+        'Content-Type': 'application/json',
+    }
 
-                    # Skip everything that does not have the form `key=value`
-                    if len(name_and_value) != 2:
-                        continue
-
-                    name, value = name_and_value
-
-                    # Minimal set of cookies so the thing works
-                    # if name != 'ASP.NET_SessionId' and name != 'RequestVerificationToken':
-                    #     continue
-
-                    self.cookies[name] = value
+    def __init__(self, *_args, **kwargs):
+        super().__init__(self.name, self.__class__.WINDOW_SIZE, **kwargs)
 
     def prepare_request(
             self,
@@ -69,59 +62,45 @@ class WizzairSpider(base_spider.BaseSpider):
             left_date: datetime.date,
             right_date: datetime.date
     ) -> List[scrapy.Request]:
-        def apply_extras(base_template: dict, extras: dict) -> dict:
-            base_template.update(extras)
-            return base_template
-
-        base_request = {
-            "flightList": [
-                {
-                    "departureStation": route.source,
-                    "arrivalStation": route.destination,
-                    "from": left_date.strftime("%Y-%m-%d"),
-                    "to": right_date.strftime("%Y-%m-%d")
-                }
-            ],
-            "priceType": "",
-            "adultCount": 1,
-            "childCount": 0,
-            "infantCount": 0
-        }
-
-        result = []
-
-        for price_type in WizzairSpider.PRICE_TYPES:
-            result.append(
-                scrapy.Request(
-                    url=self.__class__.API_ENDPOINT,
-                    method='POST',
-                    callback=self.parse,
-                    errback=self.error_callback,
-                    headers=self._headers(),
-                    cookies=self.cookies,
-                    body=json.dumps(apply_extras(deepcopy(base_request), price_type))
-                )
+        return [
+            scrapy.Request(
+                url=self.__class__.API_ENDPOINT,
+                method='POST',
+                callback=self.parse,
+                errback=self.error_callback,
+                meta={'route_window': self.route_window(route, left_date, right_date)},
+                # The version and token of the session are applied by `WizzAirSessionMiddleware`
+                headers=self.__class__.HEADERS,
+                body=template.render(
+                    source=route.source, destination=route.destination, left=f'{left_date}', right=f'{right_date}'
+                ),
             )
-
-        return result
+            for template in self.__class__.TIMETABLE_TEMPLATES
+        ]
 
     def parse(self, response: http.TextResponse, **_kwargs):
         flights = response.json()
         scrape_date = datetime.date.today().isoformat()
 
         self.logger.info(f'Received {len(flights)} flights from {response.url}')
-        self._update_cookies(response)
 
         try:
             for flight in flights['outboundFlights']:
-                yield {
-                    'flight_date': flight['departureDates'][0],
-                    'source': flight['departureStation'],
-                    'destination': flight['arrivalStation'],
-                    'price': flight['price']['amount'],
-                    'currency': flight['price']['currencyCode'],
-                    'company': self.name,
-                    'scrape_date': scrape_date
-                }
+                try:
+                    fare = items.FareRecord(
+                        flight_date=flight['departureDates'][0],
+                        source=flight['departureStation'],
+                        destination=flight['arrivalStation'],
+                        price=flight['price']['amount'],
+                        currency=flight['price']['currencyCode'],
+                        company=self.name,
+                        scrape_date=scrape_date
+                    )
+                except ValueError as ve:
+                    # Only the flight without a price is skipped, not the rest of the timetable
+                    self.logger.warning(repr(ve))
+                    continue
+
+                yield fare
         except KeyError as ke:
             self.logger.error(repr(ke))
@@ -1,13 +1,13 @@
 import abc
-import json
+import heapq
 import scrapy
 import datetime
 import logging
 
 from scrapy import http
-from .. import settings, airline_route
+from .. import settings, airline_route, crawl_ledger, route_catalog, route_history, sharding
 
-from typing import List, Optional
+from typing import Iterator, List, Optional, Set, Tuple
 from twisted.python import failure
 from scrapy.spidermiddlewares import httperror
 from twisted.internet import error
@@ -16,57 +16,184 @@ class BaseSpider(scrapy.Spider):
     name: Optional[str] = None
     days_to_scrape: int = 0
     routes: List[airline_route.Route] = []
+    # Routes of the routes file dropped as listed before, in either direction
+    redundant_routes: int = 0
     allowed_domains: List[str] = []
     window_size: int = 1
 
-    def __init__(self, name, window_size, **kwargs):
+    # Statuses meaning the airline wants fewer requests, the rate control backs off on them
+    BACKOFF_STATUSES: List[int] = [429, 500, 502, 503, 504]
+
+    # Largest window the airline may answer in full, `WindowPlannerMiddleware` probes up to it. None keeps `WINDOW_SIZE`
+    MAX_WINDOW_SIZE: Optional[datetime.timedelta] = None
+
+    def __init__(self, name, window_size, routes: Optional[str] = None, resume: Optional[str] = None,
+                 shard: Optional[str] = None, **kwargs):
         super().__init__(name, **kwargs)
         logging.basicConfig(format=settings.LOG_FORMAT, level=settings.LOG_LEVEL)
 
-        self.routes = self.routes_to_scrape()
+        # `-a shard=1/4` crawls only the second quarter of the routes file, as `SHARD_INDEX` and `SHARD_COUNT` do
+        self.shard = sharding.Shard.parse(shard) if shard else sharding.Shard(settings.SHARD_INDEX, settings.SHARD_COUNT)
+        # `-a routes=BSL-AMS,GVA-OTP` crawls only these routes instead of the ones of the routes file, whatever the shard
+        self.routes = route_catalog.RouteCatalog.from_keys(self.name, routes.split(',')).routes(self.name) if routes \
+            else self.routes_to_scrape()
         self.days_to_scrape = settings.DAYS_TO_SCRAPE
+        # `-a resume=true` requests only the windows the crawls of the day did not scrape yet, as `CRAWL_RESUME` does
+        self.resume = resume.lower() in ('1', 'true', 'yes') if resume is not None else None
         self.window_size = window_size
         self.logger.info(f'Spider {self.name} will scrape ahead {self.days_to_scrape} days starting from {datetime.date.today()}.')
         self.logger.info(f'Spider {self.name} will scrape {self.routes}.')
 
+    def request_priority(
+        self,
+        left_date: datetime.date,
+        today: datetime.date,
+        stats: Optional[route_history.RouteStats]
+    ) -> int:
+        """
+        Scrapy priority of a window, higher for windows departing sooner and routes stale or whose prices often change
+        """
+        proximity = 1 - min((left_date - today) / self.days_to_scrape, 1)
+        # Never scraped routes are as stale and as volatile as it gets
+        staleness = min((today - stats.last_scraped) / settings.SCHEDULE_STALE_AFTER, 1) if stats is not None else 1
+        volatility = stats.volatility if stats is not None else 1
+
+        return round(1000 * (
+            settings.SCHEDULE_PROXIMITY_WEIGHT * proximity +
+            settings.SCHEDULE_STALENESS_WEIGHT * staleness +
+            settings.SCHEDULE_VOLATILITY_WEIGHT * volatility
+        ))
+
+    def _route_windows(
+        self,
+        route: airline_route.Route,
+        start: datetime.date,
+        end: datetime.date,
+        today: datetime.date,
+        stats: Optional[route_history.RouteStats]
+    ) -> Iterator[Tuple[int, datetime.date, airline_route.Route, datetime.date]]:
+        """
+        Windows of `route` in date order, which is their priority order: only the proximity part of the priority
+        changes from one window of a route to the next
+        """
+        while start < end:
+            # The last window stops at the end of the days to scrape, whatever the window size
+            period_end = min(start + self.window_size, end) - datetime.timedelta(days=1)
+            yield self.request_priority(start, today, stats), start, route, period_end
+            start = start + self.window_size
+
     def start_requests(self):
+        """
+        Requests of every window of every route, from the highest priority down. The windows of every route are merged
+        lazily, so a single window per route is kept in memory, whatever the number of days to scrape, and requests are
+        built when Scrapy asks for them
+        """
         start = datetime.date.today()
         end = start + self.days_to_scrape
-
-        while start < end:
-            period_start, period_end = start, start + self.window_size - datetime.timedelta(days=1)
-
-            for route in self.routes:
-                yield from (
-                    self.prepare_request(route, period_start, period_end) +
-                    self.prepare_request(route.return_route(), period_start, period_end)
-                )
-
-            start = start + self.WINDOW_SIZE
+        today = start
+
+        history = route_history.RouteHistory(settings.ROUTE_HISTORY_PATH)
+        route_stats = history.routes(self.name)
+        history.close()
+
+        done = self._done_windows(today)
+
+        directed_routes = [directed for route in self.routes for directed in (route, route.return_route())]
+        # Windows of the same priority go in date order, then in the order of the routes
+        windows = heapq.merge(
+            *(
+                self._route_windows(route, start, end, today, route_stats.get((route.source, route.destination)))
+                for route in directed_routes
+            ),
+            key=lambda window: (-window[0], window[1])
+        )
+        window_count = -(-(end - start) // self.window_size) * len(directed_routes) if start < end else 0
+        self._set_stat('scheduling/windows', window_count)
+
+        if self.redundant_routes and window_count:
+            first_end = min(start + self.window_size, end) - datetime.timedelta(days=1)
+            # Every window of a dropped route, in both directions, would have been requested once more
+            redundant = self.redundant_routes * window_count // len(self.routes) * \
+                len(self.prepare_request(directed_routes[0], start, first_end))
+            self._set_stat('route_catalog/redundant_requests', redundant)
+            self.logger.info(f'Saving {redundant} requests of routes listed more than once')
+
+        for priority, period_start, route, period_end in windows:
+            self._inc_stat('scheduling/windows_started')
+
+            for request in self.prepare_request(route, period_start, period_end):
+                if request.meta['route_window'].key() in done:
+                    continue
+
+                request.priority = priority
+                yield request
+
+    def _set_stat(self, key: str, value):
+        # Spiders built without a crawler have no stats
+        if hasattr(self, 'crawler'):
+            self.crawler.stats.set_value(key, value, spider=self)
+
+    def _inc_stat(self, key: str):
+        if hasattr(self, 'crawler'):
+            self.crawler.stats.inc_value(key, spider=self)
+
+    def _done_windows(self, today: datetime.date) -> Set[str]:
+        """
+        Keys of the windows to skip, the ones the crawls of the day already scraped when resuming
+        """
+        resume = self.resume
+
+        if resume is None:
+            # Spiders built without a crawler have no settings
+            resume = hasattr(self, 'settings') and self.settings.getbool('CRAWL_RESUME')
+
+        if not resume:
+            return set()
+
+        ledger = crawl_ledger.CrawlLedger(settings.CRAWL_LEDGER_PATH)
+        done = ledger.done_windows(self.name, today)
+        ledger.close()
+
+        self.logger.info(f'Resuming the crawl of {today}, skipping the {len(done)} windows already done')
+        return done
 
     def routes_to_scrape(self) -> List[airline_route.Route]:
-        routes: List[airline_route.Route] = []
-
         try:
-            with open(settings.ROUTES_FILE, 'r') as f:
-                json_routes = json.load(f).get(self.name, [])
-
-                for json_route in json_routes:
-                    try:
-                        route: airline_route.Route = airline_route.Route.from_dict(json_route)
+            catalog = route_catalog.load(settings.ROUTES_FILE)
+        except FileNotFoundError as e:
+            self.logger.error(f'File {e.filename} was not found')
+            return []
+
+        routes = catalog.routes(self.name)
+        stats = catalog.stats(self.name)
+        self.redundant_routes = stats.redundant
+
+        if stats.redundant:
+            self.logger.info(f'Dropped {stats.mirrored} mirrored and {stats.duplicated} duplicated routes out of '
+                             f'{stats.listed} listed, every route is scraped in both directions')
+
+        if self.shard.count > 1:
+            sharded = sharding.routes_of(self.shard, self.name, routes)
+            self.logger.info(f'Shard {self.shard} scrapes {len(sharded)} out of {len(routes)} routes')
+            # About its share of them
+            self.redundant_routes = stats.redundant * len(sharded) // len(routes)
+            return sharded
 
-                        if route.source == route.destination:
-                            self.logger.warning(f'Identical pair in {route} found.')
-                            continue
+        return routes
 
-                        routes.append(route)
-                    except KeyError as ke:
-                        self.logger.error(f'{json_route} is not a valid {type(airline_route.Route)} object')
-                        self.logger.error(ke)
-        except FileNotFoundError:
-            self.logger.error(f'File {settings.ROUTES_FILE} was not found')
+    def route_window(
+        self,
+        route: airline_route.Route,
+        left_date: datetime.date,
+        right_date: datetime.date
+    ) -> airline_route.RouteWindow:
+        return airline_route.RouteWindow(self.name, route.source, route.destination, left_date, right_date)
 
-        return routes
+    def normalized_body(self, response: http.TextResponse) -> bytes:
+        """
+        Response body stripped of what changes between identical searches, used to tell if fares changed
+        """
+        return response.body
 
     @abc.abstractmethod
     def prepare_request(
@@ -98,4 +225,10 @@ class BaseSpider(scrapy.Spider):
             self.logger.error('DNSLookupError on %s', request.url)
         elif failure.check(error.TimeoutError, error.TCPTimedOutError):
             request = failure.request
-            self.logger.error('TimeoutError on %s %s', request.url)
+            self.logger.error('TimeoutError on %s', request.url)
+
+        # Retried later or recorded as failed, so a resumed crawl requests it again
+        if hasattr(self, 'crawler'):
+            self.crawler.signals.send_catch_log(
+                signal=crawl_ledger.window_failed, request=failure.request, failure=failure, spider=self
+            )
@@ -0,0 +1,398 @@
+"""
+Append-only on-disk outbox for the records sent to Kafka.
+
+Records are appended to fixed size, memory-mapped segment files. Every record is framed with its length and a CRC32
+checksum, so a record torn by a crash is detected and dropped when the spool is reopened. A `SpoolDrainer` thread
+replays the records to Kafka and commits how far it got in the `cursor` file, so undelivered records survive restarts
+and are delivered by the next crawl. A spool is only opened by one process at a time, it holds an exclusive lock on
+its directory until it is closed.
+"""
+import fcntl
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+SEGMENT_MAGIC = b'CFWMSPL1'
+SEGMENT_SUFFIX = '.seg'
+CURSOR_FILE = 'cursor'
+LOCK_FILE = 'lock'
+
+# Record length, CRC32 of key length, key and value, key length
+_FRAME_HEADER = struct.Struct('<IIH')
+_CURSOR = struct.Struct('<QQI')
+
+
+class SpoolPosition(NamedTuple):
+    segment: int
+    offset: int
+
+
+class SpoolRecord(NamedTuple):
+    key: Optional[bytes]
+    value: bytes
+    # Position right after the record, commit it once the record is delivered
+    next_position: SpoolPosition
+
+
+class Segment:
+    __slots__ = ('id', 'path', 'size', 'file', 'map', 'write_offset')
+
+    def __init__(self, directory: str, segment_id: int, size: int):
+        self.id = segment_id
+        self.path = os.path.join(directory, f'{segment_id:016d}{SEGMENT_SUFFIX}')
+        exists = os.path.exists(self.path)
+
+        self.file = open(self.path, 'r+b' if exists else 'w+b')
+
+        if not exists:
+            self.file.truncate(size)
+
+        self.size = os.fstat(self.file.fileno()).st_size
+        self.map = mmap.mmap(self.file.fileno(), self.size)
+
+        if not exists:
+            self.map[:len(SEGMENT_MAGIC)] = SEGMENT_MAGIC
+
+        if self.map[:len(SEGMENT_MAGIC)] != SEGMENT_MAGIC:
+            raise ValueError(f'{self.path} is not a spool segment')
+
+        self.write_offset = self._recover()
+
+    def _recover(self) -> int:
+        """
+        Finds where the last complete record ends, everything after it was never written or was torn by a crash
+        """
+        offset = len(SEGMENT_MAGIC)
+        record = self.read(offset)
+
+        while record is not None:
+            offset = record[2]
+            record = self.read(offset)
+
+        return offset
+
+    def append(self, key: Optional[bytes], value: bytes) -> bool:
+        key = key or b''
+        length = _FRAME_HEADER.size + len(key) + len(value)
+
+        if self.write_offset + length > self.size:
+            return False
+
+        start, body = self.write_offset, self.write_offset + _FRAME_HEADER.size
+        self.map[body:body + len(key)] = key
+        self.map[body + len(key):start + length] = value
+        checksum = zlib.crc32(value, zlib.crc32(key, zlib.crc32(struct.pack('<H', len(key)))))
+        self.map[start:body] = _FRAME_HEADER.pack(length, checksum, len(key))
+        self.write_offset += length
+
+        return True
+
+    def read(self, offset: int) -> Optional[Tuple[Optional[bytes], bytes, int]]:
+        if offset + _FRAME_HEADER.size > self.size:
+            return None
+
+        length, checksum, key_length = _FRAME_HEADER.unpack_from(self.map, offset)
+
+        if length < _FRAME_HEADER.size + key_length or offset + length > self.size:
+            return None
+
+        body = offset + _FRAME_HEADER.size
+        key = self.map[body:body + key_length]
+        value = self.map[body + key_length:offset + length]
+
+        if zlib.crc32(value, zlib.crc32(key, zlib.crc32(struct.pack('<H', key_length)))) != checksum:
+            return None
+
+        return key or None, value, offset + length
+
+    def flush(self):
+        self.map.flush()
+
+    def close(self):
+        self.map.flush()
+        self.map.close()
+        self.file.close()
+
+    def delete(self):
+        self.map.close()
+        self.file.close()
+        os.remove(self.path)
+
+
+class SpoolLocked(RuntimeError):
+    """
+    The spool's directory is used by another spool, which would overwrite its segments
+    """
+
+
+class Spool:
+    """
+    Thread safe: records are appended by the crawl and read and committed by the drainer
+    """
+
+    def __init__(self, directory: str, segment_size: int = 64 * 1024 * 1024, sync_every: int = 1024):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.sync_every = sync_every
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.condition = threading.Condition()
+        self.unsynced = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self.lock = open(os.path.join(directory, LOCK_FILE), 'a')
+
+        try:
+            fcntl.flock(self.lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self.lock.close()
+            raise SpoolLocked(f'Spool {directory} is already open')
+
+        segment_ids = sorted(
+            int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(directory) if name.endswith(SEGMENT_SUFFIX)
+        )
+        self.segments: Dict[int, Segment] = {
+            segment_id: Segment(directory, segment_id, segment_size) for segment_id in segment_ids
+        }
+
+        if not self.segments:
+            self.segments[0] = Segment(directory, 0, segment_size)
+
+        self.active = self.segments[max(self.segments)]
+        self.cursor = self._load_cursor()
+
+        if self.pending_bytes():
+            self.logger.info(f'Spool {directory} recovered {self.pending_bytes()} undelivered bytes')
+
+    def _load_cursor(self) -> SpoolPosition:
+        first = SpoolPosition(min(self.segments), len(SEGMENT_MAGIC))
+
+        try:
+            with open(os.path.join(self.directory, CURSOR_FILE), 'rb') as f:
+                segment, offset, checksum = _CURSOR.unpack(f.read(_CURSOR.size))
+        except (FileNotFoundError, struct.error):
+            return first
+
+        if zlib.crc32(struct.pack('<QQ', segment, offset)) != checksum or segment not in self.segments:
+            return first
+
+        return SpoolPosition(segment, offset)
+
+    def _store_cursor(self):
+        path = os.path.join(self.directory, CURSOR_FILE)
+        segment, offset = self.cursor
+
+        with open(f'{path}.tmp', 'wb') as f:
+            f.write(_CURSOR.pack(segment, offset, zlib.crc32(struct.pack('<QQ', segment, offset))))
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(f'{path}.tmp', path)
+
+    def append(self, value: bytes, key: Optional[bytes] = None):
+        with self.condition:
+            if not self.active.append(key, value):
+                self.active.flush()
+                # Not a chained assignment, which would assign `active` before the key is computed from it
+                segment = Segment(self.directory, self.active.id + 1, self.segment_size)
+                self.segments[segment.id] = self.active = segment
+
+                if not self.active.append(key, value):
+                    raise ValueError(f'Record of {len(value)} bytes does not fit a {self.segment_size} bytes segment')
+
+            self.unsynced += 1
+
+            if self.unsynced >= self.sync_every:
+                self.active.flush()
+                self.unsynced = 0
+
+            self.condition.notify_all()
+
+    def read(self, max_records: int, timeout: Optional[float] = None) -> List[SpoolRecord]:
+        """
+        Returns up to `max_records` records following the cursor, waiting up to `timeout` seconds for one to arrive
+        """
+        with self.condition:
+            if timeout and not self.pending_bytes():
+                self.condition.wait(timeout)
+
+            records: List[SpoolRecord] = []
+            segment_id, offset = self.cursor
+
+            while len(records) < max_records and segment_id in self.segments:
+                segment = self.segments[segment_id]
+                record = segment.read(offset) if offset < segment.write_offset else None
+
+                if record is None:
+                    if segment is self.active:
+                        break
+
+                    segment_id, offset = segment_id + 1, len(SEGMENT_MAGIC)
+                    continue
+
+                key, value, offset = record
+                records.append(SpoolRecord(key, value, SpoolPosition(segment_id, offset)))
+
+            return records
+
+    def commit(self, position: SpoolPosition):
+        """
+        Marks every record before `position` as delivered, segments left behind are deleted
+        """
+        with self.condition:
+            self.cursor = position
+
+            for segment_id in sorted(self.segments):
+                if segment_id >= position.segment:
+                    break
+
+                self.segments.pop(segment_id).delete()
+
+            self._store_cursor()
+            self.condition.notify_all()
+
+    def pending_bytes(self) -> int:
+        with self.condition:
+            segment, offset = self.cursor
+            pending = 0
+
+            for segment_id, candidate in self.segments.items():
+                if segment_id == segment:
+                    pending += candidate.write_offset - offset
+                elif segment_id > segment:
+                    pending += candidate.write_offset - len(SEGMENT_MAGIC)
+
+            return pending
+
+    def wait_drained(self, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+
+        with self.condition:
+            while self.pending_bytes():
+                remaining = deadline - time.monotonic()
+
+                if remaining <= 0:
+                    return False
+
+                self.condition.wait(remaining)
+
+            return True
+
+    def close(self):
+        with self.condition:
+            for segment in self.segments.values():
+                segment.close()
+
+            self.segments.clear()
+            # Releases the lock
+            self.lock.close()
+
+
+class SpoolDrainer(threading.Thread):
+    """
+    Replays the spool to Kafka in batches of `batch_records`. A batch is committed only once the broker acknowledged
+    all of its records, a failed batch is retried with an exponential backoff, so delivery is at least once.
+    """
+
+    def __init__(
+            self,
+            spool: Spool,
+            topic: str,
+            producer_factory: Callable[[], Any],
+            on_delivery: Optional[Callable[[Any], None]] = None,
+            on_error: Optional[Callable[[Exception], None]] = None,
+            batch_records: int = 10000,
+            min_backoff: float = 1,
+            max_backoff: float = 60
+    ):
+        super().__init__(name=f'{self.__class__.__name__}-{topic}', daemon=True)
+        self.spool = spool
+        self.topic = topic
+        self.producer_factory = producer_factory
+        self.on_delivery = on_delivery
+        self.on_error = on_error
+        self.batch_records = batch_records
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.backoff = min_backoff
+        self.producer = None
+        self.stopping = threading.Event()
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def run(self):
+        while not self.stopping.is_set():
+            if self.producer is None and not self._connect():
+                continue
+
+            records = self.spool.read(self.batch_records, timeout=0.5)
+
+            if not records:
+                continue
+
+            if self._deliver(records):
+                self.spool.commit(records[-1].next_position)
+                self.backoff = self.min_backoff
+            else:
+                self._wait_backoff()
+
+        if self.producer is not None:
+            self.producer.close()
+
+    def _connect(self) -> bool:
+        try:
+            self.producer = self.producer_factory()
+            self.backoff = self.min_backoff
+            return True
+        except Exception as e:
+            self.logger.warning(f'Could not create Kafka producer for {self.topic}, retrying in {self.backoff}s: {e!r}')
+            self._wait_backoff()
+            return False
+
+    def _deliver(self, records: List[SpoolRecord]) -> bool:
+        futures = []
+
+        try:
+            for record in records:
+                record_future = self.producer.send(self.topic, value=record.value, key=record.key)
+
+                if self.on_delivery is not None:
+                    record_future.add_callback(self.on_delivery)
+
+                if self.on_error is not None:
+                    record_future.add_errback(self.on_error)
+
+                futures.append(record_future)
+
+            # Blocks until the whole batch is acknowledged, which is the backpressure towards the spool
+            self.producer.flush()
+        except Exception as e:
+            # `send` raises instead of failing the future when the broker's metadata is not available in time
+            self.logger.warning(f'Could not send spooled records to {self.topic}, retrying in {self.backoff}s: {e!r}')
+            return False
+
+        failed = sum(1 for record_future in futures if not record_future.succeeded())
+
+        if failed:
+            self.logger.warning(f'{failed} out of {len(records)} spooled records were not delivered to {self.topic}')
+
+        return failed == 0
+
+    def _wait_backoff(self):
+        self.stopping.wait(self.backoff)
+        self.backoff = min(self.backoff * 2, self.max_backoff)
+
+    def stop(self, drain_timeout: float) -> bool:
+        """
+        Waits up to `drain_timeout` seconds for the spool to be delivered, then stops the thread.
+        Returns whether everything was delivered.
+        """
+        drained = self.spool.wait_drained(drain_timeout)
+        self.stopping.set()
+        self.join()
+
+        return drained
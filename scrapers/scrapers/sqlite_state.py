@@ -0,0 +1,48 @@
+"""
+Connections to the SQLite files spiders keep their state in, shared by all the stores of a process.
+
+Crawls running in the same process, see `scrapers.runner`, open stores on the same files. SQLite lets a single
+connection write at a time and stores commit in batches, so stores with connections of their own would fail each
+other's writes with `database is locked`. Stores of the same file share a connection instead, which is safe as they are
+all used from the reactor thread, and the last one to be closed closes it.
+"""
+import os
+import sqlite3
+
+from typing import Dict, Tuple
+
+# Connection and number of open stores using it, by absolute path
+_connections: Dict[str, Tuple[sqlite3.Connection, int]] = {}
+
+
+def connect(path: str) -> sqlite3.Connection:
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    key = os.path.abspath(path)
+    connection, users = _connections.get(key, (None, 0))
+
+    if connection is None:
+        connection = sqlite3.connect(path)
+
+    _connections[key] = (connection, users + 1)
+
+    return connection
+
+
+def release(connection: sqlite3.Connection):
+    """
+    Closes the connection once no store uses it anymore, committing what the stores left uncommitted
+    """
+    for key, (shared, users) in _connections.items():
+        if shared is not connection:
+            continue
+
+        if users > 1:
+            _connections[key] = (shared, users - 1)
+            return
+
+        del _connections[key]
+        break
+
+    connection.commit()
+    connection.close()
@@ -0,0 +1,128 @@
+"""
+Size of the windows of departure dates every airline is searched by, learnt from its responses.
+
+The larger the windows, the fewer requests a crawl sends, but airline APIs answer only up to some number of days and
+drop the rest. Spiders whose responses tell the last day they cover report it, a response stopping before the end of
+its window is clipped: its missing days are requested right away, and the next crawls plan windows no larger than what
+clipped responses covered. Without clipped responses, every crawl probes halfway between the largest window answered
+in full and the spider's `MAX_WINDOW_SIZE`.
+
+The size is planned once a day, the crawls resumed the same day search the same windows as the crawl they resume.
+"""
+import datetime
+import json
+import os
+
+from typing import Dict, NamedTuple, Optional
+
+
+class WindowLimit(NamedTuple):
+    # Largest window, in days, the airline answered in full or the most days a clipped response covered
+    accepted: int
+    # Smallest window, in days, the airline clipped
+    clipped: Optional[int]
+    # Window size planned for the crawls of `planned_on`
+    size: int
+    planned_on: datetime.date
+
+
+class WindowStore:
+    """
+    The window limit of every airline, in a JSON file shared by all spiders
+    """
+    __slots__ = ['path']
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+
+    def _load(self) -> Dict[str, dict]:
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def get(self, airline: str) -> Optional[WindowLimit]:
+        stored = self._load().get(airline)
+
+        if stored is None:
+            return None
+
+        return WindowLimit(
+            stored['accepted'], stored['clipped'], stored['size'], datetime.date.fromisoformat(stored['planned_on'])
+        )
+
+    def put(self, airline: str, limit: WindowLimit):
+        # Read again right before writing, other airlines may be crawled at the same time
+        limits = self._load()
+        limits[airline] = {**limit._asdict(), 'planned_on': limit.planned_on.isoformat()}
+
+        tmp_path = f'{self.path}.tmp'
+
+        with open(tmp_path, 'w') as f:
+            json.dump(limits, f, indent=2, sort_keys=True)
+
+        os.replace(tmp_path, self.path)
+
+
+def planned_size(accepted: int, clipped: Optional[int], ceiling: int) -> int:
+    upper = ceiling if clipped is None else max(1, min(ceiling, clipped - 1))
+
+    if accepted >= upper:
+        return upper
+
+    # Halfway to the largest size not known to be clipped
+    return (accepted + upper + 1) // 2
+
+
+class WindowPlanner:
+    """
+    Plans the window size of a single airline and collects what its responses tell about it
+    """
+    __slots__ = ['limit', 'default', 'ceiling', 'full', 'clipped', 'clipped_coverage']
+
+    def __init__(self, limit: Optional[WindowLimit], default: int, ceiling: int):
+        self.limit = limit
+        self.default = default
+        self.ceiling = ceiling
+        # Largest window answered in full by this crawl
+        self.full = 0
+        # Smallest window clipped by this crawl, and the most days a clipped response covered
+        self.clipped: Optional[int] = None
+        self.clipped_coverage = 0
+
+    def size(self, today: datetime.date) -> int:
+        if self.limit is None:
+            return planned_size(self.default, None, self.ceiling)
+
+        if self.limit.planned_on == today:
+            return self.limit.size
+
+        return planned_size(self.limit.accepted, self.limit.clipped, self.ceiling)
+
+    def on_full(self, days: int):
+        self.full = max(self.full, days)
+
+    def on_clipped(self, days: int, covered_days: int):
+        self.clipped = days if self.clipped is None else min(self.clipped, days)
+        self.clipped_coverage = max(self.clipped_coverage, covered_days)
+
+    def learnt(self, today: datetime.date) -> WindowLimit:
+        """
+        Limit of the airline including this crawl's responses, with the size of the next crawls of `today`
+        """
+        accepted = self.limit.accepted if self.limit is not None else self.default
+        clipped = self.limit.clipped if self.limit is not None else None
+        size = self.size(today)
+
+        if self.clipped is not None:
+            # An API answering a fixed number of days covers exactly that many days in every clipped response
+            accepted = max(self.full, self.clipped_coverage)
+            clipped = min(self.clipped, self.clipped_coverage + 1)
+        elif self.full:
+            accepted = max(accepted, self.full)
+            # The airline now answers in full windows it used to clip
+            clipped = clipped if clipped is None or self.full < clipped else None
+
+        return WindowLimit(accepted, clipped, size, today)
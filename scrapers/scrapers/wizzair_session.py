@@ -0,0 +1,228 @@
+"""
+Session of a WizzAir crawl: the version of the API the requests are sent to and the token they must carry.
+
+WizzAir serves its API under a version, `https://be.wizzair.com/19.1.0/Api/...`, that changes every few weeks, after
+which the old version answers 404s. The current version is read from the build number page of the website and stored
+between crawls, so it is only looked up again once it is old or the API answers 404s. WizzAir also answers 400s to
+requests not sending back, as a header, the `RequestVerificationToken` cookie it sets. The token of the latest response
+is applied to every request as it is sent.
+
+Until the session is ready requests wait: the version is looked up if needed, then the first request of the crawl is
+sent alone and the others once it brought back a token.
+"""
+import datetime
+import json
+import logging
+import os
+import re
+
+from typing import Callable, List, NamedTuple, Optional, Tuple, Union
+
+import scrapy
+
+from scrapy import http
+from twisted.internet import defer
+
+TOKEN_COOKIE = b'RequestVerificationToken='
+TOKEN_HEADER = 'X-Requestverificationtoken'
+
+# Version in the API urls
+URL_VERSION = re.compile(r'/(\d+(?:\.\d+)+)/Api/')
+# Url of the API in the build number page, `SSR 20230712.1 https://be.wizzair.com/19.1.0`
+BUILD_NUMBER_VERSION = re.compile(rb'be\.wizzair\.com/(\d+(?:\.\d+)+)')
+
+# Requests of the session itself, not held nor rewritten
+BYPASS_META_KEY = 'wizzair_session_bypass'
+WARM_UP_META_KEY = 'wizzair_session_warm_up'
+# Requests sent again after a 404, under the version looked up again
+RETRIED_META_KEY = 'wizzair_session_retried'
+
+NEW = 'new'
+DISCOVERING = 'discovering'
+WARMING_UP = 'warming_up'
+READY = 'ready'
+
+Download = Callable[[scrapy.Request], defer.Deferred]
+# What a downloader middleware's `process_request` returns
+Prepared = Union[None, scrapy.Request, defer.Deferred]
+
+
+class StoredVersion(NamedTuple):
+    version: str
+    discovered_on: datetime.date
+
+
+class VersionStore:
+    """
+    The last version of the API found, in a JSON file
+    """
+    __slots__ = ['path']
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+
+    def get(self) -> Optional[StoredVersion]:
+        try:
+            with open(self.path, 'r') as f:
+                stored = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+        return StoredVersion(stored['version'], datetime.date.fromisoformat(stored['discovered_on']))
+
+    def put(self, version: str, today: datetime.date):
+        tmp_path = f'{self.path}.tmp'
+
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': version, 'discovered_on': today.isoformat()}, f, indent=2, sort_keys=True)
+
+        os.replace(tmp_path, self.path)
+
+
+def url_version(url: str) -> Optional[str]:
+    match = URL_VERSION.search(url)
+
+    return match.group(1) if match is not None else None
+
+
+class WizzAirSession:
+    def __init__(self, store: VersionStore, build_number_url: str, default_version: str,
+                 max_age: datetime.timedelta, today: Optional[datetime.date] = None):
+        self.store = store
+        self.build_number_url = build_number_url
+        self.max_age = max_age
+        self.logger = logging.getLogger(__name__)
+
+        today = today or datetime.date.today()
+        stored = store.get()
+
+        self.version = stored.version if stored is not None else default_version
+        # Looked up again when older than `max_age`, or when the API answers 404s
+        self.discovered = stored is not None and today - stored.discovered_on < max_age
+        self.token: Optional[str] = None
+        self.state = NEW
+        # Whether the request warming the session up is being sent
+        self.warming_up = False
+        self.waiting: List[Tuple[defer.Deferred, scrapy.Request]] = []
+
+    def _apply(self, request: scrapy.Request) -> Optional[scrapy.Request]:
+        """
+        Sets the token of `request`, or returns it under the current version to be scheduled again
+        """
+        version = url_version(request.url)
+
+        if version is not None and version != self.version:
+            return request.replace(url=request.url.replace(f'/{version}/Api/', f'/{self.version}/Api/', 1))
+
+        if self.token is not None:
+            request.headers[TOKEN_HEADER] = self.token
+
+        return None
+
+    def prepare(self, request: scrapy.Request, download: Download) -> Prepared:
+        """
+        To be returned by `process_request`, `download` sends the requests of the session itself
+        """
+        if request.meta.get(BYPASS_META_KEY):
+            return None
+
+        if self.state == READY:
+            return self._apply(request)
+
+        d = defer.Deferred()
+        self.waiting.append((d, request))
+
+        if self.state == NEW:
+            self._discover(download)
+        elif self.state == WARMING_UP and not self.warming_up:
+            self._warm_up()
+
+        return d
+
+    def _discover(self, download: Download):
+        self.state = DISCOVERING
+
+        if self.discovered:
+            self._warm_up()
+            return
+
+        request = scrapy.Request(self.build_number_url, meta={BYPASS_META_KEY: True}, dont_filter=True)
+        d = download(request)
+        d.addCallbacks(self._on_build_number, self._on_build_number_error)
+        d.addBoth(lambda _: self._warm_up())
+
+    def _on_build_number(self, response: http.Response):
+        match = BUILD_NUMBER_VERSION.search(response.body)
+
+        if response.status != 200 or match is None:
+            self.logger.warning(f'No API version in {response.url} ({response.status}), using {self.version}')
+            return
+
+        version = match.group(1).decode('ascii')
+
+        if version != self.version:
+            self.logger.info(f'WizzAir API moved from {self.version} to {version}')
+
+        self.version = version
+        self.discovered = True
+        self.store.put(version, datetime.date.today())
+
+    def _on_build_number_error(self, failure):
+        self.logger.warning(f'Could not look up the API version, using {self.version}: {failure.value!r}')
+
+    def _warm_up(self):
+        """
+        Lets the first waiting request under the current version go, the others wait for its response
+        """
+        self.state = WARMING_UP
+
+        while self.waiting and not self.warming_up:
+            d, request = self.waiting.pop(0)
+            rescheduled = self._apply(request)
+
+            if rescheduled is None:
+                request.meta[WARM_UP_META_KEY] = True
+                self.warming_up = True
+
+            d.callback(rescheduled)
+
+    def _ready(self):
+        self.state = READY
+        self.warming_up = False
+        waiting, self.waiting = self.waiting, []
+
+        for d, request in waiting:
+            d.callback(self._apply(request))
+
+    def on_response(self, request: scrapy.Request, response: http.Response) -> Union[http.Response, scrapy.Request]:
+        """
+        To be returned by `process_response`
+        """
+        if request.meta.get(BYPASS_META_KEY):
+            return response
+
+        for cookie in response.headers.getlist('Set-Cookie'):
+            if cookie.startswith(TOKEN_COOKIE):
+                self.token = cookie[len(TOKEN_COOKIE):].split(b';', 1)[0].decode('latin-1')
+
+        if request.meta.get(WARM_UP_META_KEY) and self.warming_up:
+            self._ready()
+
+        # The version is gone, looked up once again for all the requests
+        if response.status == 404 and not request.meta.get(RETRIED_META_KEY):
+            if self.state == READY and url_version(request.url) == self.version:
+                self.logger.info(f'WizzAir API {self.version} answered 404, looking its version up again')
+                self.state = NEW
+                self.discovered = False
+
+            return request.replace(dont_filter=True, meta={**request.meta, RETRIED_META_KEY: True})
+
+        return response
+
+    def on_failure(self, request: scrapy.Request):
+        """
+        To be called by `process_exception`, a failed warm up does not hold the other requests
+        """
+        if request.meta.get(WARM_UP_META_KEY) and self.warming_up:
+            self._ready()
@@ -1,33 +1,140 @@
+import concurrent.futures
+import contextlib
+import multiprocessing
+
+from typing import List, Optional
+
 import fastapi
 import uvicorn
 import pydantic
 from starlette import status
 
-from fastapi import responses, encoders
+from fastapi import responses
+from scrapy import spiderloader
+from scrapy.utils import project
+
+from scrapers import airline_route, crawl_jobs, pipelines
+
+settings = project.get_project_settings()
+spider_names = spiderloader.SpiderLoader.from_settings(settings).list()
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app: fastapi.FastAPI):
+    # Crawling processes are spawned, forking the server's event loop and threads is asking for trouble
+    context = multiprocessing.get_context('spawn')
+    manager = context.Manager()
+    jobs = crawl_jobs.JobQueue(
+        concurrent.futures.ProcessPoolExecutor(
+            max_workers=settings.getint('CRAWL_API_WORKERS'),
+            mp_context=context,
+            # A fresh process for every crawl, the reactor of a finished one cannot be restarted (Python 3.11+)
+            max_tasks_per_child=1,
+        ),
+        manager.Queue(),
+    )
+    jobs.start()
+    app.state.jobs = jobs
+
+    yield
+
+    jobs.stop()
+    manager.shutdown()
+
 
 app = fastapi.FastAPI(
     title='API server for spiders',
-    description='Server that allows basic operations with the spiders'
+    description='Server that allows basic operations with the spiders',
+    lifespan=lifespan,
 )
 
+
+class CrawlRequest(pydantic.BaseModel):
+    # `SRC-DST` pairs, all the routes of the spider's routes file when missing
+    routes: Optional[List[str]] = None
+    # Where the fares go, `kafka` or a bulk sink of `scrapers.sinks`, the `SINK` of the settings when missing
+    sink: Optional[str] = None
+
+
+def job_queue(request: fastapi.Request) -> crawl_jobs.JobQueue:
+    return request.app.state.jobs
+
+
+def known_spider(spider_name: str) -> str:
+    if spider_name not in spider_names:
+        raise fastapi.HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f'Unknown spider {spider_name}')
+
+    return spider_name
+
+
 @app.get("/api/v1/health-check")
 async def health_check():
     return responses.JSONResponse(content=None, status_code=200)
 
+
 @app.get("/api/v1/spiders")
-async def health_check():
-    return {"message": "Hello World"}
+async def list_spiders():
+    return {"spiders": spider_names}
+
 
 @app.get("/api/v1/spiders/{spider_name}")
-async def health_check():
-    return {"message": "Hello World"}
+async def spider_jobs(
+        spider_name: str = fastapi.Depends(known_spider),
+        jobs: crawl_jobs.JobQueue = fastapi.Depends(job_queue)
+):
+    return {"spider": spider_name, "jobs": [job.to_dict() for job in jobs.list(spider_name)]}
+
+
+@app.post("/api/v1/spiders/{spider_name}", status_code=status.HTTP_202_ACCEPTED)
+async def start_crawl(
+        crawl: CrawlRequest,
+        response: fastapi.Response,
+        spider_name: str = fastapi.Depends(known_spider),
+        jobs: crawl_jobs.JobQueue = fastapi.Depends(job_queue)
+):
+    try:
+        routes = [airline_route.Route.from_key(key) for key in crawl.routes] if crawl.routes is not None else None
+    except ValueError:
+        raise fastapi.HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail='Routes must be `SRC-DST` pairs'
+        )
+
+    if crawl.sink is not None and crawl.sink not in pipelines.SINKS:
+        raise fastapi.HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f'Sink must be one of {pipelines.SINKS}'
+        )
+
+    job, duplicates = jobs.submit(spider_name, routes, crawl.sink)
+
+    if job is None:
+        # Everything asked for is already queued
+        response.status_code = status.HTTP_200_OK
+
+    return {
+        "job": job.to_dict() if job is not None else None,
+        "queued_duplicates": [duplicate.to_dict() for duplicate in duplicates],
+    }
+
+
+@app.get("/metrics", response_class=responses.PlainTextResponse)
+async def crawl_metrics(jobs: crawl_jobs.JobQueue = fastapi.Depends(job_queue)):
+    # Version of the text format of Prometheus
+    return responses.PlainTextResponse(jobs.metrics.render(), media_type='text/plain; version=0.0.4')
+
+
+@app.get("/api/v1/jobs/{job_id}")
+async def job_status(job_id: str, jobs: crawl_jobs.JobQueue = fastapi.Depends(job_queue)):
+    job = jobs.get(job_id)
+
+    if job is None:
+        raise fastapi.HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f'Unknown job {job_id}')
+
+    return job.to_dict()
 
-@app.post("/api/v1/spiders/{spider_name}")
-async def health_check():
-    return {"message": "Hello World"}
 
 def main():
     uvicorn.run(app, host='0.0.0.0', port=8080)
 
+
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,33 @@
+import os
+
+os.environ.setdefault('KAFKA_TOPIC', 'flights')
+os.environ.setdefault('KAFKA_BOOTSTRAP_BROKERS', 'stand-in:9092')
+
+from benchmarks import suite  # noqa: E402
+from scrapers.spiders import EasyJet, RyanAir, WizzAir  # noqa: E402
+
+
+def test_every_case_runs_on_its_fixtures():
+    items = {name: case().setup()() for name, case in suite.cases().items()}
+
+    for spider in [EasyJet.EasyJetSpider, RyanAir.RyanairSpider, WizzAir.WizzairSpider]:
+        assert f'parse/{spider.name}/x1' in items
+        assert f'prepare_request/{spider.name}' in items
+
+    # 9 of the 31 days of the month have no flight
+    assert items['parse/RyanAir/x1'] == 22
+    assert items['parse/RyanAir/x10'] == 220
+    assert items['parse/WizzAir/x1'] == 18
+    # Only the direct BSL-AMS offer is kept
+    assert items['parse/EasyJet/x1'] == 1
+    assert items['serialize/FareRecord'] == 18000
+
+
+def test_ingest_benchmark_consumes_its_own_topic_with_the_deployed_queue():
+    from benchmarks import kafka_ingest
+
+    sql = kafka_ingest.flights_sql('kafka_consumer', 'ingest_benchmark_1_4', 4)
+
+    assert 'flight_data.' not in sql and '{{' not in sql
+    assert "kafka_topic_list = 'ingest_benchmark_1_4'" in sql
+    assert 'kafka_num_consumers = 4' in sql and 'kafka_thread_per_consumer = 1' in sql
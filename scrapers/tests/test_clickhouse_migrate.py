@@ -0,0 +1,86 @@
+import datetime
+import os
+import re
+
+from typing import List, Set
+
+from scrapers import clickhouse_migrate, settings
+
+
+FLIGHTS_DIR = os.path.join(os.path.dirname(settings.CLICKHOUSE_MIGRATIONS_DIR), 'flights')
+MIGRATIONS = {m.version: m for m in clickhouse_migrate.migrations(settings.CLICKHOUSE_MIGRATIONS_DIR)}
+
+
+def fresh(name: str) -> List[str]:
+    with open(os.path.join(FLIGHTS_DIR, f'{name}.up.sql'), 'r') as f:
+        return clickhouse_migrate.statements(f.read())
+
+
+def added_after(version: str) -> Set[str]:
+    """Columns added by the migrations after `version`"""
+    return {
+        column
+        for later in MIGRATIONS.values() if later.version > version and later.sql('up')
+        for column in re.findall(r'ADD COLUMN IF NOT EXISTS (\w+)', later.sql('up'))
+    }
+
+
+def layout(statement: str, without: Set[str] = frozenset()) -> List[str]:
+    """Words of `statement`, without the lines of the columns `without`"""
+    lines = [
+        line for line in statement.replace('IF NOT EXISTS ', '').splitlines()
+        if not any(re.search(rf'\b{column}\b', line) for column in without)
+    ]
+
+    return ' '.join(lines).split()
+
+
+def test_rewrites_create_the_layout_of_fresh_deployments():
+    migration = MIGRATIONS['0001_flights_route_first']
+    [table] = fresh('table')
+
+    shadow = clickhouse_migrate.statements(migration.sql('shadow'))
+    assert layout(shadow[0].replace('flight_data.flights_next', 'flight_data.flights')) == \
+        layout(table, added_after(migration.version))
+    assert all(clickhouse_migrate.statements(migration.sql(name)) for name in ['check', 'swap', 'down'])
+
+
+def test_migrations_create_the_tables_of_fresh_deployments():
+    # The rollup view read the Kafka queue until `0004_daily_prices_from_flights`
+    def from_flights(statement: str) -> str:
+        return statement.replace('FROM flight_data.kafka_queue\nGROUP BY', 'FROM flight_data.flights\nGROUP BY')
+
+    rollup = MIGRATIONS['0002_daily_prices']
+    assert [layout(from_flights(s)) for s in clickhouse_migrate.statements(rollup.sql('up'))] == \
+        [layout(s, added_after(rollup.version)) for s in fresh('daily_prices')]
+
+    price_eur = MIGRATIONS['0003_price_eur']
+    created = [s for s in clickhouse_migrate.statements(price_eur.sql('up')) if s.startswith('CREATE')]
+    assert [layout(from_flights(s)) for s in created] == \
+        [layout(s) for s in fresh('kafka_consumer') + fresh('daily_prices')[1:]]
+
+    rollup_from_flights = MIGRATIONS['0004_daily_prices_from_flights']
+    [view, drop, rename] = clickhouse_migrate.statements(rollup_from_flights.sql('up'))
+    assert layout(view.replace('daily_prices_mv_next', 'daily_prices_mv')) == layout(fresh('daily_prices')[1])
+    assert drop.startswith('DROP VIEW') and rename.startswith('RENAME TABLE')
+
+
+def test_rollups_are_rebuilt_by_the_last_migration_changing_them():
+    assert [m.version for m in MIGRATIONS.values() if 'daily_prices' in m.rebuilds()] == [
+        '0002_daily_prices', '0003_price_eur'
+    ]
+
+    for migration in ['0002_daily_prices', '0003_price_eur']:
+        [rebuild] = clickhouse_migrate.statements(MIGRATIONS[migration].sql('rebuild.daily_prices'))
+        assert rebuild.format(table='flight_data.daily_prices_rebuild', condition='1').startswith(
+            'INSERT INTO flight_data.daily_prices_rebuild'
+        )
+
+
+def test_only_days_with_different_rows_before_the_cutoff_mismatch():
+    current = {'2023-07-01': 10, '2023-07-02': 12, '2023-07-03': 5, '2023-07-04': 3}
+    copied = {'2023-07-01': 10, '2023-07-02': 7, '2023-07-04': 1}
+
+    assert clickhouse_migrate.mismatched_days(current, copied, datetime.date(2023, 7, 4)) == [
+        datetime.date(2023, 7, 2), datetime.date(2023, 7, 3)
+    ]
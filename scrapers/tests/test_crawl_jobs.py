@@ -0,0 +1,124 @@
+import asyncio
+import concurrent.futures
+import os
+import queue
+import threading
+
+import pytest
+
+from scrapy import settings as scrapy_settings
+
+from scrapers import airline_route, crawl_jobs, metrics
+
+BSL_AMS = airline_route.Route('BSL', 'AMS')
+GVA_OTP = airline_route.Route('GVA', 'OTP')
+
+
+def test_queued_routes_are_deduplicated():
+    release = threading.Event()
+
+    def run(job_id, spider, routes, progress, sink=None):
+        release.wait(5)
+        return {'progress': {'responses': 1, 'items': 2}, 'metrics': {}, 'finish_reason': 'finished'}
+
+    async def scenario():
+        # A single worker, so the jobs after the first one stay queued
+        jobs = crawl_jobs.JobQueue(concurrent.futures.ThreadPoolExecutor(max_workers=1), queue.Queue(), run)
+        jobs.start()
+
+        first, _ = jobs.submit('EasyJet', [BSL_AMS])
+        jobs.progress.put((first.id, {'status': crawl_jobs.RUNNING}))
+        await asyncio.sleep(0.1)
+        assert first.status == crawl_jobs.RUNNING
+
+        # The running job crawls the very same routes already
+        again, duplicates = jobs.submit('EasyJet', [BSL_AMS])
+        assert again is None and duplicates == [first]
+
+        # It might be past the route, so it is queued again along with other routes
+        second, duplicates = jobs.submit('EasyJet', [BSL_AMS, GVA_OTP])
+        assert second is not None and duplicates == []
+
+        third, duplicates = jobs.submit('EasyJet', [GVA_OTP])
+        assert third is None and duplicates == [second]
+
+        fourth, duplicates = jobs.submit('EasyJet', [BSL_AMS, airline_route.Route('OTP', 'AMM')])
+        assert fourth.routes == [airline_route.Route('OTP', 'AMM')] and duplicates == [second]
+
+        # Other airlines have their own jobs, and so do crawls writing their fares elsewhere
+        assert jobs.submit('RyanAir', [BSL_AMS])[0] is not None
+        parquet, duplicates = jobs.submit('EasyJet', [GVA_OTP], 'parquet')
+        assert parquet.sink == 'parquet' and duplicates == []
+
+        release.set()
+
+        while any(job.status != crawl_jobs.FINISHED for job in jobs.list()):
+            await asyncio.sleep(0.01)
+
+        assert first.to_dict()['progress'] == {'responses': 1, 'items': 2, 'finish_reason': 'finished'}
+        assert [job.id for job in jobs.list('EasyJet')] == [first.id, second.id, fourth.id, parquet.id]
+
+        jobs.stop()
+
+    asyncio.run(scenario())
+
+
+def test_metrics_of_every_job_add_up():
+    def run(job_id, spider, routes, progress, sink=None):
+        registry = metrics.Registry()
+        registry.inc('scrapers_responses_total', airline=spider, status=200)
+        progress.put((job_id, {'metrics': registry.snapshot()}))
+        registry.inc('scrapers_responses_total', 2, airline=spider, status=200)
+        registry.set('scrapers_pipeline_queue_depth', 0, airline=spider)
+
+        return {'progress': {}, 'metrics': registry.snapshot()}
+
+    async def scenario():
+        jobs = crawl_jobs.JobQueue(concurrent.futures.ThreadPoolExecutor(max_workers=1), queue.Queue(), run)
+        jobs.start()
+        jobs.submit('EasyJet', [BSL_AMS])
+        jobs.submit('EasyJet', [GVA_OTP])
+
+        while len(jobs.list()) < 2 or any(job.status != crawl_jobs.FINISHED for job in jobs.list()):
+            await asyncio.sleep(0.01)
+
+        # Progress snapshots might be read after their job finished, they must not count twice
+        await asyncio.sleep(0.1)
+        jobs.stop()
+
+        assert jobs.metrics.total('scrapers_responses_total', airline='EasyJet') == (6, 6)
+        assert 'scrapers_pipeline_queue_depth{airline="EasyJet"} 0' in jobs.metrics.render()
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_crawls_keep_their_state_apart(tmp_path):
+    state_dir = str(tmp_path)
+
+    def settings():
+        return scrapy_settings.Settings({
+            'STATE_DIR': state_dir,
+            'RESPONSE_CACHE_PATH': os.path.join(state_dir, 'response_cache.sqlite'),
+            'METRICS_DUMP_DIR': os.path.join(state_dir, 'metrics'),
+            'SINK_DIR': '/var/fares',
+        })
+
+    first, second = settings(), settings()
+    first_lock = crawl_jobs.isolate_state(first, 2)
+    second_lock = crawl_jobs.isolate_state(second, 2)
+
+    assert first.get('STATE_DIR') == os.path.join(state_dir, 'api-worker-0')
+    assert first.get('RESPONSE_CACHE_PATH') == os.path.join(state_dir, 'api-worker-0', 'response_cache.sqlite')
+    assert second.get('METRICS_DUMP_DIR') == os.path.join(state_dir, 'api-worker-1', 'metrics')
+    # Paths elsewhere are left alone
+    assert second.get('SINK_DIR') == '/var/fares'
+
+    with pytest.raises(RuntimeError):
+        crawl_jobs.isolate_state(settings(), 2)
+
+    # The next crawl picks up the state of the one before
+    first_lock.close()
+    third = settings()
+    crawl_jobs.isolate_state(third, 2).close()
+    assert third.get('STATE_DIR') == os.path.join(state_dir, 'api-worker-0')
+    second_lock.close()
@@ -0,0 +1,32 @@
+import datetime
+
+from scrapers import airline_route, crawl_ledger, settings
+from scrapers.spiders import RyanAir
+
+
+def test_resumed_crawl_requests_only_the_windows_not_done(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'ROUTE_HISTORY_PATH', str(tmp_path / 'history.sqlite'))
+    monkeypatch.setattr(settings, 'CRAWL_LEDGER_PATH', str(tmp_path / 'ledger.sqlite'))
+    today = datetime.date.today()
+
+    spider = RyanAir.RyanairSpider()
+    spider.routes = [airline_route.Route('BSL', 'AMS')]
+    windows = [request.meta['route_window'] for request in spider.start_requests()]
+
+    ledger = crawl_ledger.CrawlLedger(settings.CRAWL_LEDGER_PATH)
+    ledger.done(windows[0], today)
+    ledger.failed(windows[1], today, 'TimeoutError()', 3)
+    # Done by the crawl of another day
+    ledger.done(windows[2], today - datetime.timedelta(days=1))
+    assert ledger.counts('RyanAir', today) == {crawl_ledger.DONE: 1, crawl_ledger.FAILED: 1}
+    ledger.close()
+
+    spider = RyanAir.RyanairSpider(resume='true')
+    spider.routes = [airline_route.Route('BSL', 'AMS')]
+    assert [request.meta['route_window'] for request in spider.start_requests()] == windows[1:]
+
+    # The failed window is done by the resumed crawl
+    ledger = crawl_ledger.CrawlLedger(settings.CRAWL_LEDGER_PATH)
+    ledger.done(windows[1], today)
+    assert ledger.done_windows('RyanAir', today) == {windows[0].key(), windows[1].key()}
+    ledger.close()
@@ -0,0 +1,94 @@
+import datetime
+import json
+import os
+import types
+
+from scrapy import http
+from scrapy.spidermiddlewares import httperror
+from twisted.python import failure
+
+from scrapers import airline_route, items
+from scrapers.spiders import EasyJet
+
+ROUTE = airline_route.Route('BSL', 'AMS')
+FIXTURE = os.path.join(os.path.dirname(__file__), '..', 'benchmarks', 'fixtures', 'easyjet_search.json')
+
+
+def offer(day: str, price: float, legs: int = 1) -> dict:
+    leg = {'departure': f'{day}T06:00:00Z', 'origin': {'code': 'BSL'}, 'destination': {'code': 'AMS'}}
+
+    return {'price': price, 'currency': 'EUR', 'itinerary': {'outbound': [{'id': day, 'legs': [leg] * legs}]}}
+
+
+def best_offers(day: str, price: float) -> dict:
+    return {'bestOffers': {offer_type: offer(day, price) for offer_type in EasyJet.EasyJetSpider.OFFER_TYPES}}
+
+
+def test_dates_are_packed_into_batched_searches():
+    spider = EasyJet.EasyJetSpider()
+    requests = spider.prepare_request(ROUTE, datetime.date(2023, 7, 1), datetime.date(2023, 7, 30))
+
+    assert len(requests) == 3
+    assert [len(request.meta['dates']) for request in requests] == [10, 10, 10]
+    assert requests[-1].meta['dates'][-1] == datetime.date(2023, 7, 30)
+
+    body = json.loads(requests[0].body)
+    assert body['query'].count('search(') == 10
+    assert body['variables']['d9'] == '2023-07-10'
+
+
+def test_failed_batched_searches_are_retried_one_by_one():
+    spider = EasyJet.EasyJetSpider()
+    request = spider.prepare_request(ROUTE, datetime.date(2023, 7, 1), datetime.date(2023, 7, 3))[0]
+    body = {
+        'data': {'d0': best_offers('2023-07-01', 10), 'd1': None, 'd2': best_offers('2023-07-03', 30)},
+        'errors': [{'message': 'Internal error', 'path': ['d1']}],
+    }
+    response = http.TextResponse(request.url, body=json.dumps(body), encoding='utf-8', request=request)
+
+    output = list(spider.parse(response))
+    retries = [request for request in output if isinstance(request, http.Request)]
+
+    assert [fare.price for fare in output if isinstance(fare, items.FareRecord)] == [10, 30]
+    assert [retry.meta['route_window'].start for retry in retries] == [datetime.date(2023, 7, 2)]
+    # Only one search failed, so the gateway still accepts batches
+    assert spider.searches_per_request > 1
+
+
+def test_rejected_batches_are_searched_again_without_failing_their_window():
+    spider = EasyJet.EasyJetSpider()
+    sent = []
+    spider.crawler = types.SimpleNamespace(signals=types.SimpleNamespace(send_catch_log=lambda **kw: sent.append(kw)))
+    request = spider.prepare_request(ROUTE, datetime.date(2023, 7, 1), datetime.date(2023, 7, 3))[0]
+
+    def failed(status: int) -> failure.Failure:
+        response = http.TextResponse(request.url, status=status, request=request)
+        f = failure.Failure(httperror.HttpError(response, 'Ignoring non-200 response'))
+        f.request = request
+
+        return f
+
+    retries = list(request.errback(failed(413)))
+
+    # The days searched one by one record their own outcome
+    assert [retry.meta['route_window'].start for retry in retries] == [
+        datetime.date(2023, 7, 1), datetime.date(2023, 7, 2), datetime.date(2023, 7, 3)
+    ]
+    assert sent == [] and spider.searches_per_request == 1
+
+    assert list(request.errback(failed(500))) == []
+    assert [kw['request'] for kw in sent] == [request]
+
+
+def test_single_search_keeps_only_direct_flights_of_the_route():
+    spider = EasyJet.EasyJetSpider()
+    spider.searches_per_request = 1
+    request = spider.prepare_request(ROUTE, datetime.date(2023, 7, 14), datetime.date(2023, 7, 14))[0]
+
+    with open(FIXTURE, 'rb') as f:
+        response = http.TextResponse(request.url, body=f.read(), encoding='utf-8', request=request)
+
+    fares = list(spider.parse(response))
+
+    # QUICKEST departs from Mulhouse and CHEAPEST has a connection
+    assert [(fare.source, fare.destination) for fare in fares] == [('BSL', 'AMS')]
@@ -0,0 +1,69 @@
+import datetime
+import types
+
+import pytest
+
+from benchmarks import mock_airlines
+from scrapers import fx_rates, items, pipelines
+
+TODAY = datetime.date(2023, 7, 3)
+
+
+def rates_url(tmp_path, today: datetime.date) -> str:
+    document = tmp_path / 'eurofxref.xml'
+    document.write_text(mock_airlines.ecb_rates(today, days=2))
+
+    return document.as_uri()
+
+
+def test_rates_are_cached_by_day_and_kept_when_the_ecb_is_unreachable(tmp_path):
+    table = fx_rates.FxTable(str(tmp_path / 'fx_rates.json'), rates_url(tmp_path, TODAY))
+
+    assert table.refresh(TODAY)
+    assert not table.refresh(TODAY)
+    assert table.to_eur('EUR', '2020-01-01') == 1.0
+    assert table.to_eur('PLN', '2023-07-03') == pytest.approx(1 / 4.4345)
+    # The rates of the last day before are used, none before the first day known
+    assert table.rates_day('2023-07-09T10:00:00') == '2023-07-03'
+    assert table.to_eur('PLN', '2023-07-01') is None
+    assert table.to_eur('XXX', '2023-07-03') is None
+
+    unreachable = fx_rates.FxTable(str(tmp_path / 'fx_rates.json'), (tmp_path / 'missing.xml').as_uri())
+
+    with pytest.raises(OSError):
+        unreachable.refresh(TODAY + datetime.timedelta(days=1))
+
+    assert unreachable.fetched_on == TODAY
+    assert unreachable.to_eur('HUF', '2023-07-04') == pytest.approx(1 / 379.85)
+
+
+def test_pipeline_sets_the_euro_price_of_every_fare(tmp_path):
+    stats = types.SimpleNamespace(values={})
+    stats.inc_value = lambda key: stats.values.__setitem__(key, stats.values.get(key, 0) + 1)
+    pipeline = pipelines.CurrencyNormalizationPipeline(
+        str(tmp_path / 'fx_rates.json'), rates_url(tmp_path, datetime.date.today()), stats
+    )
+    pipeline.open_spider(types.SimpleNamespace(name='WizzAir'))
+    today = datetime.date.today().isoformat()
+
+    fares = [
+        items.FareRecord('2023-08-01', 'BUD', 'BSL', price, currency, 'WizzAir', today)
+        for price, currency in [(18990, 'HUF'), (49.99, 'EUR'), (1000, 'XXX'), (37980, 'HUF')]
+    ]
+
+    assert [pipeline.process_item(fare, None).price_eur for fare in fares] == [49.99, 49.99, None, 99.99]
+    assert stats.values == {'fx/unconverted/XXX': 1}
+    assert len(pipeline.factors) == 3
+
+
+@pytest.mark.parametrize('document', [None, '<gesmes:Envelope', '<Envelope/>'])
+def test_fares_keep_no_euro_price_when_the_rates_cannot_be_fetched(tmp_path, document):
+    url = tmp_path / 'eurofxref.xml'
+    if document is not None:
+        url.write_text(document)
+
+    pipeline = pipelines.CurrencyNormalizationPipeline(str(tmp_path / 'fx_rates.json'), url.as_uri())
+    pipeline.open_spider(types.SimpleNamespace(name='WizzAir'))
+    fare = items.FareRecord('2023-08-01', 'BUD', 'BSL', 18990, 'HUF', 'WizzAir', TODAY.isoformat())
+
+    assert pipeline.process_item(fare, None).price_eur is None
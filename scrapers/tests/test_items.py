@@ -0,0 +1,64 @@
+import json
+import sys
+
+import pytest
+
+from scrapers import items
+
+
+def fare(**overrides) -> items.FareRecord:
+    fields = {
+        'flight_date': '2023-07-01T06:10:00',
+        'source': 'GVA',
+        'destination': 'OTP',
+        'price': 42.5,
+        'currency': 'EUR',
+        'company': 'WizzAir',
+        'scrape_date': '2023-06-01',
+    }
+    fields.update(overrides)
+
+    return items.FareRecord(**fields)
+
+
+def test_fare_record_interns_repeated_strings():
+    # Built at runtime, like the strings decoded from a response
+    first, second = fare(source=''.join(['G', 'V', 'A'])), fare(source=''.join(['G', 'V', 'A']))
+
+    assert first.source is second.source
+    assert first.source is sys.intern('GVA')
+    assert not hasattr(first, '__dict__')
+
+
+@pytest.mark.parametrize('price', [None, float('nan'), float('inf'), '42.5'])
+def test_fare_record_rejects_prices_that_are_not_finite_numbers(price):
+    with pytest.raises(ValueError):
+        fare(price=price)
+
+
+def test_fares_in_euros_have_their_euro_price():
+    assert fare().price_eur == 42.5
+    assert fare(currency='PLN').price_eur is None
+    assert json.loads(items.encode_json_row(fare()))['price_eur'] == 42.5
+
+
+def test_encode_json_each_row():
+    records = [fare(), fare(price=7, price_eur=0.875, destination='BSL', currency='PLN'), fare(source='O"T\\P')]
+    rows = items.encode_json_each_row(records).decode('utf-8').split('\n')
+
+    assert rows[-1] == ''
+    assert [json.loads(row) for row in rows[:-1]] == [
+        {
+            'flight_date': record.flight_date,
+            'source': record.source,
+            'destination': record.destination,
+            'price': float(record.price),
+            'price_eur': record.price_eur,
+            'currency': record.currency,
+            'company': record.company,
+            'scrape_date': record.scrape_date,
+        }
+        for record in records
+    ]
+    assert items.encode_json_each_row([]) == b''
+    assert items.encode_json_row(records[0]) + b'\n' == items.encode_json_each_row(records[:1])
@@ -0,0 +1,30 @@
+import json
+
+import pytest
+
+from scrapers import json_stream
+
+
+def test_values_are_found_at_any_depth():
+    body = json.dumps({'a': {'key': [1, 2]}, 'b': [{'key': {'c': 3}}], 'key': 'last'}).encode('utf-8')
+
+    assert list(json_stream.iter_values(body, 'key')) == [[1, 2], {'c': 3}, 'last']
+    assert list(json_stream.iter_values(body, 'key', limit=1)) == [[1, 2]]
+
+
+def test_keys_inside_strings_and_values_are_skipped():
+    body = json.dumps({'text': 'a "key": 1', 'other': 'key', 'key': 2}).encode('utf-8')
+
+    assert list(json_stream.iter_values(body, 'key')) == [2]
+
+
+def test_chunks_grow_until_they_hold_the_value():
+    value = [{'city': 'Zürich', 'n': i} for i in range(1000)]
+    body = json.dumps({'key': value}, ensure_ascii=False).encode('utf-8')
+
+    assert list(json_stream.iter_values(body, 'key', chunk_size=16)) == [value]
+
+
+def test_truncated_values_raise():
+    with pytest.raises(json.JSONDecodeError):
+        list(json_stream.iter_values(b'{"key": [1, 2', 'key', chunk_size=4))
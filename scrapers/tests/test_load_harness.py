@@ -0,0 +1,36 @@
+import json
+import os
+import subprocess
+import sys
+
+from benchmarks import load_harness
+
+SCRAPERS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_generated_routes_are_distinct():
+    routes = load_harness.generate_routes(100, ['RyanAir', 'EasyJet'])
+    pairs = {(route['source'], route['destination']) for route in routes['RyanAir']}
+
+    assert routes['RyanAir'] == routes['EasyJet']
+    assert len(pairs) == 100
+    assert all(source != destination and (destination, source) not in pairs for source, destination in pairs)
+
+
+def test_spiders_crawl_the_mock_airlines_into_the_broker(tmp_path):
+    report_path = tmp_path / 'report.json'
+    subprocess.run(
+        [sys.executable, '-m', 'benchmarks.load_harness', '--routes', '3', '--days', '30', '--output', str(report_path)],
+        cwd=SCRAPERS_DIR,
+        check=True,
+        capture_output=True,
+        timeout=120,
+    )
+    report = json.loads(report_path.read_text())
+
+    assert set(report['spiders']) == {'RyanAir', 'WizzAir', 'EasyJet'}
+    assert all(spider['items'] > 0 for spider in report['spiders'].values())
+    # Prices and days with flights only depend on the route, so every airline has the same fares
+    assert len({spider['items'] for spider in report['spiders'].values()}) == 1
+    assert report['delivered'] == report['items']
+    assert report['backlog_end'] == 0
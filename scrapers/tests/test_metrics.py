@@ -0,0 +1,50 @@
+import types
+
+from scrapy import http
+
+from scrapers import airline_route, metrics, middlewares
+
+
+def test_histograms_render_cumulative_buckets():
+    registry = metrics.Registry()
+
+    for latency in [0.01, 0.3, 0.3, 120]:
+        registry.observe('scrapers_download_seconds', latency, airline='WizzAir', endpoint='be.wizzair.com/timetable')
+
+    lines = registry.render(airline='WizzAir').splitlines()
+    labels = 'airline="WizzAir",endpoint="be.wizzair.com/timetable"'
+
+    assert '# TYPE scrapers_download_seconds histogram' in lines
+    assert f'scrapers_download_seconds_bucket{{{labels},le="0.05"}} 1' in lines
+    assert f'scrapers_download_seconds_bucket{{{labels},le="0.5"}} 3' in lines
+    assert f'scrapers_download_seconds_bucket{{{labels},le="60"}} 3' in lines
+    assert f'scrapers_download_seconds_bucket{{{labels},le="+Inf"}} 4' in lines
+    assert f'scrapers_download_seconds_count{{{labels}}} 4' in lines
+    assert registry.render(airline='RyanAir') == ''
+
+
+def test_endpoints_do_not_depend_on_the_route():
+    def request(source: str, destination: str) -> http.Request:
+        window = airline_route.RouteWindow('RyanAir', source, destination, None, None)
+        return http.Request(
+            f'https://www.ryanair.com/api/farfnd/3/oneWayFares/{source}/{destination}/cheapestPerDay?outboundDateFrom=1',
+            meta={'route_window': window},
+        )
+
+    assert middlewares.endpoint(request('OTP', 'AMM')) == middlewares.endpoint(request('BSL', 'AMS')) \
+        == 'www.ryanair.com/api/farfnd/3/oneWayFares/{source}/{destination}/cheapestPerDay'
+
+
+def test_spider_middleware_times_the_callback():
+    registry = metrics.Registry()
+    middleware = middlewares.AirlineScraperSpiderMiddleware(registry, '')
+    spider = types.SimpleNamespace(name='EasyJet')
+
+    def parse():
+        yield {'price': 1}
+        yield http.Request('https://gateway.prod.dohop.net/api/graphql')
+        yield {'price': 2}
+
+    assert len(list(middleware.process_spider_output(None, parse(), spider))) == 3
+    assert registry.total('scrapers_items_per_response', airline='EasyJet') == (1, 2)
+    assert registry.total('scrapers_parse_seconds', airline='EasyJet')[0] == 1
@@ -0,0 +1,183 @@
+import datetime
+import json
+import logging
+import os
+import types
+
+import pytest
+
+from kafka.record import memory_records
+
+from benchmarks import stand_in_broker
+
+os.environ.setdefault('KAFKA_TOPIC', 'flights')
+os.environ.setdefault('KAFKA_BOOTSTRAP_BROKERS', 'stand-in:9092')
+
+from scrapers import items, pipelines  # noqa: E402
+
+FARE = {
+    'flight_date': '2023-07-01',
+    'source': 'GVA',
+    'destination': 'OTP',
+    'price': 42.5,
+    'currency': 'EUR',
+    'company': 'WizzAir',
+    'scrape_date': '2023-06-01'
+}
+
+
+def run_pipeline(broker, items, **producer_config):
+    pipeline = pipelines.AirlineScraperPipeline(
+        producer_config=producer_config,
+        producer_factory=lambda **configs: stand_in_broker.StandInProducer(broker, **configs),
+    )
+    spider = types.SimpleNamespace(name='test')
+
+    pipeline.open_spider(spider)
+
+    for item in items:
+        assert pipeline.process_item(item, spider) is item
+
+    pipeline.close_spider(spider)
+
+    return pipeline
+
+
+def test_batched_delivery():
+    broker = stand_in_broker.StandInBroker()
+    pipeline = run_pipeline(broker, [FARE] * 100, batch_size=64 * 1024, linger_ms=60_000, compression_type='gzip')
+
+    # Everything lingered in a single batch until `close_spider` flushed it
+    assert broker.requests == 1
+    assert pipeline.delivered == 100
+    assert pipeline.failed == 0
+    assert [json.loads(value) for value in broker.values(os.environ['KAFKA_TOPIC'])] == [FARE] * 100
+
+
+def test_shared_producer_outlives_the_crawls():
+    broker = stand_in_broker.StandInBroker()
+    shared = pipelines.SharedProducer(lambda **configs: stand_in_broker.StandInProducer(broker, **configs))
+
+    for _ in range(2):
+        pipeline = pipelines.AirlineScraperPipeline(producer_factory=shared)
+        spider = types.SimpleNamespace(name='test')
+        pipeline.open_spider(spider)
+        pipeline.process_item(FARE, spider)
+        pipeline.close_spider(spider)
+
+        # Flushed for every crawl, but not closed
+        assert pipeline.delivered == 1
+        assert pipeline.producer is shared.producer
+
+    shared.close()
+    assert len(broker.values(os.environ['KAFKA_TOPIC'])) == 2
+
+
+def test_spooled_crawls_of_a_runner_keep_the_shared_producer_open(tmp_path):
+    broker = stand_in_broker.StandInBroker()
+    shared = pipelines.SharedProducer(lambda **configs: stand_in_broker.StandInProducer(broker, **configs))
+    spiders = [types.SimpleNamespace(name='RyanAir'), types.SimpleNamespace(name='WizzAir')]
+    crawls = [
+        pipelines.AirlineScraperPipeline(
+            producer_factory=shared,
+            spool_config={'directory': str(tmp_path), 'segment_size': 1024 * 1024, 'drain_timeout': 5},
+        )
+        for _ in spiders
+    ]
+
+    for pipeline, spider in zip(crawls, spiders):
+        pipeline.open_spider(spider)
+        pipeline.process_item(FARE, spider)
+
+    # The first crawl to finish closes its own drainer's producer only
+    crawls[0].close_spider(spiders[0])
+    crawls[1].process_item(FARE, spiders[1])
+    crawls[1].close_spider(spiders[1])
+
+    assert [pipeline.delivered for pipeline in crawls] == [1, 2]
+    assert [json.loads(value) for value in broker.values(os.environ['KAFKA_TOPIC'])] == [FARE] * 3
+
+    # Crawls sending straight to Kafka still get a working shared producer
+    pipeline = pipelines.AirlineScraperPipeline(producer_factory=shared)
+    pipeline.open_spider(spiders[0])
+    pipeline.process_item(FARE, spiders[0])
+    pipeline.close_spider(spiders[0])
+    assert pipeline.delivered == 1 and not shared.producer.closed
+
+
+def test_fares_are_keyed_by_route():
+    broker = stand_in_broker.StandInBroker(partitions=4)
+    routes = [('GVA', 'OTP'), ('OTP', 'GVA'), ('BSL', 'AMS'), ('AMS', 'BSL'), ('LTN', 'BCN'), ('BCN', 'LTN')]
+    fares = [
+        items.FareRecord(f'2023-07-{day:02d}', source, destination, day, 'EUR', 'WizzAir', '2023-06-01')
+        for day in range(1, 31) for source, destination in routes
+    ]
+    run_pipeline(broker, fares, linger_ms=60_000)
+
+    routes = {}
+
+    for _topic, partition, buffer in broker.batches:
+        records = memory_records.MemoryRecords(buffer)
+
+        while records.has_next():
+            for record in records.next_batch():
+                routes.setdefault(record.key, []).append((partition, json.loads(record.value)['flight_date']))
+
+    # Every route in a single partition with its fares in the order they were scraped, the routes over several ones
+    assert sorted(routes) == sorted({pipelines.route_key(fare) for fare in fares})
+    assert all(len({partition for partition, _day in sent}) == 1 for sent in routes.values())
+    assert all([day for _partition, day in sent] == sorted(day for _partition, day in sent) for sent in routes.values())
+    assert len({sent[0][0] for sent in routes.values()}) > 1
+
+
+def test_delivery_failures_are_counted():
+    broker = stand_in_broker.StandInBroker(failure_rate=1.0)
+    pipeline = run_pipeline(broker, [FARE] * 10)
+
+    assert pipeline.delivered == 0
+    assert pipeline.failed == 10
+
+
+def test_compression_type():
+    logger = logging.getLogger('test')
+
+    assert pipelines.compression_type('', logger) is None
+    assert pipelines.compression_type('gzip', logger) == 'gzip'
+
+    with pytest.raises(ValueError):
+        pipelines.compression_type('brotli', logger)
+
+
+def test_price_delta_emits_only_changes_between_snapshots(tmp_path, monkeypatch):
+    spider = types.SimpleNamespace(name='WizzAir')
+    days = iter([datetime.date(2023, 6, day) for day in (1, 2, 3, 8)])
+
+    def crawl(prices):
+        pipeline = pipelines.PriceDeltaPipeline(str(tmp_path / 'index.sqlite'), datetime.timedelta(days=7))
+        pipeline.open_spider(spider)
+        emitted = []
+
+        for flight_date, price in prices.items():
+            record = items.FareRecord(flight_date, 'GVA', 'OTP', price, 'EUR', 'WizzAir', '2023-06-01')
+
+            try:
+                emitted.append(pipeline.process_item(record, spider).price)
+            except pipelines.UnchangedFare:
+                pass
+
+        pipeline.close_spider(spider)
+
+        return emitted
+
+    class Date(datetime.date):
+        @classmethod
+        def today(cls):
+            return next(days)
+
+    monkeypatch.setattr(pipelines, 'datetime', types.SimpleNamespace(date=Date, timedelta=datetime.timedelta))
+
+    # The first crawl is a snapshot, then only the changes go through until the next snapshot is due
+    assert crawl({'2023-07-01': 10, '2023-07-02': 20}) == [10, 20]
+    assert crawl({'2023-07-01': 10, '2023-07-02': 25, '2023-07-03': 30}) == [25, 30]
+    assert crawl({'2023-07-01': 10, '2023-07-02': 25, '2023-07-03': 30}) == []
+    assert crawl({'2023-07-01': 10, '2023-07-02': 25}) == [10, 25]
@@ -0,0 +1,95 @@
+import datetime
+import types
+
+import pytest
+
+from scrapy import exceptions, http
+from scrapy.core import downloader as core_downloader
+from scrapy.utils import test
+
+from scrapers import middlewares, rate_control
+
+LIMITS = rate_control.RateLimits(
+    min_delay=0.5, max_delay=60, max_concurrency=4, delay_step=1, increase_every=2, target_latency=5
+)
+
+
+def test_additive_increase_then_multiplicative_decrease():
+    controller = rate_control.RateController(rate_control.Rate(1, 1.5), LIMITS)
+    rates = []
+
+    for _ in range(10):
+        controller.on_success(controller.epoch, latency=1)
+        rates.append(controller.rate)
+
+    # The delay goes down to its minimum first, then concurrent requests are added
+    assert rates[-1] == rate_control.Rate(4, 0.5)
+    assert rate_control.Rate(2, 0.5) in rates
+
+    epoch = controller.epoch
+    assert controller.on_backoff(epoch)
+    # Requests sent before the backoff cannot cause another one
+    assert not controller.on_backoff(epoch)
+    assert controller.rate == rate_control.Rate(2, 1)
+    assert controller.safe_rate == controller.rate
+
+
+def test_slow_successes_hold_the_rate():
+    controller = rate_control.RateController(rate_control.Rate(1, 10), LIMITS)
+
+    for _ in range(10):
+        assert not controller.on_success(controller.epoch, latency=6)
+
+    assert controller.rate == rate_control.Rate(1, 10)
+
+
+def test_safe_rate_is_stored_between_crawls(tmp_path):
+    store = rate_control.RateStore(str(tmp_path / 'rates.json'))
+    store.put('WizzAir', rate_control.Rate(3, 2.0), datetime.date(2023, 6, 1))
+    store.put('RyanAir', rate_control.Rate(1, 8.0), datetime.date(2023, 6, 1))
+
+    assert store.get('WizzAir') == rate_control.Rate(3, 2.0)
+    assert store.get('EasyJet') is None
+
+
+def test_middleware_drives_the_download_slot(tmp_path):
+    # A real downloader, whose slots are only created when a request is enqueued, after the middlewares
+    downloader = core_downloader.Downloader(
+        test.get_crawler(settings_dict={'CONCURRENT_REQUESTS_PER_DOMAIN': 2, 'DOWNLOAD_DELAY': 10})
+    )
+    crawler = types.SimpleNamespace(
+        engine=types.SimpleNamespace(downloader=downloader),
+        stats=types.SimpleNamespace(inc_value=lambda *args, **kwargs: None, set_value=lambda *args, **kwargs: None),
+    )
+    store = rate_control.RateStore(str(tmp_path / 'rates.json'))
+    store.put('WizzAir', rate_control.Rate(4, 0.5), datetime.date(2023, 6, 1))
+    middleware = middlewares.AdaptiveRateMiddleware(crawler, store, LIMITS, rate_control.Rate(2, 10))
+    spider = types.SimpleNamespace(name='WizzAir', BACKOFF_STATUSES=[400, 429], logger=types.SimpleNamespace(
+        info=lambda *_: None, debug=lambda *_: None, warning=lambda *_: None
+    ))
+
+    middleware.spider_opened(spider)
+    request = http.Request('https://wizzair.com/')
+    middleware.process_request(request, spider)
+    slot = downloader.slots['wizzair.com']
+
+    # The very first request starts from the stored rate rather than the static settings
+    assert (slot.concurrency, slot.delay) == (4, 0.5)
+
+    # Downloader middlewares get responses not tied to their request yet
+    request.meta['download_latency'] = 0.1
+    middleware.process_response(request, http.Response(request.url, status=200), spider)
+    middleware.process_response(request, http.Response(request.url, status=400), spider)
+
+    # The backoff applies right away, not only to the requests sent after it
+    assert (slot.concurrency, slot.delay) == (2, 1)
+
+    middleware.spider_closed(spider)
+    assert store.get('WizzAir') == rate_control.Rate(2, 1)
+
+
+def test_middleware_is_not_enabled_along_with_autothrottle():
+    crawler = test.get_crawler(settings_dict={'RATE_CONTROL_ENABLED': True, 'AUTOTHROTTLE_ENABLED': True})
+
+    with pytest.raises(exceptions.NotConfigured):
+        middlewares.AdaptiveRateMiddleware.from_crawler(crawler)
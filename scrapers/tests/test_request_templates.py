@@ -0,0 +1,44 @@
+import datetime
+import json
+
+from scrapy import http
+
+from scrapers import airline_route, request_templates
+from scrapers.spiders import EasyJet, WizzAir
+
+ROUTE = airline_route.Route('BSL', 'AMS')
+
+
+def test_rendered_bodies_are_the_bodies_json_dumps_gives():
+    template = request_templates.BodyTemplate(
+        {'b': [request_templates.Field('x'), {'c': request_templates.Field('y')}], 'a': '%s {0}'}, sort_keys=True
+    )
+    values = {'x': 'Zürich "1"', 'y': None}
+
+    assert template.render(**values) == json.dumps(
+        {'b': [values['x'], {'c': values['y']}], 'a': '%s {0}'}, sort_keys=True
+    ).encode()
+
+
+def test_spiders_send_the_bodies_they_built_before():
+    days = [datetime.date(2023, 7, 1) + datetime.timedelta(days=i) for i in range(3)]
+    variables = {
+        'partner': 'easyjet', 'metadata': {'language': 'en', 'currency': 'EUR'}, 'origin': 'BSL',
+        'destination': 'AMS', 'passengerAges': [18], 'limit': 1,
+    }
+    spider = EasyJet.EasyJetSpider(routes='BSL-AMS')
+
+    assert spider._batched_search_request(ROUTE, days).body == http.JsonRequest('https://x', data={
+        'query': EasyJet.batched_search_query(3),
+        'variables': {**variables, 'd0': '2023-07-01', 'd1': '2023-07-02', 'd2': '2023-07-03'},
+    }).body
+    assert spider._search_request(ROUTE, days[0]).body == http.JsonRequest('https://x', data={
+        'query': EasyJet.SEARCH_QUERY,
+        'variables': {**variables, 'departureDateString': '2023-07-01', 'returnDateString': None},
+    }).body
+
+    [request] = WizzAir.WizzairSpider(routes='BSL-AMS').prepare_request(ROUTE, days[0], days[-1])
+    assert json.loads(request.body) == {
+        'flightList': [{'departureStation': 'BSL', 'arrivalStation': 'AMS', 'from': '2023-07-01', 'to': '2023-07-03'}],
+        'priceType': 'regular', 'adultCount': 1, 'childCount': 0, 'infantCount': 0,
+    }
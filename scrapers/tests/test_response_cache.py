@@ -0,0 +1,70 @@
+import datetime
+import types
+
+from scrapy import http
+from scrapy.settings import Settings
+from scrapy.statscollectors import MemoryStatsCollector
+
+from scrapers import airline_route, middlewares, response_cache
+
+WINDOW = airline_route.RouteWindow('RyanAir', 'OTP', 'AMM', datetime.date(2023, 7, 1), datetime.date(2023, 7, 30))
+
+
+def crawl(middleware, body: bytes, parsed: list, follow_up: bool = False):
+    request = http.Request('https://www.ryanair.com/api', meta={'route_window': WINDOW})
+    response = http.TextResponse(request.url, body=body, request=request, encoding='utf-8')
+
+    def parse():
+        parsed.append(body)
+        response.meta['covered_until'] = datetime.date(2023, 7, 20)
+        yield {'body': body}
+
+        if follow_up:
+            yield http.Request('https://www.ryanair.com/api?retry=1')
+
+    spider = types.SimpleNamespace(
+        name='RyanAir', logger=types.SimpleNamespace(debug=print), normalized_body=lambda r: r.body
+    )
+    output = [i if isinstance(i, dict) else i.url for i in middleware.process_spider_output(response, parse(), spider)]
+
+    return output, response.meta.get('covered_until')
+
+
+def test_unchanged_responses_are_not_parsed(tmp_path):
+    cache = response_cache.ResponseCache(str(tmp_path / 'cache.sqlite'), datetime.timedelta(days=7))
+    stats = MemoryStatsCollector(types.SimpleNamespace(settings=Settings()))
+    middleware = middlewares.ResponseCacheMiddleware(cache, stats)
+    parsed = []
+
+    assert crawl(middleware, b'{"fares": 1}', parsed) == ([{'body': b'{"fares": 1}'}], datetime.date(2023, 7, 20))
+    # Neither parsed nor emitted, the days it covers come from the cache
+    assert crawl(middleware, b'{"fares": 1}', parsed) == ([], datetime.date(2023, 7, 20))
+    assert parsed == [b'{"fares": 1}']
+    assert cache.confirmed_on(WINDOW) == datetime.date.today()
+
+    assert crawl(middleware, b'{"fares": 2}', parsed)[0] == [{'body': b'{"fares": 2}'}]
+    assert cache.confirmed_on(WINDOW) is None
+
+
+def test_responses_yielding_requests_are_parsed_every_time(tmp_path):
+    cache = response_cache.ResponseCache(str(tmp_path / 'cache.sqlite'), datetime.timedelta(days=7))
+    stats = MemoryStatsCollector(types.SimpleNamespace(settings=Settings()))
+    middleware = middlewares.ResponseCacheMiddleware(cache, stats)
+    parsed = []
+
+    for _ in range(2):
+        assert crawl(middleware, b'{"errors": 1}', parsed, follow_up=True)[0] == [
+            {'body': b'{"errors": 1}'}, 'https://www.ryanair.com/api?retry=1'
+        ]
+
+    assert len(parsed) == 2
+
+
+def test_unchanged_responses_are_emitted_again_when_stale(tmp_path):
+    cache = response_cache.ResponseCache(str(tmp_path / 'cache.sqlite'), datetime.timedelta(days=7))
+    body_digest = response_cache.digest(b'{}')
+    cache.store(WINDOW, body_digest, datetime.date(2023, 6, 1))
+
+    assert cache.is_unchanged(WINDOW, body_digest, datetime.date(2023, 6, 7))
+    assert not cache.is_unchanged(WINDOW, body_digest, datetime.date(2023, 6, 8))
+    assert not cache.is_unchanged(WINDOW, response_cache.digest(b'[]'), datetime.date(2023, 6, 2))
@@ -0,0 +1,34 @@
+import json
+
+from scrapers import airline_route, route_catalog, settings
+from scrapers.spiders import WizzAir
+
+
+def test_mirrored_and_duplicated_routes_are_scraped_once(tmp_path, monkeypatch):
+    (tmp_path / 'a.json').write_text(json.dumps({
+        'WizzAir': [
+            {'source': 'GVA', 'destination': 'OTP'},
+            {'source': 'otp', 'destination': 'gva '},
+            {'source': 'BSL', 'destination': 'OTP'},
+            {'source': 'BSL', 'destination': 'BSL'},
+            {'source': 'BASEL', 'destination': 'OTP'},
+            {'source': 'BSL'},
+        ],
+        'RyanAir': [{'source': 'OTP', 'destination': 'GVA'}],
+    }))
+    (tmp_path / 'b.json').write_text(json.dumps({'WizzAir': [{'source': 'BSL', 'destination': 'OTP'}]}))
+
+    catalog = route_catalog.load(str(tmp_path))
+
+    assert catalog.routes('WizzAir') == [airline_route.Route('GVA', 'OTP'), airline_route.Route('BSL', 'OTP')]
+    assert catalog.stats('WizzAir') == route_catalog.CatalogStats(listed=7, mirrored=1, duplicated=1, invalid=3)
+    assert catalog.contains('WizzAir', airline_route.Route('OTP', 'GVA'))
+    assert not catalog.contains('RyanAir', airline_route.Route('BSL', 'OTP'))
+    # Airport codes are shared by all the routes
+    assert catalog.routes('WizzAir')[0].destination is catalog.routes('WizzAir')[1].destination
+
+    monkeypatch.setattr(settings, 'ROUTES_FILE', f'{tmp_path / "a.json"},{tmp_path / "b.json"}')
+    spider = WizzAir.WizzairSpider()
+
+    assert spider.routes == catalog.routes('WizzAir') and spider.redundant_routes == 2
+    assert WizzAir.WizzairSpider(routes='GVA-OTP,OTP-GVA').routes == [airline_route.Route('GVA', 'OTP')]
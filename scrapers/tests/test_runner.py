@@ -0,0 +1,24 @@
+import datetime
+
+from twisted.web.test import requesthelper
+
+from scrapers import metrics, runner
+
+
+def test_next_trigger():
+    schedule = runner.parse_schedule('18:20, 06:00')
+
+    assert schedule == [datetime.time(6, 0), datetime.time(18, 20)]
+    assert runner.next_trigger(datetime.datetime(2023, 6, 1, 7, 0), schedule) == datetime.datetime(2023, 6, 1, 18, 20)
+    assert runner.next_trigger(datetime.datetime(2023, 6, 1, 18, 20), schedule) == datetime.datetime(2023, 6, 2, 6, 0)
+
+
+def test_metrics_of_the_crawls_are_served():
+    registry = metrics.Registry()
+    registry.inc('scrapers_responses_total', airline='RyanAir', status=200)
+    request = requesthelper.DummyRequest([b'metrics'])
+
+    body = runner.MetricsResource(registry).render_GET(request)
+
+    assert request.responseHeaders.getRawHeaders(b'Content-Type') == [b'text/plain; version=0.0.4']
+    assert 'scrapers_responses_total{airline="RyanAir",status="200"} 1' in body.decode().splitlines()
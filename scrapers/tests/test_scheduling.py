@@ -0,0 +1,48 @@
+import datetime
+
+from scrapy import http
+
+from scrapers import airline_route, items, middlewares, fare_index, route_history, settings
+from scrapers.spiders import RyanAir
+
+
+def test_requests_are_scheduled_by_priority(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'ROUTE_HISTORY_PATH', str(tmp_path / 'history.sqlite'))
+    today = datetime.date.today()
+
+    history = route_history.RouteHistory(settings.ROUTE_HISTORY_PATH)
+    # Scraped today and its prices never change
+    history.record(airline_route.RouteWindow('RyanAir', 'BSL', 'AMS', today, today), 10, 0, today)
+    history.record(airline_route.RouteWindow('RyanAir', 'BSL', 'AMS', today, today), 10, 0, today)
+    history.close()
+
+    spider = RyanAir.RyanairSpider()
+    spider.routes = [airline_route.Route('BSL', 'AMS')]
+    requests = list(spider.start_requests())
+    windows = [request.meta['route_window'] for request in requests]
+
+    assert len(requests) == 2 * len({window.start for window in windows})
+    assert [request.priority for request in requests] == sorted((request.priority for request in requests), reverse=True)
+    # The return route was never scraped, so it goes first
+    assert (windows[0].source, windows[0].start) == ('AMS', today)
+    assert windows[-1].start == max(window.start for window in windows)
+
+
+def test_route_history_records_changed_fares(tmp_path):
+    history = route_history.RouteHistory(str(tmp_path / 'history.sqlite'))
+    middleware = middlewares.RouteHistoryMiddleware(history, fare_index.FareIndex(str(tmp_path / 'fares.sqlite')))
+    window = airline_route.RouteWindow('RyanAir', 'BSL', 'AMS', datetime.date(2023, 7, 1), datetime.date(2023, 7, 2))
+    request = http.Request('https://www.ryanair.com/', meta={'route_window': window})
+    response = http.Response(request.url, request=request)
+
+    def crawl(*prices):
+        fares = [
+            items.FareRecord(f'2023-07-0{day}', 'BSL', 'AMS', price, 'EUR', 'RyanAir', '2023-06-01')
+            for day, price in enumerate(prices, start=1)
+        ]
+        assert list(middleware.process_spider_output(response, iter(fares), None)) == fares
+
+        return history.routes('RyanAir')[('BSL', 'AMS')].volatility
+
+    assert crawl(10, 20) == 1
+    assert crawl(10, 25) == 1 * (1 - route_history.VOLATILITY_SMOOTHING) + 0.5 * route_history.VOLATILITY_SMOOTHING
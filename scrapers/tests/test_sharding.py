@@ -0,0 +1,34 @@
+import itertools
+
+from scrapers import airline_route, rate_control, sharding
+
+ROUTES = [
+    airline_route.Route(source, destination)
+    for source, destination in itertools.permutations([f'A{i:02d}' for i in range(40)], 2)
+]
+
+
+def test_routes_are_split_evenly_and_move_little_when_adding_a_shard():
+    owners = {route.key(): sharding.shard_of('WizzAir', route, 4) for route in ROUTES}
+    shards = [sharding.routes_of(sharding.Shard(index, 4), 'WizzAir', ROUTES) for index in range(4)]
+
+    # Every route is crawled by a single shard
+    assert sorted(route.key() for shard in shards for route in shard) == sorted(owners)
+    assert all(0.15 < len(shard) / len(ROUTES) < 0.35 for shard in shards)
+
+    moved = [route for route in ROUTES if sharding.shard_of('WizzAir', route, 5) != owners[route.key()]]
+
+    # Only to the new shard, about a fifth of them
+    assert {sharding.shard_of('WizzAir', route, 5) for route in moved} == {4}
+    assert len(moved) / len(ROUTES) < 0.3
+
+
+def test_shards_share_the_rate_budget_of_the_airline():
+    limits = rate_control.RateLimits(
+        min_delay=0.25, max_delay=100, max_concurrency=16, delay_step=1, increase_every=10, target_latency=10
+    )
+    assert rate_control.shard_budget(limits, rate_control.Rate(8, 1), 4) == (
+        limits._replace(min_delay=1, max_concurrency=4, delay_step=4), rate_control.Rate(2, 4)
+    )
+    assert rate_control.shard_budget(limits, rate_control.Rate(8, 1), 1) == (limits, rate_control.Rate(8, 1))
+    assert sharding.Shard.parse('3/4') == sharding.Shard(3, 4)
@@ -0,0 +1,118 @@
+import datetime
+import struct
+import types
+
+import pytest
+
+from twisted.internet import defer
+
+from scrapers import items, pipelines, sinks
+
+
+def fare(**overrides) -> items.FareRecord:
+    fields = {
+        'flight_date': '2023-07-01T06:10:00',
+        'source': 'BUD',
+        'destination': 'BSL',
+        'price': 18990,
+        'currency': 'HUF',
+        'company': 'WizzAir',
+        'scrape_date': '2023-06-01',
+        'price_eur': 49.5,
+    }
+    fields.update(overrides)
+
+    return items.FareRecord(**fields)
+
+
+def test_row_binary_encoding():
+    encoded = sinks.RowBinaryEncoder().encode([fare(), fare(flight_date='2023-07-02', price_eur=None)])
+
+    assert encoded == (
+        struct.pack('<I', 1688191800) + b'\x03BUD' + b'\x03BSL' + struct.pack('<f', 18990)
+        + b'\x00' + struct.pack('<f', 49.5) + b'\x03HUF' + b'\x07WizzAir' + struct.pack('<H', 19509)
+        + struct.pack('<I', 1688256000) + b'\x03BUD' + b'\x03BSL' + struct.pack('<f', 18990)
+        + b'\x01' + b'\x03HUF' + b'\x07WizzAir' + struct.pack('<H', 19509)
+    )
+    # Local times of the server's timezone, like the text formats
+    assert sinks.RowBinaryEncoder('Europe/Budapest').encode([fare()])[:4] == struct.pack('<I', 1688184600)
+    # Lengths are varints
+    assert sinks._row_binary_string('x' * 200)[:2] == b'\xc8\x01'
+
+
+class FakeSink(sinks.Sink):
+    def __init__(self):
+        self.batches = []
+        self.closed = False
+
+    def write(self, records):
+        self.batches.append([record.price for record in records])
+
+    def close(self):
+        self.closed = True
+
+
+def test_batches_are_written_one_at_a_time():
+    sink = FakeSink()
+    writes = []
+
+    def run_in_thread(f, *args):
+        # Written once the test says so
+        d = defer.Deferred()
+        d.addCallback(lambda _: f(*args))
+        writes.append(d)
+
+        return d
+
+    pipeline = pipelines.BulkSinkPipeline('clickhouse', {}, 2, sink_factory=lambda _spider: sink,
+                                          run_in_thread=run_in_thread)
+    spider = types.SimpleNamespace(name='test')
+    pipeline.open_spider(spider)
+    results = [pipeline.process_item(fare(price=price), spider) for price in range(5)]
+
+    # The first batch is being written, the crawl waits for it once the second one is full
+    assert [type(result) for result in results] == [
+        items.FareRecord, defer.Deferred, items.FareRecord, defer.Deferred, items.FareRecord
+    ]
+    assert results[1].called and not results[3].called
+    assert len(writes) == 1
+
+    writes[0].callback(None)
+    assert results[3].called and results[3].result.price == 3
+    assert len(writes) == 2
+
+    closed = pipeline.close_spider(spider)
+    assert not closed.called
+
+    writes[1].callback(None)
+    writes[2].callback(None)
+    assert closed.called and sink.closed
+    assert sink.batches == [[0, 1], [2, 3], [4]]
+    assert (pipeline.written, pipeline.failed) == (5, 0)
+
+
+def test_file_sinks_write_a_batch_per_row_group(tmp_path):
+    pyarrow = pytest.importorskip('pyarrow')
+    from pyarrow import ipc, parquet
+
+    started = datetime.datetime(2023, 6, 1, 18, 20)
+    records = [fare(), fare(flight_date='2023-07-02', price_eur=None)]
+
+    for sink_class in [sinks.ParquetSink, sinks.ArrowSink]:
+        sink = sink_class(str(tmp_path), 'WizzAir', started)
+        sink.write(records)
+        sink.write([fare(source='GVA', destination='OTP', currency='EUR')])
+        assert not (tmp_path / f'WizzAir-20230601T182000.{sink_class.EXTENSION}').exists()
+        sink.close()
+
+        if sink_class is sinks.ParquetSink:
+            assert parquet.ParquetFile(sink.path).num_row_groups == 2
+            table = parquet.read_table(sink.path)
+        else:
+            table = ipc.open_file(sink.path).read_all()
+
+        assert table.column_names == sinks.COLUMNS
+        assert table.column('price_eur').to_pylist() == [49.5, None, 49.5]
+        assert table.column('source').to_pylist() == ['BUD', 'BUD', 'GVA']
+        assert table.column('flight_date').to_pylist()[1] == datetime.datetime(2023, 7, 2)
+        assert table.column('scrape_date').type == pyarrow.date32()
@@ -0,0 +1,139 @@
+import os
+import types
+
+import pytest
+
+from benchmarks import stand_in_broker
+
+os.environ.setdefault('KAFKA_TOPIC', 'flights')
+os.environ.setdefault('KAFKA_BOOTSTRAP_BROKERS', 'stand-in:9092')
+
+from scrapers import pipelines, spool  # noqa: E402
+
+
+def test_spool_survives_reopening(tmp_path):
+    outbox = spool.Spool(str(tmp_path), segment_size=256)
+
+    for i in range(20):
+        outbox.append(f'record-{i:02d}'.encode(), key=b'GVA-OTP' if i % 2 else None)
+
+    # Small segments, so the records were spread over several of them
+    assert len(outbox.segments) > 1
+
+    records = outbox.read(5)
+    outbox.commit(records[-1].next_position)
+    outbox.close()
+
+    reopened = spool.Spool(str(tmp_path), segment_size=256)
+    records = reopened.read(100)
+
+    assert [record.value for record in records] == [f'record-{i:02d}'.encode() for i in range(5, 20)]
+    assert [record.key for record in records[:2]] == [b'GVA-OTP', None]
+
+    reopened.commit(records[-1].next_position)
+
+    assert reopened.pending_bytes() == 0
+    assert len(reopened.segments) == 1
+
+
+def test_torn_record_is_dropped(tmp_path):
+    outbox = spool.Spool(str(tmp_path))
+    outbox.append(b'complete')
+    outbox.append(b'torn')
+    segment = outbox.active
+    # Corrupt the last byte of the second record, as if the crawl died while writing it
+    segment.map[segment.write_offset - 1] ^= 0xFF
+    outbox.close()
+
+    reopened = spool.Spool(str(tmp_path))
+    assert [record.value for record in reopened.read(100)] == [b'complete']
+
+    # New records are appended over the torn one
+    reopened.append(b'after')
+    assert [record.value for record in reopened.read(100)] == [b'complete', b'after']
+
+
+def test_drainer_retries_until_the_broker_accepts(tmp_path):
+    broker = stand_in_broker.StandInBroker(failure_rate=1.0)
+    outbox = spool.Spool(str(tmp_path))
+    drainer = spool.SpoolDrainer(
+        outbox,
+        'flights',
+        producer_factory=lambda: stand_in_broker.StandInProducer(broker),
+        min_backoff=0.01,
+    )
+
+    for i in range(10):
+        outbox.append(f'{i}'.encode())
+
+    drainer.start()
+    assert outbox.wait_drained(0.2) is False
+
+    broker.failure_rate = 0
+    assert drainer.stop(5) is True
+    assert broker.values('flights') == [f'{i}'.encode() for i in range(10)]
+
+
+def test_pipeline_spools_while_the_broker_is_down(tmp_path):
+    broker = stand_in_broker.StandInBroker()
+    broker_down = True
+
+    def producer_factory(**configs):
+        if broker_down:
+            raise ConnectionError('broker is down')
+
+        return stand_in_broker.StandInProducer(broker, **configs)
+
+    spider = types.SimpleNamespace(name='test')
+
+    for crawl in range(2):
+        # The first crawl never reaches the broker
+        broker_down = crawl == 0
+        pipeline = pipelines.AirlineScraperPipeline(
+            producer_factory=producer_factory,
+            spool_config={'directory': str(tmp_path), 'segment_size': 1024 * 1024, 'drain_timeout': 1},
+        )
+        pipeline.open_spider(spider)
+        pipeline.process_item({'crawl': crawl}, spider)
+        pipeline.close_spider(spider)
+
+    # The second crawl delivered what the first one spooled
+    assert broker.values(os.environ['KAFKA_TOPIC']) == [b'{"crawl":0}', b'{"crawl":1}']
+    assert pipeline.delivered == 2
+
+
+def test_concurrent_spiders_spool_apart(tmp_path):
+    broker = stand_in_broker.StandInBroker()
+    spiders = [types.SimpleNamespace(name='RyanAir'), types.SimpleNamespace(name='WizzAir')]
+    crawls = [
+        pipelines.AirlineScraperPipeline(
+            producer_factory=lambda **configs: stand_in_broker.StandInProducer(broker, **configs),
+            spool_config={'directory': str(tmp_path), 'segment_size': 1024, 'drain_timeout': 5},
+        )
+        for _ in spiders
+    ]
+
+    for pipeline, spider in zip(crawls, spiders):
+        pipeline.open_spider(spider)
+
+    for i in range(50):
+        for pipeline, spider in zip(crawls, spiders):
+            pipeline.process_item({'spider': spider.name, 'i': i}, spider)
+
+    for pipeline, spider in zip(crawls, spiders):
+        pipeline.close_spider(spider)
+
+    delivered = sorted(broker.values(os.environ['KAFKA_TOPIC']))
+    assert delivered == sorted(
+        f'{{"spider":"{spider.name}","i":{i}}}'.encode() for spider in spiders for i in range(50)
+    )
+    assert [pipeline.delivered for pipeline in crawls] == [50, 50]
+
+    # Another process crawling the same spider cannot spool there until the first one is done
+    outbox = spool.Spool(str(tmp_path / 'WizzAir'))
+
+    with pytest.raises(spool.SpoolLocked):
+        spool.Spool(str(tmp_path / 'WizzAir'))
+
+    outbox.close()
+    spool.Spool(str(tmp_path / 'WizzAir')).close()
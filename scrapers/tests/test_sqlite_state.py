@@ -0,0 +1,31 @@
+import datetime
+import os
+
+import pytest
+
+from scrapers import airline_route, route_history, sqlite_state
+
+TODAY = datetime.date(2023, 7, 1)
+
+
+def test_stores_of_the_same_file_share_its_connection(tmp_path):
+    path = str(tmp_path / 'history.sqlite')
+    wizzair = route_history.RouteHistory(path)
+    ryanair = route_history.RouteHistory(path)
+
+    # Neither commits, separate connections would lock each other out
+    wizzair.record(airline_route.RouteWindow('WizzAir', 'GVA', 'OTP', TODAY, TODAY), 10, 5, TODAY)
+    ryanair.record(airline_route.RouteWindow('RyanAir', 'OTP', 'AMM', TODAY, TODAY), 10, 0, TODAY)
+
+    wizzair.close()
+    assert list(ryanair.routes('WizzAir')) == [('GVA', 'OTP')]
+
+    ryanair.close()
+
+    with pytest.raises(Exception):
+        ryanair.connection.execute('SELECT 1')
+
+    reopened = route_history.RouteHistory(path)
+    assert sorted(reopened.routes('WizzAir')) + sorted(reopened.routes('RyanAir')) == [('GVA', 'OTP'), ('OTP', 'AMM')]
+    reopened.close()
+    assert os.path.abspath(path) not in sqlite_state._connections
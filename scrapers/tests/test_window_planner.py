@@ -0,0 +1,90 @@
+import datetime
+import json
+import types
+
+from scrapy import http
+from scrapy.settings import Settings
+from scrapy.statscollectors import MemoryStatsCollector
+
+from benchmarks import mock_airlines
+from scrapers import airline_route, middlewares, response_cache, settings, window_planner
+from scrapers.spiders import RyanAir
+
+TODAY = datetime.date(2023, 7, 1)
+
+
+def test_planner_probes_up_then_settles_on_the_days_clipped_responses_cover(tmp_path):
+    store = window_planner.WindowStore(str(tmp_path / 'window_planner.json'))
+
+    planner = window_planner.WindowPlanner(store.get('RyanAir'), 30, 90)
+    assert planner.size(TODAY) == 60
+    # The API answers 35 days at most
+    planner.on_full(25)
+    planner.on_clipped(60, 35)
+    store.put('RyanAir', planner.learnt(TODAY))
+
+    # Crawls resumed the same day keep the windows of the crawl they resume
+    assert window_planner.WindowPlanner(store.get('RyanAir'), 30, 90).size(TODAY) == 60
+    planner = window_planner.WindowPlanner(store.get('RyanAir'), 30, 90)
+    tomorrow = TODAY + datetime.timedelta(days=1)
+    assert planner.size(tomorrow) == 35
+
+    planner.on_full(35)
+    store.put('RyanAir', planner.learnt(tomorrow))
+    assert store.get('RyanAir') == window_planner.WindowLimit(35, 36, 35, tomorrow)
+
+
+def test_days_missing_from_clipped_responses_are_requested(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'ROUTES_FILE', str(tmp_path / 'missing.json'))
+    spider = RyanAir.RyanairSpider()
+    stats = MemoryStatsCollector(types.SimpleNamespace(settings=Settings()))
+    middleware = middlewares.WindowPlannerMiddleware(
+        window_planner.WindowStore(str(tmp_path / 'window_planner.json')), stats
+    )
+    middleware.spider_opened(spider)
+
+    route = airline_route.Route('BSL', 'AMS')
+    request = spider.prepare_request(route, TODAY, TODAY + spider.window_size - datetime.timedelta(days=1))[0]
+    request.priority = 700
+    body = mock_airlines.ryanair_cheapest_per_day('BSL', 'AMS', TODAY, TODAY + datetime.timedelta(days=34))
+    response = http.TextResponse(request.url, body=json.dumps(body).encode(), request=request, encoding='utf-8')
+
+    output = list(middleware.process_spider_output(response, spider.parse(response), spider))
+    tail = [i for i in output if isinstance(i, http.Request)]
+
+    assert len(output) - len(tail) == sum(1 for fare in body['outbound']['fares'] if not fare['unavailable'])
+    assert [(r.meta['route_window'].start, r.meta['route_window'].end, r.priority) for r in tail] == [
+        (datetime.date(2023, 8, 5), datetime.date(2023, 8, 29), 700)
+    ]
+    assert middleware.planner.learnt(TODAY).clipped == 36
+
+
+def test_days_missing_from_unchanged_responses_are_requested(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'ROUTES_FILE', str(tmp_path / 'missing.json'))
+    spider = RyanAir.RyanairSpider()
+    stats = MemoryStatsCollector(types.SimpleNamespace(settings=Settings()))
+    planner = middlewares.WindowPlannerMiddleware(
+        window_planner.WindowStore(str(tmp_path / 'window_planner.json')), stats
+    )
+    planner.spider_opened(spider)
+    cache = middlewares.ResponseCacheMiddleware(
+        response_cache.ResponseCache(str(tmp_path / 'cache.sqlite'), datetime.timedelta(days=7)), stats
+    )
+
+    route = airline_route.Route('BSL', 'AMS')
+    body = mock_airlines.ryanair_cheapest_per_day('BSL', 'AMS', TODAY, TODAY + datetime.timedelta(days=34))
+    outputs = []
+
+    for _ in range(2):
+        request = spider.prepare_request(route, TODAY, TODAY + spider.window_size - datetime.timedelta(days=1))[0]
+        response = http.TextResponse(request.url, body=json.dumps(body).encode(), request=request, encoding='utf-8')
+        # In the order of `SPIDER_MIDDLEWARES`, the cache is the closest to the spider
+        output = planner.process_spider_output(
+            response, cache.process_spider_output(response, spider.parse(response), spider), spider
+        )
+        outputs.append([i.meta['route_window'].start if isinstance(i, http.Request) else i for i in output])
+
+    split = datetime.date(2023, 8, 5)
+    assert split in outputs[0] and len(outputs[0]) > 1
+    # The unchanged response is not parsed again, the days missing from it still are requested
+    assert outputs[1] == [split]
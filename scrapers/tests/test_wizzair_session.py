@@ -0,0 +1,77 @@
+import datetime
+
+import scrapy
+
+from scrapy import http
+from twisted.internet import defer
+
+from scrapers import wizzair_session
+
+BUILD_NUMBER_URL = 'https://wizzair.com/buildnumber'
+TIMETABLE_URL = 'https://be.wizzair.com/{}/Api/search/timetable'
+
+
+def session_at(tmp_path, default_version: str = '19.1.0') -> wizzair_session.WizzAirSession:
+    store = wizzair_session.VersionStore(str(tmp_path / 'wizzair_session.json'))
+    return wizzair_session.WizzAirSession(store, BUILD_NUMBER_URL, default_version, datetime.timedelta(days=1))
+
+
+def prepared(d) -> list:
+    results = []
+    d.addCallback(results.append)
+    return results
+
+
+def build_number(version: str):
+    def download(request):
+        return defer.succeed(
+            http.TextResponse(request.url, body=f'SSR 20230712.1 https://be.wizzair.com/{version}'.encode())
+        )
+
+    return download
+
+
+def token_response(request, token: str, status: int = 200) -> http.Response:
+    return http.TextResponse(
+        request.url, status=status, body=b'{}', headers={'Set-Cookie': f'RequestVerificationToken={token}; path=/'}
+    )
+
+
+def test_requests_wait_for_the_version_and_the_token(tmp_path):
+    session = session_at(tmp_path)
+    first, second = (scrapy.Request(TIMETABLE_URL.format('19.1.0'), method='POST') for _ in range(2))
+
+    # Both were built under the old version, they are scheduled again under the current one
+    download = build_number('20.3.0')
+    first_result = prepared(session.prepare(first, download))
+    second_result = prepared(session.prepare(second, download))
+    assert [r.url for r in first_result + second_result] == [TIMETABLE_URL.format('20.3.0')] * 2
+
+    first, second = first_result[0], second_result[0]
+
+    # The first one warms the session up alone
+    first_result = prepared(session.prepare(first, None))
+    second_result = prepared(session.prepare(second, None))
+    assert first_result == [None] and second_result == []
+
+    assert session.on_response(first, token_response(first, 'abc')).status == 200
+    assert second_result == [None] and second.headers[wizzair_session.TOKEN_HEADER] == b'abc'
+
+    # The version found is kept for the next crawls
+    assert session_at(tmp_path).version == '20.3.0' and session_at(tmp_path).discovered
+
+
+def test_version_is_looked_up_again_on_404s(tmp_path):
+    session = session_at(tmp_path)
+    session.state = wizzair_session.READY
+    request = scrapy.Request(TIMETABLE_URL.format('19.1.0'), method='POST')
+
+    retried = session.on_response(request, token_response(request, 'abc', status=404))
+    assert isinstance(retried, scrapy.Request) and session.state == wizzair_session.NEW
+
+    result = prepared(session.prepare(retried, build_number('20.3.0')))
+    assert result[0].url == TIMETABLE_URL.format('20.3.0')
+
+    # Sent only once again, the next 404 goes to the spider
+    response = token_response(retried, 'abc', status=404)
+    assert session.on_response(result[0], response) is response